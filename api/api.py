@@ -1,10 +1,23 @@
 from io import BytesIO
 import tarfile
 import json
+from celery.exceptions import TimeoutError as CeleryTimeoutError
 from flask import Flask, request, send_file, Response
+from geocruncher.serialization import JSON_MIMETYPE, BINARY_MIMETYPE, dumps_binary, dumps_json
 from .redis import redis_client as r
-from .utils import generate_key, parse_metadata_from_request
+from .utils import generate_key, parse_metadata_from_request, parse_mesh_format_from_request
 from . import tasks
+from .intersections import (
+    FIELDS as INTERSECTIONS_FIELDS,
+    get_sections,
+    load_result,
+    read_stream,
+    release_result,
+    validate_data as validate_intersections_data,
+)
+from .projects import has_project, load_project, store_project
+from .sessions import IDLE_TIMEOUT as SESSION_IDLE_TIMEOUT, close_session, get_session, open_session
+from .pipeline import start_pipeline, get_pipeline, delete_pipeline, pipeline_state, revoke_pipeline
 from .celery import app as celery
 
 app = Flask(__name__)
@@ -26,7 +39,10 @@ def compute_meshes_or_faults(is_meshes: bool):
         # TODO: validate data
         data = json.loads(request.form['data'])
         metadata = parse_metadata_from_request()
-        
+        mesh_format = parse_mesh_format_from_request()
+        if mesh_format is None:
+            return Response("Invalid parameter meshFormat", 400, mimetype="text/plain")
+
         # TODO: check files exists
         xml = request.files.get('xml').read()
         dem = request.files.get('dem').read()
@@ -36,7 +52,7 @@ def compute_meshes_or_faults(is_meshes: bool):
         r.set(dem_key, dem)
         output_key = generate_key()
         res = (tasks.compute_meshes if is_meshes else tasks.compute_faults).delay(
-            data, xml_key, dem_key, output_key, metadata)
+            data, xml_key, dem_key, output_key, metadata, mesh_format)
         return Response(res.id, 202, mimetype="text/plain")
 
     elif request.method == 'GET':
@@ -63,9 +79,12 @@ def compute_tunnel_meshes():
         # TODO: validate data
         data = json.loads(request.form['data'])
         metadata = parse_metadata_from_request()
-        
+        mesh_format = parse_mesh_format_from_request()
+        if mesh_format is None:
+            return Response("Invalid parameter meshFormat", 400, mimetype="text/plain")
+
         output_key = generate_key()
-        res = tasks.compute_tunnel_meshes.delay(data, output_key, metadata)
+        res = tasks.compute_tunnel_meshes.delay(data, output_key, metadata, mesh_format)
         return Response(res.id, 202, mimetype="text/plain")
 
     elif request.method == 'GET':
@@ -91,17 +110,32 @@ def compute_meshes():
     return compute_meshes_or_faults(True)
 
 
-@app.route("/compute/intersections", methods=['POST', 'GET'])
+@app.route("/compute/intersections", methods=['POST', 'GET', 'DELETE'])
 def compute_intersections():
     if request.method == 'POST':
         # when files are uploaded, we receive a multipart/form-data. The JSON data is encoded in the data form field
         # TODO: validate data
         data = json.loads(request.form['data'])
+        error = validate_intersections_data(data)
+        if error is not None:
+            return Response(error, 400, mimetype="text/plain")
         metadata = parse_metadata_from_request()
-        
-        # TODO: check files exists
-        xml = request.files.get('xml').read()
-        dem = request.files.get('dem').read()
+
+        # in a session, the project is the one of the session and the computation runs where its model is loaded
+        session = None
+        session_id = request.form.get('session') or None
+        if session_id is not None:
+            session = get_session(session_id)
+            if session is None:
+                return Response("Unknown session, it may have expired", 404, mimetype="text/plain")
+            try:
+                xml, dem = load_project(session['project'])
+            except ValueError as error:
+                return Response(str(error), 404, mimetype="text/plain")
+        else:
+            # TODO: check files exists
+            xml = request.files.get('xml').read()
+            dem = request.files.get('dem').read()
         xml_key = generate_key()
         dem_key = generate_key()
         r.set(xml_key, xml)
@@ -114,26 +148,94 @@ def compute_intersections():
                 continue
             r.hset(gwb_meshes_key, key, value.read())
         output_key = generate_key()
+        # publish each section as soon as it is computed, see /compute/intersections/stream
+        stream = request.form.get('stream', 'false').lower() == 'true'
 
-        res = tasks.compute_intersections.delay(
-            data, xml_key, dem_key, gwb_meshes_key, output_key, metadata)
+        options = {'queue': session['queue']} if session is not None else {}
+        res = tasks.compute_intersections.apply_async(
+            (data, xml_key, dem_key, gwb_meshes_key, output_key, metadata, stream, session_id), **options)
         return Response(res.id, 202, mimetype="text/plain")
 
-    elif request.method == 'GET':
-        _id = request.args.get('id')
-        if _id is None or _id == '':
-            return Response("Missing parameter id", 400, mimetype="text/plain")
-        res = celery.AsyncResult(_id)
-        if res.state != 'SUCCESS':
-            return Response(res.state, mimetype="text/plain")
-        # TODO: catch errors
-        output_key = res.get()
-        output = r.get(output_key)
-        r.delete(output_key)
-        if not output:
-            return Response('', 204, mimetype="text/plain")
-
-        return Response(output.decode('utf-8'), mimetype="application/json")
+    _id = request.args.get('id')
+    if _id is None or _id == '':
+        return Response("Missing parameter id", 400, mimetype="text/plain")
+    res = celery.AsyncResult(_id)
+    if res.state != 'SUCCESS':
+        return Response(res.state, mimetype="text/plain")
+    # TODO: catch errors
+    output_key = res.get()
+
+    if request.method == 'DELETE':
+        release_result(output_key, _id)
+        return Response(f"Task {_id} released", 200, mimetype="text/plain")
+
+    stored_sections = get_sections(output_key)
+    if stored_sections is None:
+        return Response('', 204, mimetype="text/plain")
+
+    # optional comma separated filters, every section and field by default
+    sections = request.args.get('sections')
+    sections = sections.split(',') if sections else stored_sections
+    unknown_sections = [section for section in sections if section not in stored_sections]
+    if unknown_sections:
+        return Response(f"Unknown sections {','.join(unknown_sections)}", 400, mimetype="text/plain")
+    fields = request.args.get('fields')
+    fields = fields.split(',') if fields else None
+    if fields is not None and any(field not in INTERSECTIONS_FIELDS for field in fields):
+        return Response(f"Fields must be among {','.join(INTERSECTIONS_FIELDS)}", 400, mimetype="text/plain")
+    result = load_result(output_key, sections, fields)
+
+    # JSON unless the client prefers the binary format, which keeps grids as typed arrays
+    mimetype = request.accept_mimetypes.best_match([JSON_MIMETYPE, BINARY_MIMETYPE], JSON_MIMETYPE)
+    if mimetype == BINARY_MIMETYPE:
+        return Response(dumps_binary(result), mimetype=BINARY_MIMETYPE)
+    return Response(dumps_json(result), mimetype=JSON_MIMETYPE)
+
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+SSE_MIMETYPE = "text/event-stream"
+# how long a stream read waits for new sections before checking the task state, in milliseconds
+STREAM_BLOCK_MS = 5000
+# empty reads after which a stream still PENDING is ended, since unknown task IDs are PENDING forever. Clients can
+# reconnect if their task is only waiting in the queue
+STREAM_MAX_PENDING_READS = 12
+
+
+@app.get("/compute/intersections/stream")
+def stream_intersections():
+    """Forward the sections of a streaming intersections computation as they are computed, as NDJSON or server-sent
+    events. Each message is either a section {"section": ID, **fields} or a last {"end": task state}"""
+    _id = request.args.get('id')
+    if _id is None or _id == '':
+        return Response("Missing parameter id", 400, mimetype="text/plain")
+    mimetype = request.accept_mimetypes.best_match([NDJSON_MIMETYPE, SSE_MIMETYPE], NDJSON_MIMETYPE)
+
+    def format_message(message: dict) -> bytes:
+        data = dumps_json(message)
+        return b"data: " + data + b"\n\n" if mimetype == SSE_MIMETYPE else data + b"\n"
+
+    def generate():
+        last_id = '0'
+        is_done = False
+        num_pending_reads = 0
+        while True:
+            # read once more without waiting after the task is done, sections may have been published since
+            entries = read_stream(_id, last_id, None if is_done else STREAM_BLOCK_MS)
+            for entry_id, message in entries:
+                last_id = entry_id
+                yield format_message(message)
+                if "end" in message:
+                    return
+            if is_done:
+                # the task was revoked, or was not streaming
+                yield format_message({"end": state})
+                return
+            if not entries:
+                state = celery.AsyncResult(_id).state
+                num_pending_reads = num_pending_reads + 1 if state == 'PENDING' else 0
+                is_done = state in ['SUCCESS', 'FAILURE', 'REVOKED'] or num_pending_reads >= STREAM_MAX_PENDING_READS
+
+    return Response(generate(), mimetype=mimetype)
 
 
 @app.route("/compute/faults", methods=['POST', 'GET'])
@@ -191,6 +293,9 @@ def compute_gwb_meshes():
         # TODO: validate data
         data = json.loads(request.form['data'])
         metadata = parse_metadata_from_request()
+        mesh_format = parse_mesh_format_from_request()
+        if mesh_format is None:
+            return Response("Invalid parameter meshFormat", 400, mimetype="text/plain")
 
         meshes_key = generate_key()
         for key, value in request.files.items():
@@ -198,7 +303,10 @@ def compute_gwb_meshes():
             r.hset(meshes_key, key, value.read())
         output_key = generate_key()
 
-        res = tasks.compute_gwb_meshes.delay(data, meshes_key, output_key, metadata)
+        # reuse the results of unchanged springs above the first changed one
+        incremental = request.form.get('incremental', 'false').lower() == 'true'
+
+        res = tasks.compute_gwb_meshes.delay(data, meshes_key, output_key, metadata, mesh_format, incremental)
         return Response(res.id, 202, mimetype="text/plain")
 
     elif request.method == 'GET':
@@ -219,12 +327,160 @@ def compute_gwb_meshes():
         return send_file(output, mimetype="application/x-tar", as_attachment=True, download_name="gwb_meshes.tar")
 
 
+@app.route("/compute/pipeline", methods=['POST', 'GET'])
+def compute_pipeline():
+    if request.method == 'POST':
+        # when files are uploaded, we receive a multipart/form-data. The JSON data is encoded in the data form field
+        # TODO: validate data
+        data = json.loads(request.form['data'])
+        if 'meshes' not in data:
+            return Response("Missing meshes in data", 400, mimetype="text/plain")
+        error = validate_intersections_data(data['intersections']) if 'intersections' in data else None
+        if error is not None:
+            return Response(error, 400, mimetype="text/plain")
+        metadata = parse_metadata_from_request()
+        mesh_format = parse_mesh_format_from_request()
+        if mesh_format is None:
+            return Response("Invalid parameter meshFormat", 400, mimetype="text/plain")
+
+        # TODO: check files exists
+        xml = request.files.get('xml').read()
+        dem = request.files.get('dem').read()
+        pipeline_id = start_pipeline(data, xml, dem, metadata, mesh_format)
+        return Response(pipeline_id, 202, mimetype="text/plain")
+
+    elif request.method == 'GET':
+        _id = request.args.get('id')
+        if _id is None or _id == '':
+            return Response("Missing parameter id", 400, mimetype="text/plain")
+        record = get_pipeline(_id)
+        if record is None:
+            return Response(f"Unknown pipeline {_id}", 404, mimetype="text/plain")
+        state = pipeline_state(record)
+        if state != 'SUCCESS':
+            return Response(state, mimetype="text/plain")
+
+        # every product in a single tar, meshes in folders
+        files = {}
+        outputs = record["outputs"]
+        for product in ['meshes', 'gwb_meshes']:
+            if product in outputs:
+                for name, value in r.hgetall(outputs[product]).items():
+                    files[f"{product}/".encode('utf-8') + name] = value
+        if 'intersections' in outputs:
+            sections = get_sections(outputs['intersections'])
+            files[b"intersections.json"] = dumps_json(
+                load_result(outputs['intersections'], sections)) if sections is not None else b''
+        if 'voxels' in outputs:
+            files[b"voxels.vox"] = r.get(outputs['voxels']) or b''
+        r.delete(*outputs.values())
+        delete_pipeline(_id)
+
+        output = filemap_to_tar(files)
+        return send_file(output, mimetype="application/x-tar", as_attachment=True, download_name="pipeline.tar")
+
+
+# how long a points query waits for its result before returning the task ID to poll, in seconds
+QUERY_TIMEOUT = 10
+
+
+def query_failure(res) -> Response:
+    """Response to a failed points query. Invalid queries, such as unknown faults or expired projects, raise a
+    ValueError and get a 400"""
+    if isinstance(res.result, ValueError):
+        return Response(str(res.result), 400, mimetype="text/plain")
+    return Response(res.state, 500, mimetype="text/plain")
+
+
+@app.route("/query/points", methods=['POST', 'GET'])
+def query_points():
+    if request.method == 'POST':
+        # TODO: validate data
+        data = json.loads(request.form['data'])
+        metadata = parse_metadata_from_request()
+
+        # the project is uploaded once, later queries only give its hash, or the session opened on it
+        options = {}
+        session_id = request.form.get('session') or None
+        if session_id is not None:
+            session = get_session(session_id)
+            if session is None:
+                return Response("Unknown session, it may have expired", 404, mimetype="text/plain")
+            project_hash = session['project']
+            options['queue'] = session['queue']
+        elif 'xml' in request.files and 'dem' in request.files:
+            project_hash = store_project(request.files.get('xml').read(), request.files.get('dem').read())
+        else:
+            project_hash = request.form.get('project')
+            if not project_hash or not has_project(project_hash):
+                return Response("Unknown project, upload the xml and dem files", 400, mimetype="text/plain")
+
+        res = tasks.query_points.apply_async((data, project_hash, metadata, session_id), **options)
+        try:
+            result = res.get(timeout=QUERY_TIMEOUT, propagate=False)
+        except CeleryTimeoutError:
+            return Response(res.id, 202, mimetype="text/plain")
+        if res.failed():
+            return query_failure(res)
+        return Response(dumps_json(dict(result, project=project_hash)), mimetype=JSON_MIMETYPE)
+
+    elif request.method == 'GET':
+        _id = request.args.get('id')
+        if _id is None or _id == '':
+            return Response("Missing parameter id", 400, mimetype="text/plain")
+        res = celery.AsyncResult(_id)
+        if res.failed():
+            return query_failure(res)
+        if res.state != 'SUCCESS':
+            return Response(res.state, mimetype="text/plain")
+        return Response(dumps_json(res.get()), mimetype=JSON_MIMETYPE)
+
+
+@app.route("/sessions", methods=['POST', 'DELETE'])
+def sessions():
+    """Open a session on a project, so that its points queries and intersections run on a worker keeping its model
+    loaded, or close it"""
+    if request.method == 'POST':
+        if 'xml' in request.files and 'dem' in request.files:
+            project_hash = store_project(request.files.get('xml').read(), request.files.get('dem').read())
+        else:
+            project_hash = request.form.get('project')
+            if not project_hash or not has_project(project_hash):
+                return Response("Unknown project, upload the xml and dem files", 400, mimetype="text/plain")
+
+        session_id = open_session(project_hash)
+        if session_id is None:
+            return Response("No session worker available", 503, mimetype="text/plain")
+        session = get_session(session_id)
+        # the model is loaded ahead of the first request, and released once the session is closed or idle
+        tasks.open_session_model.apply_async((session_id, project_hash), queue=session['queue'])
+        tasks.expire_session.apply_async(
+            (session_id, session['queue']), queue=session['queue'], countdown=SESSION_IDLE_TIMEOUT + 1)
+        result = {"session": session_id, "project": project_hash, "idleTimeout": SESSION_IDLE_TIMEOUT}
+        return Response(json.dumps(result, separators=(',', ':')), 201, mimetype="application/json")
+
+    _id = request.args.get('id')
+    if _id is None or _id == '':
+        return Response("Missing parameter id", 400, mimetype="text/plain")
+    session = get_session(_id)
+    if session is None:
+        return Response(f"Unknown session {_id}", 404, mimetype="text/plain")
+    close_session(_id)
+    # releases the session right away instead of at its next expiration check
+    tasks.expire_session.apply_async((_id, session['queue']), queue=session['queue'])
+    return Response(f"Session {_id} closed", 200, mimetype="text/plain")
+
+
 @app.post("/poll")
 def poll():
     """Poll many computation statuses at the same time"""
     data = request.json
     result = {}
     for _id in data:
+        record = get_pipeline(str(_id))
+        if record is not None:
+            result[str(_id)] = pipeline_state(record)
+            continue
         res = celery.AsyncResult(str(_id))
         result[str(_id)] = res.state
     return Response(json.dumps(result, separators=(',', ':')), mimetype="application/json")
@@ -236,6 +492,12 @@ def revoke():
     if not _id or _id == '':
         return Response("Missing parameter id", 400, mimetype="text/plain")
 
+    record = get_pipeline(_id)
+    if record is not None:
+        if not revoke_pipeline(record):
+            return Response(f"Pipeline {_id} could not be revoked", 500, mimetype="text/plain")
+        return Response(f"Pipeline {_id} revoked", 200, mimetype="text/plain")
+
     res = celery.AsyncResult(_id)
     res.revoke(terminate=True, wait=True, timeout=2)
     if res.state != 'REVOKED':
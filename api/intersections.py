@@ -0,0 +1,176 @@
+"""
+Intersections results are stored in a Redis hash, one field per part, so that clients can download only the sections
+and fields they need. Parts are stored in the binary format of geocruncher.serialization, without losing precision:
+
+    "index"                     JSON list of the cross section IDs, in the order they were given
+    f"section:{id}:{field}"     one item per segment of the cross section
+    f"map:{field}"              the map, if computed. Only ranks and faults
+    "boreholes"                 the virtual borehole logs, if any
+
+Results are kept until they are released or expire, and can be downloaded many times.
+
+In streaming mode, each section is also published to a Redis stream keyed by task ID as soon as it is computed, so
+clients can draw sections before the whole computation is done. Entries are either {"section": ID or MAP, "data": part
+in the binary format}, with the same fields as above, or a last {"end": task state}.
+"""
+import json
+from typing import Optional
+import numpy as np
+from geocruncher import computations
+from geocruncher.adaptive_ranks import normalize_tolerance
+from geocruncher.ComputeIntersections import RankOutputMode
+from geocruncher.fault_intersections import FaultOutputMode
+from geocruncher.serialization import dumps_binary, loads_binary
+from .redis import redis_client as r
+
+FIELDS = ['ranks', 'faults', 'drillholes', 'springs', 'matrixGwb']
+MAP_FIELDS = ['ranks', 'faults']
+# used as a section ID to select the map
+MAP = 'map'
+# used as a section ID to select the virtual borehole logs, whatever the fields
+BOREHOLES = 'boreholes'
+
+_INDEX = 'index'
+
+
+def validate_data(data: computations.IntersectionsData) -> Optional[str]:
+    """Check the options of an intersections computation before it is queued. Returns the error, or None if valid"""
+    for name, mode in [('rankOutput', RankOutputMode), ('faultOutput', FaultOutputMode)]:
+        if name in data and data[name] not in [value.value for value in mode]:
+            return f"{name} must be among {','.join(value.value for value in mode)}"
+    try:
+        normalize_tolerance(data.get('rankTolerance'))
+    except ValueError as error:
+        return str(error)
+    # reserved to select the map and the virtual borehole logs among the stored sections
+    reserved = [section for section in data.get('toCompute', {}) if section in [MAP, BOREHOLES]]
+    if reserved:
+        return f"Reserved cross section IDs {','.join(reserved)}"
+    return None
+
+
+def _field(section: str, field: str) -> str:
+    return f"{MAP}:{field}" if section == MAP else f"section:{section}:{field}"
+
+
+def _parts(result: computations.IntersectionsResult) -> dict[str, object]:
+    """Split an intersections result into its parts, by hash field"""
+    mesh, fault = result["mesh"], result["fault"]
+    parts = {}
+    for section in mesh["forCrossSections"]:
+        parts[_field(section, 'ranks')] = mesh["forCrossSections"][section]
+        parts[_field(section, 'faults')] = fault["forCrossSections"][section]
+        for field in ['drillholes', 'springs', 'matrixGwb']:
+            parts[_field(section, field)] = mesh[field][section]
+    if "forMaps" in mesh:
+        parts[_field(MAP, 'ranks')] = mesh["forMaps"]
+        parts[_field(MAP, 'faults')] = fault["forMaps"]
+    if "boreholes" in mesh:
+        parts[BOREHOLES] = mesh["boreholes"]
+    return parts
+
+
+def store_result(output_key: str, result: computations.IntersectionsResult, expires: int) -> None:
+    """Store an intersections result, expiring after the given number of seconds"""
+    mapping = {field: dumps_binary(part, float_dtype=np.float64) for field, part in _parts(result).items()}
+    mapping[_INDEX] = json.dumps(list(result["mesh"]["forCrossSections"]))
+    pipe = r.pipeline()
+    pipe.hset(output_key, mapping=mapping)
+    pipe.expire(output_key, expires)
+    pipe.execute()
+
+
+def get_sections(output_key: str) -> Optional[list[str]]:
+    """IDs of the stored sections, MAP and BOREHOLES included if they were computed, or None if the result was
+    released or expired"""
+    index = r.hget(output_key, _INDEX)
+    if index is None:
+        return None
+    sections = json.loads(index)
+    if r.hexists(output_key, _field(MAP, 'ranks')):
+        sections.append(MAP)
+    if r.hexists(output_key, BOREHOLES):
+        sections.append(BOREHOLES)
+    return sections
+
+
+def load_result(
+    output_key: str, sections: list[str], fields: list[str] = None
+) -> computations.IntersectionsResult:
+    """Read the given sections of a stored result, with only the given fields, all of them by default.
+
+    The result has the same structure as returned by the computation, without the parts that were not asked for.
+    Sections must exist, see get_sections.
+    """
+    fields = FIELDS if fields is None else fields
+    requested = [
+        (section, field)
+        for section in sections
+        if section != BOREHOLES
+        for field in fields
+        if section != MAP or field in MAP_FIELDS
+    ]
+    values = r.hmget(output_key, [_field(section, field) for section, field in requested]) if requested else []
+
+    mesh = {"forCrossSections": {}, "drillholes": {}, "springs": {}, "matrixGwb": {}}
+    fault = {"forCrossSections": {}, "forMaps": {}}
+    for (section, field), value in zip(requested, values):
+        if value is None:
+            continue
+        part = loads_binary(value)
+        if section == MAP:
+            (mesh if field == 'ranks' else fault)["forMaps"] = part
+        elif field == 'ranks':
+            mesh["forCrossSections"][section] = part
+        elif field == 'faults':
+            fault["forCrossSections"][section] = part
+        else:
+            mesh[field][section] = part
+    if BOREHOLES in sections:
+        boreholes = r.hget(output_key, BOREHOLES)
+        if boreholes is not None:
+            mesh["boreholes"] = loads_binary(boreholes)
+    return {"mesh": mesh, "fault": fault}
+
+
+def stream_key(task_id: str) -> str:
+    return f"stream:{task_id}"
+
+
+def publish_section(task_id: str, section: Optional[str], part: dict, expires: int) -> None:
+    """Publish a computed section to the stream of a task, or the map if section is None"""
+    key = stream_key(task_id)
+    pipe = r.pipeline()
+    pipe.xadd(key, {"section": MAP if section is None else section, "data": dumps_binary(part, float_dtype=np.float64)})
+    pipe.expire(key, expires)
+    pipe.execute()
+
+
+def end_stream(task_id: str, state: str, expires: int) -> None:
+    """Mark the end of the stream of a task, with the final state of the task"""
+    key = stream_key(task_id)
+    pipe = r.pipeline()
+    pipe.xadd(key, {"end": state})
+    pipe.expire(key, expires)
+    pipe.execute()
+
+
+def read_stream(task_id: str, last_id: bytes | str, block: Optional[int]) -> list[tuple[bytes, dict]]:
+    """Read the stream entries after last_id, waiting up to block milliseconds for new ones, or not at all if None.
+    Entries are (entry ID, message) where the message is either {"section": ID, **fields} or {"end": state}"""
+    response = r.xread({stream_key(task_id): last_id}, block=block)
+    entries = []
+    for _, stream_entries in response:
+        for entry_id, values in stream_entries:
+            if b"end" in values:
+                entries.append((entry_id, {"end": values[b"end"].decode('utf-8')}))
+            else:
+                message = {"section": values[b"section"].decode('utf-8')}
+                message.update(loads_binary(values[b"data"]))
+                entries.append((entry_id, message))
+    return entries
+
+
+def release_result(output_key: str, task_id: str) -> None:
+    """Delete the stored result and the stream of a task"""
+    r.delete(output_key, stream_key(task_id))
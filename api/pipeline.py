@@ -0,0 +1,143 @@
+"""
+Server side pipelines, chaining computations so that intermediate outputs never leave Redis.
+
+The unit meshes are passed to the gwb meshes computation, whose output is then passed to the voxels and intersections
+computations, by Redis key. The client only uploads the project once, and downloads the final products.
+"""
+import json
+from typing import Optional, TypedDict
+from celery import chain, group, uuid
+from celery.canvas import Signature
+from geocruncher import computations
+from .celery import app as celery
+from .redis import redis_client as r
+from .utils import generate_key
+from . import tasks
+
+
+class PipelineData(TypedDict):
+    """Data given to the pipeline"""
+
+    meshes: computations.MeshesData
+    # Optional. If given, groundwater body meshes are computed from the unit meshes, then used by voxels and intersections
+    springs: list[computations.Spring]
+    # Optional
+    voxels: computations.MeshesData
+    # Optional
+    intersections: computations.IntersectionsData
+
+
+class PipelineRecord(TypedDict):
+    """What is stored about a running pipeline"""
+
+    tasks: list[str]
+    # product name to output key
+    outputs: dict[str, str]
+
+
+# states after which a task will not change anymore, other than SUCCESS
+FAILED_STATES = ['FAILURE', 'REVOKED']
+
+
+def _pipeline_key(pipeline_id: str) -> str:
+    return f"pipeline:{pipeline_id}"
+
+
+def _with_id(signature: Signature, task_ids: list[str]) -> Signature:
+    """Assign an ID to a task signature and remember it, to report the state of the pipeline"""
+    task_id = uuid()
+    task_ids.append(task_id)
+    return signature.set(task_id=task_id)
+
+
+def _store_project(xml: bytes, dem: bytes) -> tuple[str, str]:
+    """Store a copy of the project for a task. Tasks delete their inputs once read, and they expire with the results
+    in case the task never runs"""
+    xml_key = generate_key()
+    dem_key = generate_key()
+    r.set(xml_key, xml, ex=celery.conf.result_expires)
+    r.set(dem_key, dem, ex=celery.conf.result_expires)
+    return xml_key, dem_key
+
+
+def start_pipeline(data: PipelineData, xml: bytes, dem: bytes, metadata: dict, mesh_format: str) -> str:
+    """Start the computations of a pipeline.
+
+    Unit and fault meshes are always computed. When springs are given, the unit meshes are passed to the gwb meshes
+    computation, and voxels and intersections are started once the groundwater bodies are known. Otherwise, every
+    computation runs in parallel.
+
+    Returns
+    -------
+    str
+        The pipeline ID.
+    """
+    task_ids = []
+    outputs = {}
+
+    xml_key, dem_key = _store_project(xml, dem)
+    outputs['meshes'] = generate_key()
+    upstream = _with_id(tasks.compute_meshes.si(
+        data['meshes'], xml_key, dem_key, outputs['meshes'], metadata, mesh_format), task_ids)
+
+    downstream = []
+    gwb_parts_keys = []
+    for name, task in [('intersections', tasks.compute_intersections), ('voxels', tasks.compute_voxels)]:
+        if name not in data:
+            continue
+        xml_key, dem_key = _store_project(xml, dem)
+        gwb_parts_keys.append(generate_key())
+        outputs[name] = generate_key()
+        downstream.append(_with_id(task.si(
+            data[name], xml_key, dem_key, gwb_parts_keys[-1], outputs[name], metadata), task_ids))
+
+    if data.get('springs'):
+        unit_meshes_key = generate_key()
+        outputs['gwb_meshes'] = generate_key()
+        upstream = chain(
+            upstream,
+            _with_id(tasks.extract_unit_meshes.si(outputs['meshes'], unit_meshes_key), task_ids),
+            _with_id(tasks.compute_gwb_meshes.si(
+                data['springs'], unit_meshes_key, outputs['gwb_meshes'], metadata, mesh_format), task_ids),
+            _with_id(tasks.extract_gwb_parts.si(outputs['gwb_meshes'], gwb_parts_keys), task_ids),
+        )
+        workflow = chain(upstream, group(downstream)) if downstream else upstream
+    else:
+        workflow = group(upstream, *downstream)
+
+    pipeline_id = generate_key()
+    record: PipelineRecord = {"tasks": task_ids, "outputs": outputs}
+    r.set(_pipeline_key(pipeline_id), json.dumps(record), ex=celery.conf.result_expires)
+    workflow.apply_async()
+    return pipeline_id
+
+
+def get_pipeline(pipeline_id: str) -> Optional[PipelineRecord]:
+    """Get a pipeline by ID, or None if it does not exist or expired"""
+    record = r.get(_pipeline_key(pipeline_id))
+    return json.loads(record) if record else None
+
+
+def delete_pipeline(pipeline_id: str) -> None:
+    r.delete(_pipeline_key(pipeline_id))
+
+
+def pipeline_state(record: PipelineRecord) -> str:
+    """State of a pipeline, SUCCESS once every task succeeded. Tasks after a failed one never start, so the failure
+    is reported as soon as it happens."""
+    states = [celery.AsyncResult(task_id).state for task_id in record["tasks"]]
+    for state in states:
+        if state in FAILED_STATES:
+            return state
+    if all(state == 'SUCCESS' for state in states):
+        return 'SUCCESS'
+    return 'STARTED' if any(state != 'PENDING' for state in states) else 'PENDING'
+
+
+def revoke_pipeline(record: PipelineRecord) -> bool:
+    """Revoke every task of a pipeline. Returns whether the pipeline is stopped"""
+    for task_id in record["tasks"]:
+        res = celery.AsyncResult(task_id)
+        if res.state not in ['SUCCESS'] + FAILED_STATES:
+            res.revoke(terminate=True, wait=True, timeout=2)
+    return pipeline_state(record) in FAILED_STATES + ['SUCCESS']
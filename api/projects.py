@@ -0,0 +1,40 @@
+"""
+Projects uploaded for point queries, stored by hash so that later queries on the same project don't upload it again.
+Workers keep the loaded models by the same hash, see geocruncher.cache.models.
+"""
+from typing import Optional
+from geocruncher.cache import content_hash
+from .celery import app as celery
+from .redis import redis_client as r
+
+
+def _project_key(project_hash: str) -> str:
+    return f"project:{project_hash}"
+
+
+def store_project(xml: bytes, dem: bytes) -> str:
+    """Store a project, or refresh its expiration if it is already stored. Returns its hash"""
+    project_hash = content_hash(xml, dem)
+    key = _project_key(project_hash)
+    pipe = r.pipeline()
+    pipe.hset(key, mapping={"xml": xml, "dem": dem})
+    pipe.expire(key, celery.conf.result_expires)
+    pipe.execute()
+    return project_hash
+
+
+def refresh_project(project_hash: str) -> None:
+    """Postpone the expiration of a stored project while it is used"""
+    r.expire(_project_key(project_hash), celery.conf.result_expires)
+
+
+def has_project(project_hash: str) -> bool:
+    return bool(r.exists(_project_key(project_hash)))
+
+
+def load_project(project_hash: str) -> tuple[bytes, str]:
+    """Get the XML and DEM of a stored project, and raise a ValueError if it doesn't exist"""
+    xml, dem = r.hmget(_project_key(project_hash), "xml", "dem")
+    if xml is None or dem is None:
+        raise ValueError(f"Project not found {project_hash}")
+    return xml, dem.decode('utf-8')
@@ -0,0 +1,102 @@
+"""
+Sessions pin a project to a worker for interactive slicing. Each session has its own queue, consumed by a single
+worker of the session pool, so that every request of the session runs where the model and its compiled evaluators are
+already loaded, see geocruncher.cache.models.
+
+Session workers consume SESSION_POOL_QUEUE, which only tells them apart from the other workers, and should run with a
+concurrency of 1 so that the models stay in the process that runs the tasks. Session models are pinned apart from the
+cache of recently queried models, so they are never evicted, and each worker takes at most MAX_SESSIONS_PER_WORKER
+sessions. Sessions expire after IDLE_TIMEOUT seconds without requests, then their worker stops consuming their queue
+and unpins their model.
+"""
+import os
+from typing import Optional, TypedDict
+from .celery import app as celery
+from .projects import refresh_project
+from .redis import redis_client as r
+from .utils import generate_key
+
+# seconds without requests after which a session is closed
+IDLE_TIMEOUT = int(os.environ.get('SESSION_IDLE_TIMEOUT', 15 * 60))
+# open sessions per worker, each keeping a model in memory
+MAX_SESSIONS_PER_WORKER = int(os.environ.get('SESSION_MAX_PER_WORKER', 4))
+SESSION_POOL_QUEUE = 'geocruncher:sessions'
+_QUEUE_PREFIX = 'geocruncher:session:'
+# seconds to wait for the workers to answer control commands
+_CONTROL_TIMEOUT = 1.0
+
+
+class SessionRecord(TypedDict):
+    """What is stored about an open session"""
+
+    project: str
+    queue: str
+    worker: str
+
+
+def _session_key(session_id: str) -> str:
+    return f"session:{session_id}"
+
+
+def session_queue(session_id: str) -> str:
+    return f"{_QUEUE_PREFIX}{session_id}"
+
+
+def _pick_worker() -> Optional[str]:
+    """The session worker with the fewest open sessions, or None if there is no session worker or they are all full"""
+    active_queues = celery.control.inspect(timeout=_CONTROL_TIMEOUT).active_queues() or {}
+    num_sessions = {
+        worker: sum(queue['name'].startswith(_QUEUE_PREFIX) for queue in queues)
+        for worker, queues in active_queues.items()
+        if any(queue['name'] == SESSION_POOL_QUEUE for queue in queues)
+    }
+    if not num_sessions:
+        return None
+    worker = min(num_sessions, key=num_sessions.get)
+    return worker if num_sessions[worker] < MAX_SESSIONS_PER_WORKER else None
+
+
+def open_session(project_hash: str) -> Optional[str]:
+    """Open a session on a stored project, and make a session worker consume its queue. Returns the session ID, or
+    None if no session worker is available"""
+    worker = _pick_worker()
+    if worker is None:
+        return None
+    session_id = generate_key()
+    queue = session_queue(session_id)
+    replies = celery.control.add_consumer(queue, destination=[worker], reply=True, timeout=_CONTROL_TIMEOUT)
+    if not any('ok' in reply.get(worker, {}) for reply in replies):
+        return None
+
+    key = _session_key(session_id)
+    pipe = r.pipeline()
+    pipe.hset(key, mapping={"project": project_hash, "queue": queue, "worker": worker})
+    pipe.expire(key, IDLE_TIMEOUT)
+    pipe.execute()
+    return session_id
+
+
+def get_session(session_id: str) -> Optional[SessionRecord]:
+    """Get an open session, and postpone its expiration and the one of its project since it is used. None if it is
+    closed or expired"""
+    key = _session_key(session_id)
+    pipe = r.pipeline()
+    pipe.hgetall(key)
+    pipe.expire(key, IDLE_TIMEOUT)
+    record, _ = pipe.execute()
+    if not record:
+        return None
+    session = {field.decode('utf-8'): value.decode('utf-8') for field, value in record.items()}
+    # the worker reloads the project if it restarts, it must outlive the session
+    refresh_project(session['project'])
+    return session
+
+
+def session_ttl(session_id: str) -> int:
+    """Seconds before an idle session expires, or a negative number if it is closed or expired"""
+    return r.ttl(_session_key(session_id))
+
+
+def close_session(session_id: str) -> None:
+    """Close a session. Its worker releases it on its next expiration check, see tasks.expire_session"""
+    r.delete(_session_key(session_id))
@@ -1,40 +1,48 @@
 from collections import defaultdict
 import json
 from geocruncher import computations
+from geocruncher.cache.models import release_session_model
+from geocruncher.mesh_io.mesh_io import MeshFormat
+from geocruncher.serialization import to_json_compatible
 from .celery import app
 from .redis import redis_client as r
+from .intersections import end_stream, publish_section, store_result
+from .projects import load_project
+from .sessions import session_ttl
 from .utils import get_and_delete
 
 
 @app.task
-def compute_tunnel_meshes(data: computations.TunnelMeshesData, output_key: str, metadata: dict = None) -> str:
-    meshes = computations.compute_tunnel_meshes(data, metadata)
+def compute_tunnel_meshes(data: computations.TunnelMeshesData, output_key: str, metadata: dict = None, mesh_format: str = MeshFormat.DRACO.value) -> str:
+    mesh_format = MeshFormat(mesh_format)
+    meshes = computations.compute_tunnel_meshes(data, metadata, mesh_format)
     for field, value in meshes.items():
-        r.hset(output_key, field, value)
+        r.hset(output_key, field + mesh_format.extension, value)
     return output_key
 
 
 @app.task
-def compute_meshes(data: computations.MeshesData, xml_key: str, dem_key: str, output_key: str, metadata: dict = None) -> str:
+def compute_meshes(data: computations.MeshesData, xml_key: str, dem_key: str, output_key: str, metadata: dict = None, mesh_format: str = MeshFormat.DRACO.value) -> str:
     xml = get_and_delete(r, xml_key)
     dem = get_and_delete(r, dem_key).decode('utf-8')
 
-    generated_meshes = computations.compute_meshes(data, xml, dem, metadata)
+    mesh_format = MeshFormat(mesh_format)
+    generated_meshes = computations.compute_meshes(data, xml, dem, metadata, mesh_format)
 
     # write unit files
     for rank, mesh in generated_meshes['mesh'].items():
-        field = f"rank_{rank}"
+        field = f"rank_{rank}{mesh_format.extension}"
         r.hset(output_key, field, mesh)
 
     # write fault files
     for name, mesh in generated_meshes['fault'].items():
-        field = f"fault_{name}"
+        field = f"fault_{name}{mesh_format.extension}"
         r.hset(output_key, field, mesh)
     return output_key
 
 
-@app.task
-def compute_intersections(data: computations.IntersectionsData, xml_key: str, dem_key: str, gwb_meshes_key: str, output_key: str, metadata: dict = None) -> str:
+@app.task(bind=True)
+def compute_intersections(self, data: computations.IntersectionsData, xml_key: str, dem_key: str, gwb_meshes_key: str, output_key: str, metadata: dict = None, stream: bool = False, session_id: str = None) -> str:
     xml = get_and_delete(r, xml_key)
     dem = get_and_delete(r, dem_key).decode('utf-8')
 
@@ -45,24 +53,41 @@ def compute_intersections(data: computations.IntersectionsData, xml_key: str, de
             # Syntax: f"{id}_{subID}"
             gwb_id = name.decode('utf-8').split('_')[0]
             gwb_meshes[gwb_id].append(mesh)
-        r.delete(gwb_meshes_key)
-
-    outputs = computations.compute_intersections(data, xml, dem, gwb_meshes, metadata)
+    # deleted even when unused, a pipeline may have filled it
+    r.delete(gwb_meshes_key)
 
-    r.set(output_key, json.dumps(outputs, separators=(',', ':')))
+    task_id = self.request.id
+    on_section = None
+    if stream:
+        def on_section(section, part):
+            publish_section(task_id, section, part, app.conf.result_expires)
+
+    try:
+        outputs = computations.compute_intersections(
+            data, xml, dem, gwb_meshes, metadata, on_section, session_id)
+    except Exception:
+        if stream:
+            end_stream(task_id, 'FAILURE', app.conf.result_expires)
+        raise
+
+    # kept until released, so clients can download the sections they need when they need them
+    store_result(output_key, outputs, app.conf.result_expires)
+    if stream:
+        end_stream(task_id, 'SUCCESS', app.conf.result_expires)
     return output_key
 
 
 @app.task
-def compute_faults(data: computations.MeshesData, xml_key: str, dem_key: str, output_key: str, metadata: dict = None) -> str:
+def compute_faults(data: computations.MeshesData, xml_key: str, dem_key: str, output_key: str, metadata: dict = None, mesh_format: str = MeshFormat.DRACO.value) -> str:
     xml = get_and_delete(r, xml_key)
     dem = get_and_delete(r, dem_key).decode('utf-8')
 
-    generated_meshes = computations.compute_faults(data, xml, dem, metadata)
+    mesh_format = MeshFormat(mesh_format)
+    generated_meshes = computations.compute_faults(data, xml, dem, metadata, mesh_format)
 
     # write fault files
     for name, mesh in generated_meshes['fault'].items():
-        field = f"fault_{name}"
+        field = f"fault_{name}{mesh_format.extension}"
         r.hset(output_key, field, mesh)
     return output_key
 
@@ -86,7 +111,7 @@ def compute_voxels(data: computations.MeshesData, xml_key: str, dem_key: str, gw
 
 
 @app.task
-def compute_gwb_meshes(data: list[computations.Spring], meshes_key: str, output_key: str, metadata: dict = None) -> str:
+def compute_gwb_meshes(data: list[computations.Spring], meshes_key: str, output_key: str, metadata: dict = None, mesh_format: str = MeshFormat.DRACO.value, incremental: bool = False) -> str:
 
     # get existing meshes for groundwater bodies
     unit_meshes: dict[str, bytes] = {}
@@ -95,13 +120,79 @@ def compute_gwb_meshes(data: list[computations.Spring], meshes_key: str, output_
         unit_meshes[unit_id.decode('utf-8')] = mesh
     r.delete(meshes_key)
 
-    results = computations.compute_gwb_meshes(unit_meshes, data, metadata)
+    mesh_format = MeshFormat(mesh_format)
+    results = computations.compute_gwb_meshes(unit_meshes, data, metadata, mesh_format, incremental)
 
     # write metadata
     r.hset(output_key, "metadata", json.dumps(results["metadata"], separators=(',', ':')))
 
     # write gwb files
     for id, mesh in enumerate(results["meshes"]):
-        r.hset(output_key, f"mesh_{id}", mesh)
+        r.hset(output_key, f"mesh_{id}{mesh_format.extension}", mesh)
+
+    return output_key
+
 
+@app.task
+def extract_unit_meshes(meshes_key: str, output_key: str) -> str:
+    """Copy the unit meshes of a meshes computation to a new hash keyed by unit ID, as read by compute_gwb_meshes.
+    The meshes computation output is kept, so it can still be downloaded."""
+    for field, mesh in r.hgetall(meshes_key).items():
+        name = field.decode('utf-8')
+        if name.startswith('rank_'):
+            # Syntax: f"rank_{unit_id}{extension}"
+            unit_id = name[len('rank_'):].split('.')[0]
+            r.hset(output_key, unit_id, mesh)
     return output_key
+
+
+@app.task
+def extract_gwb_parts(gwb_meshes_key: str, output_keys: list[str]) -> list[str]:
+    """Copy the meshes of a gwb meshes computation to new hashes named f"{id}_{subID}", as read by compute_voxels and
+    compute_intersections. The groundwater body ID is the spring ID. The gwb meshes computation output is kept."""
+    stored = r.hgetall(gwb_meshes_key)
+    if b'metadata' not in stored:
+        return output_keys
+    metadata = json.loads(stored.pop(b'metadata'))
+
+    meshes: dict[int, bytes] = {}
+    for field, mesh in stored.items():
+        # Syntax: f"mesh_{index}{extension}"
+        meshes[int(field.decode('utf-8')[len('mesh_'):].split('.')[0])] = mesh
+
+    num_parts = defaultdict(int)
+    for index, part in enumerate(metadata):
+        gwb_id = part['spring_id']
+        for key in output_keys:
+            r.hset(key, f"{gwb_id}_{num_parts[gwb_id]}", meshes[index])
+        num_parts[gwb_id] += 1
+    # read and deleted by the next computations, unless they fail before
+    for key in output_keys:
+        r.expire(key, app.conf.result_expires)
+    return output_keys
+
+
+@app.task
+def query_points(data: computations.PointsQueryData, project_hash: str, metadata: dict = None, session_id: str = None) -> dict:
+    """Evaluate ranks and fault potentials at points. Results are small, so they are returned directly instead of
+    being stored in Redis"""
+    result = computations.query_points(data, project_hash, lambda: load_project(project_hash), metadata, session_id)
+    return to_json_compatible(result)
+
+
+@app.task
+def open_session_model(session_id: str, project_hash: str) -> None:
+    """Load the model of a session in its worker, before its first request"""
+    computations.preload_model(session_id, project_hash, lambda: load_project(project_hash))
+
+
+@app.task(bind=True)
+def expire_session(self, session_id: str, queue: str) -> None:
+    """Release a session once it is closed or idle: stop consuming its queue and forget its model. Scheduled on the
+    session queue, so it runs in the session worker, and scheduled again while the session is used"""
+    ttl = session_ttl(session_id)
+    if ttl > 0:
+        self.apply_async((session_id, queue), queue=queue, countdown=ttl + 1)
+        return
+    app.control.cancel_consumer(queue, destination=[self.request.hostname])
+    release_session_model(session_id)
@@ -3,6 +3,7 @@ import redis
 import json
 from flask import request
 from typing import Optional, Dict, Any
+from geocruncher.mesh_io.mesh_io import MeshFormat
 
 
 def parse_metadata_from_request() -> Optional[Dict[str, Any]]:
@@ -24,6 +25,23 @@ def parse_metadata_from_request() -> Optional[Dict[str, Any]]:
     return None
 
 
+def parse_mesh_format_from_request() -> Optional[str]:
+    """Parse the optional output mesh format from Flask request.
+
+    Looks for 'meshFormat' form field. Defaults to Draco when not provided
+
+    Returns
+    -------
+    Optional[str]
+        The mesh format value, or None if the given format is unknown
+    """
+    value = request.form.get('meshFormat', MeshFormat.DRACO.value) if hasattr(request, 'form') else MeshFormat.DRACO.value
+    try:
+        return MeshFormat(value).value
+    except ValueError:
+        return None
+
+
 def get_and_delete(r: redis.client.Redis, key: str) -> bytes:
     """Get a key from the Redis Client, then delete it, and raise a ValueError if it doesn't exist.
 
@@ -1,19 +1,61 @@
 #include "AquiferCalc.h"
-#include <CGAL/AABB_face_graph_triangle_primitive.h>
-#include <CGAL/AABB_traits_3.h>
-#include <CGAL/AABB_tree.h>
+#include <CGAL/Polygon_mesh_processing/bbox.h>
 #include <CGAL/Polygon_mesh_processing/clip.h>
 #include <CGAL/Polygon_mesh_processing/connected_components.h>
 #include <CGAL/Polygon_mesh_processing/measure.h>
 #include <CGAL/boost/graph/helpers.h>
 #include <CGAL/exceptions.h>
-
-typedef CGAL::AABB_face_graph_triangle_primitive<Mesh> AABB_primitive;
-typedef CGAL::AABB_traits_3<Kernel, AABB_primitive> AABB_traits;
-typedef CGAL::AABB_tree<AABB_traits> AABB_tree;
+#include <atomic>
+#include <exception>
+#include <mutex>
+#include <thread>
 
 namespace PMP = CGAL::Polygon_mesh_processing;
 
+namespace {
+
+/**
+* Call f(i) for each i in [0, n) on a pool of worker threads. The first exception thrown by f is rethrown on the calling thread.
+*/
+template <typename F>
+void parallelFor(size_t n, F f) {
+  const size_t num_threads = std::min<size_t>(n, std::max(1u, std::thread::hardware_concurrency()));
+  if (num_threads <= 1) {
+    for (size_t i = 0; i < n; i++) {
+      f(i);
+    }
+    return;
+  }
+
+  std::atomic<size_t> next(0);
+  std::exception_ptr error;
+  std::mutex error_mutex;
+  std::vector<std::thread> workers;
+  workers.reserve(num_threads);
+  for (size_t t = 0; t < num_threads; t++) {
+    workers.emplace_back([&]() {
+      for (size_t i = next++; i < n; i = next++) {
+        try {
+          f(i);
+        } catch (...) {
+          std::lock_guard<std::mutex> lock(error_mutex);
+          if (!error) {
+            error = std::current_exception();
+          }
+        }
+      }
+    });
+  }
+  for (auto& worker : workers) {
+    worker.join();
+  }
+  if (error) {
+    std::rethrow_exception(error);
+  }
+}
+
+}
+
 /**
 Groundwater Body Algorithm
 
@@ -25,7 +67,7 @@ Main
 -----
 Input: Springs, Unit Meshes
 
-1. Sort springs by Z coordinate, descending
+1. Sort springs by Z coordinate, descending (ties by ID)
 2. For each spring:
   2.1 Compute aquifer on the spring's unit mesh
   2.2 If aquifer is contained in existing groundwater body, skip
@@ -35,7 +77,7 @@ Propagation
 ------------
 Input: Spring, Origin (aquifer mesh belonging to spring)
 
-1. Cut all unit meshes at Z coordinate of Spring
+1. Cut all unit meshes at Z coordinate of Spring (in parallel, reused by springs at the same Z)
 2. Candidates: All unit meshes except origin
 3. Work queue: For each candidate 'C', add flow (Origin, C) to queue
 4. Take (Source, Target) from queue until empty
@@ -45,6 +87,12 @@ Input: Spring, Origin (aquifer mesh belonging to spring)
     4.1.3 For each candidate 'C', add flow (target, C)
 5. Return groundwater body  
 
+Intersection tests
+-------------------
+Each pair is first rejected if the bounding boxes of the meshes don't overlap. Otherwise, the faces of one mesh
+that overlap the bounding box of the other are tested against the AABB tree of the other. Bounding boxes and trees
+are kept with the cut components, so they are reused across work queue items and springs at the same Z.
+
 */
 
 /**
@@ -52,8 +100,25 @@ Input: Spring, Origin (aquifer mesh belonging to spring)
 * spring_to_mesh: location of a spring and its assignment to a mesh ID. Invalid mesh IDs will throw a exception during calculation.
 */
 AquiferCalc::AquiferCalc(std::vector<UnitMesh>&& meshes, std::vector<Spring>&& springs)
-  : meshes(meshes), springs(springs) { }
+  : meshes(meshes), springs(springs), cut_cache_z(0.0) { }
+
+/**
+* existing_aquifers: aquifers previously computed for springs that are all higher than the given springs, with the same meshes.
+* The calculation resumes after them, and only returns the aquifers of the given springs.
+*/
+AquiferCalc::AquiferCalc(std::vector<UnitMesh>&& meshes, std::vector<Spring>&& springs, std::vector<UnitMesh>&& existing_aquifers)
+  : meshes(meshes), springs(springs), existing_aquifers(existing_aquifers), cut_cache_z(0.0) { }
+
 
+AquiferCalc::IndexedMesh::IndexedMesh(Mesh&& mesh)
+  : mesh(std::move(mesh)), bbox(PMP::bbox(this->mesh)) { }
+
+const AABB_tree& AquiferCalc::IndexedMesh::tree() const {
+  if (!aabb_tree) {
+    aabb_tree = std::make_unique<AABB_tree>(faces(mesh).first, faces(mesh).second, mesh);
+  }
+  return *aabb_tree;
+}
 
 /**
 * Find the aquifers for all the meshes. Connected meshes are considered as one.
@@ -61,8 +126,15 @@ AquiferCalc::AquiferCalc(std::vector<UnitMesh>&& meshes, std::vector<Spring>&& s
 */
 std::vector<UnitMesh> AquiferCalc::calculate()
 {
-  std::vector<UnitMesh> aquifers;
-  std::sort(springs.begin(), springs.end(), [](const Spring& s1, const Spring& s2) { return s1.location.z() > s2.location.z(); });
+  std::vector<GroundwaterBodyPart> parts;
+  for (const auto& existing : existing_aquifers) {
+    parts.push_back(GroundwaterBodyPart{std::make_shared<const IndexedMesh>(Mesh(existing.mesh)), existing.unit_id, existing.spring});
+  }
+  const size_t num_existing = parts.size();
+  // Ties are broken by ID, so the processing order is deterministic and results can be resumed
+  std::sort(springs.begin(), springs.end(), [](const Spring& s1, const Spring& s2) {
+    return s1.location.z() > s2.location.z() || (s1.location.z() == s2.location.z() && s1.id < s2.id);
+  });
 
   for (const auto& spring : springs) {
     int unit_mesh_id = spring.meshId;
@@ -78,28 +150,34 @@ std::vector<UnitMesh> AquiferCalc::calculate()
       throw std::runtime_error(msg.c_str());
     }
 
-    UnitMesh init_aquifer(*it); // Create a copy
-    cutMeshZ(init_aquifer.mesh, spring.location.z());
-    if (init_aquifer.mesh.number_of_faces() == 0) {
+    auto cut = getCutUnit(std::distance(meshes.cbegin(), it), spring.location.z());
+    if (cut->mesh.number_of_faces() == 0) {
       continue;
     }
+    Mesh init_mesh(cut->mesh); // Create a copy
 
-    keepClosestSubmeshOnly(init_aquifer.mesh, spring.location);  // Cutting may result in multiple meshes. Keep the one closest to the spring
+    keepClosestSubmeshOnly(init_mesh, spring.location);  // Cutting may result in multiple meshes. Keep the one closest to the spring
+    auto init_aquifer = std::make_shared<const IndexedMesh>(std::move(init_mesh));
     // Check if overlaps with existing aquifer. Cancel if so.
-    bool does_intersect = std::find_if(aquifers.cbegin(), aquifers.cend(),
-      [&init_aquifer](const UnitMesh& other) { return PMP::do_intersect(init_aquifer.mesh, other.mesh); }
-    ) != aquifers.cend();
+    bool does_intersect = std::find_if(parts.cbegin(), parts.cend(),
+      [this, &init_aquifer](const GroundwaterBodyPart& other) { return doIntersect(*init_aquifer, *other.part); }
+    ) != parts.cend();
     if (does_intersect) {
       continue; // This aquifer is part of a larger one, skip it. [Guaranteed due to springs being sorted]
     }
     
     // Propagate spring from init aquifer to touching units
-    std::vector<UnitMesh> groundwater_body = findConnectedGroundwaterBodyParts(init_aquifer, spring);
-    aquifers.insert(aquifers.cend(), groundwater_body.begin(), groundwater_body.end());
+    std::vector<GroundwaterBodyPart> groundwater_body = findConnectedGroundwaterBodyParts(init_aquifer, spring);
+    parts.insert(parts.cend(), groundwater_body.begin(), groundwater_body.end());
   }
 
-  for (auto& aquifer : aquifers) {
+  std::vector<UnitMesh> aquifers;
+  aquifers.reserve(parts.size() - num_existing);
+  for (auto it = parts.cbegin() + num_existing; it != parts.cend(); ++it) {
+    const auto& part = *it;
+    UnitMesh aquifer(part.part->mesh, part.unit_id, part.spring);
     aquifer.volume = PMP::volume(aquifer.mesh);
+    aquifers.push_back(std::move(aquifer));
   }
   
   return aquifers;
@@ -109,48 +187,72 @@ bool AquiferCalc::isMeshValid(const Mesh& mesh) {
   return CGAL::is_closed(mesh);
 }
 
+/**
+* Check if the surfaces of two meshes intersect. Bounding boxes act as a broad phase, then the faces of the
+* smaller mesh are queried against the AABB tree of the larger one, with the same exact predicates as PMP::do_intersect.
+*/
+bool AquiferCalc::doIntersect(const IndexedMesh& a, const IndexedMesh& b) {
+  if (!CGAL::do_overlap(a.bbox, b.bbox)) {
+    stats.pairs_pruned_bbox++;
+    return false;
+  }
+  stats.pairs_tested_exact++;
+
+  const IndexedMesh& indexed = a.mesh.number_of_faces() >= b.mesh.number_of_faces() ? a : b;
+  const IndexedMesh& queried = &indexed == &a ? b : a;
+  const AABB_tree& tree = indexed.tree();
+  for (auto f : faces(queried.mesh)) {
+    auto h = queried.mesh.halfedge(f);
+    Kernel::Triangle_3 triangle(
+      queried.mesh.point(queried.mesh.source(h)),
+      queried.mesh.point(queried.mesh.target(h)),
+      queried.mesh.point(queried.mesh.target(queried.mesh.next(h))));
+    if (!CGAL::do_overlap(triangle.bbox(), indexed.bbox)) {
+      continue;
+    }
+    if (tree.do_intersect(triangle)) {
+      stats.pairs_intersecting++;
+      return true;
+    }
+  }
+  return false;
+}
+
 
-std::vector<UnitMesh> AquiferCalc::findConnectedGroundwaterBodyParts(const UnitMesh& init_source, const Spring& spring) {
-  typedef std::shared_ptr<const UnitMesh> UnitPtr;
-  typedef std::pair<UnitPtr, UnitPtr> SourceToTargetFlow;
+std::vector<AquiferCalc::GroundwaterBodyPart> AquiferCalc::findConnectedGroundwaterBodyParts(const IndexedMeshPtr& init_source, const Spring& spring) {
+  typedef std::pair<IndexedMeshPtr, int> Candidate; // Mesh and unit ID
+  typedef std::pair<IndexedMeshPtr, IndexedMeshPtr> SourceToTargetFlow;
 
-  std::vector<UnitPtr> candidates;
+  std::vector<Candidate> candidates;
   candidates.reserve(meshes.size());
-  std::vector<UnitMesh> aquifers; // Result
+  std::vector<GroundwaterBodyPart> aquifers; // Result
 
   // Cut across all unit meshes at height of spring
-  for (const auto& u : meshes) {
-    Mesh mesh_copy(u.mesh);
-    cutMeshZ(mesh_copy, spring.location.z());
-    std::vector<Mesh> components = findConnectedComponents(mesh_copy);
-
-    for (const auto& m : components) {
-      UnitMesh um(m, u.unit_id, spring);
-      candidates.push_back(std::move(std::make_shared<const UnitMesh>(um)));
+  std::vector<CutUnitPtr> cuts = getCutUnits(spring.location.z());
+  for (size_t i = 0; i < meshes.size(); i++) {
+    for (const auto& m : cuts[i]->components) {
+      candidates.emplace_back(m, meshes[i].unit_id);
     }
   }
 
   // Start the queue with the source mesh
-  auto origin_ptr = std::make_shared<const UnitMesh>(init_source);
   std::queue<SourceToTargetFlow> worklist;
   for (const auto& c : candidates) {
-    SourceToTargetFlow f(origin_ptr, c);
-    worklist.emplace(f);
+    worklist.emplace(init_source, c.first);
   }
 
   while (!worklist.empty()) {
     const auto& flow = worklist.front();
     const auto& origin = flow.first;
     const auto& target = flow.second;
-    auto targetItr = std::find(candidates.begin(), candidates.end(), target);
+    auto targetItr = std::find_if(candidates.begin(), candidates.end(), [&target](const Candidate& c) { return c.first == target; });
     if (targetItr != candidates.end()) {
-      if (PMP::do_intersect(origin->mesh, target->mesh)) {
-        aquifers.push_back(*target);
+      if (doIntersect(*origin, *target)) {
+        aquifers.push_back(GroundwaterBodyPart{target, targetItr->second, spring});
         candidates.erase(targetItr);
         // Add worklist items: (Target, c) for each c in candidates
         for (const auto& c : candidates) {
-          SourceToTargetFlow f(target, c);
-          worklist.emplace(f);
+          worklist.emplace(target, c.first);
         }
       }
     }
@@ -182,6 +284,59 @@ std::vector<Mesh> AquiferCalc::findConnectedComponents(Mesh& mesh) {
   return components;
 }
 
+/**
+* Get a unit mesh cut at the given Z. Springs are processed by descending Z, so only the cuts at the Z of the
+* current spring can be reused. The cache is reset whenever another Z is requested.
+*/
+AquiferCalc::CutUnitPtr AquiferCalc::getCutUnit(size_t mesh_index, double z) {
+  if (cut_cache.empty() || cut_cache_z != z) {
+    cut_cache.assign(meshes.size(), nullptr);
+    cut_cache_z = z;
+  }
+  if (!cut_cache[mesh_index]) {
+    auto cut = std::make_shared<CutUnit>();
+    cut->mesh = meshes[mesh_index].mesh;
+    cutMeshZ(cut->mesh, z);
+    cut_cache[mesh_index] = cut;
+  }
+  return cut_cache[mesh_index];
+}
+
+/**
+* Get all unit meshes cut at the given Z, along with their connected components.
+* Missing cuts and components are computed in parallel, each worker only touching its own unit.
+*/
+std::vector<AquiferCalc::CutUnitPtr> AquiferCalc::getCutUnits(double z) {
+  if (cut_cache.empty() || cut_cache_z != z) {
+    cut_cache.assign(meshes.size(), nullptr);
+    cut_cache_z = z;
+  }
+
+  std::vector<size_t> missing;
+  for (size_t i = 0; i < meshes.size(); i++) {
+    if (!cut_cache[i] || !cut_cache[i]->has_components) {
+      missing.push_back(i);
+    }
+  }
+
+  parallelFor(missing.size(), [&](size_t k) {
+    const size_t i = missing[k];
+    CutUnitPtr cut = cut_cache[i];
+    if (!cut) {
+      cut = std::make_shared<CutUnit>();
+      cut->mesh = meshes[i].mesh;
+      cutMeshZ(cut->mesh, z);
+    }
+    for (auto& component : findConnectedComponents(cut->mesh)) {
+      cut->components.push_back(std::make_shared<const IndexedMesh>(std::move(component)));
+    }
+    cut->has_components = true;
+    cut_cache[i] = cut;
+  });
+
+  return cut_cache;
+}
+
 /**
 * Cuts mesh so that all points are at or below specified Z coordinate. Holes in the mesh are closed.
 */
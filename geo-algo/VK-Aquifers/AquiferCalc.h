@@ -1,18 +1,75 @@
 #pragma once
 #include "CommonDefs.h"
+#include <CGAL/AABB_face_graph_triangle_primitive.h>
+#include <CGAL/AABB_traits_3.h>
+#include <CGAL/AABB_tree.h>
+
+typedef CGAL::AABB_face_graph_triangle_primitive<Mesh> AABB_primitive;
+typedef CGAL::AABB_traits_3<Kernel, AABB_primitive> AABB_traits;
+typedef CGAL::AABB_tree<AABB_traits> AABB_tree;
 
 class AquiferCalc {
 public:
+  // Counters of the intersection tests, per phase
+  struct Stats {
+    // Pairs rejected because their bounding boxes don't overlap
+    size_t pairs_pruned_bbox = 0;
+    // Pairs tested face by face against an AABB tree
+    size_t pairs_tested_exact = 0;
+    // Tested pairs that do intersect
+    size_t pairs_intersecting = 0;
+  };
+
   AquiferCalc(std::vector<UnitMesh>&& meshes, std::vector<Spring>&& springs);
+  AquiferCalc(std::vector<UnitMesh>&& meshes, std::vector<Spring>&& springs, std::vector<UnitMesh>&& existing_aquifers);
   std::vector<UnitMesh> calculate();
+  const Stats& getStats() const { return stats; }
 
 private:
+  // A mesh with its bounding box and a lazily built AABB tree, kept as long as the mesh is reused
+  class IndexedMesh {
+  public:
+    explicit IndexedMesh(Mesh&& mesh);
+    const Mesh mesh;
+    const CGAL::Bbox_3 bbox;
+    const AABB_tree& tree() const;
+
+  private:
+    mutable std::unique_ptr<AABB_tree> aabb_tree;
+  };
+  typedef std::shared_ptr<const IndexedMesh> IndexedMeshPtr;
+
+  // A part of a groundwater body, the mesh being shared with the cut cache
+  struct GroundwaterBodyPart {
+    IndexedMeshPtr part;
+    int unit_id;
+    Spring spring;
+  };
+
+  // A unit mesh cut at a given Z, and the connected components of the cut
+  struct CutUnit {
+    Mesh mesh;
+    std::vector<IndexedMeshPtr> components;
+    bool has_components = false;
+  };
+  typedef std::shared_ptr<CutUnit> CutUnitPtr;
+
   std::vector<UnitMesh> meshes;
   std::vector<Spring> springs;
+  // Aquifers of springs above all of the given springs, computed earlier. Only used to check containment
+  std::vector<UnitMesh> existing_aquifers;
+  Stats stats;
+
+  // Cut unit meshes for cut_cache_z, indexed like meshes
+  double cut_cache_z;
+  std::vector<CutUnitPtr> cut_cache;
 
   bool isMeshValid(const Mesh& mesh);
-  std::vector<UnitMesh> findConnectedGroundwaterBodyParts(const UnitMesh& init_source, const Spring& spring);
+  bool doIntersect(const IndexedMesh& a, const IndexedMesh& b);
+  std::vector<GroundwaterBodyPart> findConnectedGroundwaterBodyParts(const IndexedMeshPtr& init_source, const Spring& spring);
   std::vector<Mesh> findConnectedComponents(Mesh& mesh);
+  CutUnitPtr getCutUnit(size_t mesh_index, double z);
+  std::vector<CutUnitPtr> getCutUnits(double z);
   void cutMeshZ(Mesh& mesh, double maxZ);
   void keepClosestSubmeshOnly(Mesh& mesh, const Point_3& point);
   Mesh::Face_index findClosestFace(const Mesh& mesh, const Point_3& point);
@@ -1,5 +1,6 @@
 #include "AquiferCalc.h"
 #include "FileIO.h"
+#include <pybind11/numpy.h>
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
 
@@ -8,9 +9,17 @@ namespace py = pybind11;
 PYBIND11_MODULE(PyGeoAlgo, m) {
     m.doc() = "GeoAlgo pybind11 python bindings";
 
+    py::class_<AquiferCalc::Stats>(m, "AquiferCalcStats")
+        .def_readonly("pairs_pruned_bbox", &AquiferCalc::Stats::pairs_pruned_bbox)
+        .def_readonly("pairs_tested_exact", &AquiferCalc::Stats::pairs_tested_exact)
+        .def_readonly("pairs_intersecting", &AquiferCalc::Stats::pairs_intersecting);
+
     py::class_<AquiferCalc>(m, "AquiferCalc")
         .def(py::init<std::vector<UnitMesh>&&, std::vector<Spring>&&>())
-        .def("calculate", &AquiferCalc::calculate);
+        .def(py::init<std::vector<UnitMesh>&&, std::vector<Spring>&&, std::vector<UnitMesh>&&>())
+        // The calculation doesn't touch any Python object, release the GIL so other threads can run meanwhile
+        .def("calculate", &AquiferCalc::calculate, py::call_guard<py::gil_scoped_release>())
+        .def_property_readonly("stats", &AquiferCalc::getStats, py::return_value_policy::copy);
 
     py::class_<FileIO>(m, "FileIO")
         .def_static("load_from_bytes", [](py::buffer buf) {
@@ -27,7 +36,33 @@ PYBIND11_MODULE(PyGeoAlgo, m) {
             const auto& vec = FileIO::write_to_bytes(mesh, use_off);
             // Convert directly to Python bytes (zero-copy for the view)
             return py::bytes(vec.data(), vec.size());
-        }, py::arg("mesh"), py::arg("use_off") = false);
+        }, py::arg("mesh"), py::arg("use_off") = false)
+        // NumPy exchange: arrays are read through the buffer protocol, without copies when
+        // they are already C-contiguous float64 points (N, 3) and int32 triangles (F, 3)
+        .def_static("load_from_arrays", [](
+            py::array_t<double, py::array::c_style | py::array::forcecast> points,
+            py::array_t<std::int32_t, py::array::c_style | py::array::forcecast> triangles) {
+            if (points.ndim() != 2 || points.shape(1) != 3) {
+                throw std::runtime_error("Expected points of shape (N, 3)");
+            }
+            if (triangles.ndim() != 2 || triangles.shape(1) != 3) {
+                throw std::runtime_error("Expected triangles of shape (F, 3)");
+            }
+            const double *p = points.data();
+            const std::int32_t *t = triangles.data();
+            const size_t num_points = points.shape(0);
+            const size_t num_triangles = triangles.shape(0);
+            // Building the CGAL mesh doesn't touch any Python object, so other threads can run meanwhile
+            py::gil_scoped_release release;
+            return FileIO::load_from_arrays(p, num_points, t, num_triangles);
+        }, py::arg("points"), py::arg("triangles"))
+        .def_static("write_to_arrays", [](const Mesh &mesh) {
+            // Vertices and triangles are written directly into the NumPy owned buffers
+            py::array_t<double> points({static_cast<py::ssize_t>(mesh.number_of_vertices()), static_cast<py::ssize_t>(3)});
+            py::array_t<std::int32_t> triangles({static_cast<py::ssize_t>(mesh.number_of_faces()), static_cast<py::ssize_t>(3)});
+            FileIO::write_to_arrays(mesh, points.mutable_data(), triangles.mutable_data());
+            return py::make_tuple(points, triangles);
+        }, py::arg("mesh"));
 
     py::class_<Point_3>(m, "Point_3", py::module_local())
         .def(py::init<double, double, double>());
@@ -6,6 +6,7 @@
 #include <draco/compression/decode.h>
 #include <draco/compression/encode.h>
 #include <draco/mesh/mesh.h>
+#include <CGAL/boost/graph/iterator.h>
 #include <stdexcept>
 
 Mesh FileIO::load_off(std::string filename) {
@@ -232,3 +233,67 @@ std::vector<char> FileIO::write_to_bytes(const Mesh &mesh, bool use_off) {
     return write_draco_to_bytes(mesh);
   }
 }
+
+Mesh FileIO::load_from_arrays(const double *points, size_t num_points,
+                              const std::int32_t *triangles,
+                              size_t num_triangles) {
+  Mesh mesh;
+  mesh.reserve(num_points, num_triangles * 3 / 2, num_triangles);
+
+  // Points are laid out as x0 y0 z0 x1 y1 z1 ...
+  for (size_t v = 0; v < num_points; v++) {
+    mesh.add_vertex(
+        Point_3(points[3 * v], points[3 * v + 1], points[3 * v + 2]));
+  }
+
+  // Triangles are laid out as a0 b0 c0 a1 b1 c1 ...
+  for (size_t t = 0; t < num_triangles; t++) {
+    Mesh::Vertex_index vertices[3];
+    for (int i = 0; i < 3; ++i) {
+      const std::int32_t idx = triangles[3 * t + i];
+      if (idx < 0 || static_cast<size_t>(idx) >= num_points) {
+        throw std::invalid_argument("Invalid triangle. Vertex index " +
+                                    std::to_string(idx) + " out of range.");
+      }
+      vertices[i] = Mesh::Vertex_index(idx);
+    }
+    // Like Draco meshes, non-manifold triangles are skipped: add_face returns
+    // null_face() for them. Meshes are validated where they are used, see
+    // AquiferCalc::isMeshValid
+    mesh.add_face(vertices[0], vertices[1], vertices[2]);
+  }
+
+  if (mesh.is_empty()) {
+    throw std::invalid_argument("Invalid input arrays. Mesh is empty.");
+  }
+
+  return mesh;
+}
+
+void FileIO::write_to_arrays(const Mesh &mesh, double *points,
+                             std::int32_t *triangles) {
+  // Removed elements may still be present if garbage was not collected, so
+  // vertices are re-indexed in iteration order
+  std::vector<std::int32_t> index(mesh.number_of_vertices() +
+                                  mesh.number_of_removed_vertices());
+  std::int32_t next = 0;
+  for (auto v : mesh.vertices()) {
+    const Point_3 &p = mesh.point(v);
+    points[3 * next] = CGAL::to_double(p.x());
+    points[3 * next + 1] = CGAL::to_double(p.y());
+    points[3 * next + 2] = CGAL::to_double(p.z());
+    index[v.idx()] = next++;
+  }
+
+  size_t t = 0;
+  for (auto f : mesh.faces()) {
+    int i = 0;
+    for (auto v : CGAL::vertices_around_face(mesh.halfedge(f), mesh)) {
+      if (i == 3) {
+        throw std::invalid_argument("CGAL mesh contains non-triangular faces.");
+      }
+      triangles[3 * t + i++] = index[v.idx()];
+    }
+    t++;
+  }
+}
@@ -1,5 +1,6 @@
 #pragma once
 #include "CommonDefs.h"
+#include <cstdint>
 #include <fstream>
 
 class FileIO {
@@ -15,6 +16,9 @@ public:
   static std::vector<char> write_draco_to_bytes(const Mesh &);
   static Mesh load_from_bytes(const char *, size_t);
   static std::vector<char> write_to_bytes(const Mesh &, bool = false);
+  static Mesh load_from_arrays(const double *, size_t, const std::int32_t *,
+                               size_t);
+  static void write_to_arrays(const Mesh &, double *, std::int32_t *);
 
 private:
     // From Draco implementation comments:
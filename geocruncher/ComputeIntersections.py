@@ -1,13 +1,115 @@
-import math
+from enum import Enum
 
 import numpy as np
-import pyvista as pv
 from forgeo.gmlib.GeologicalModel3D import GeologicalModel, Box
 
 from forgeo.gmlib.architecture import from_GeoModeller, make_evaluator
 
+from .adaptive_ranks import refine_ranks
+from .borehole_logs import rank_intervals, sample_polylines
 from .profiler import profile_step
-from .mesh_io.mesh_io import read_mesh_to_polydata
+from .mesh_io.mesh_cache import read_cached_mesh, select_enclosed_points
+from .sky_culling import evaluate_ranks
+from .topography_reader import evaluate_z, topography_potential
+
+
+class RankOutputMode(str, Enum):
+    """How the unit ranks of a cross section are returned"""
+
+    # dense grid of ranks
+    GRID = "grid"
+    # boundary rings of each unit, see rank_polygons
+    POLYGONS = "polygons"
+
+
+def _remove_collinear_points(ring: np.ndarray) -> np.ndarray:
+    """Remove the points of a closed ring that are on a straight line between their neighbours"""
+    # the last point of the ring repeats the first one
+    points = ring[:-1]
+    previous = np.roll(points, 1, axis=0)
+    following = np.roll(points, -1, axis=0)
+    cross = (points[:, 0] - previous[:, 0]) * (following[:, 1] - points[:, 1]) - (
+        points[:, 1] - previous[:, 1]
+    ) * (following[:, 0] - points[:, 0])
+    kept = points[cross != 0]
+    return np.vstack([kept, kept[:1]])
+
+
+def _boundary_rings(mask: np.ndarray) -> list[np.ndarray]:
+    """Trace the boundaries of the True cells of a 2D mask along the cell edges.
+
+    Corners are at integer coordinates, corner (i, j) being the lower left corner of cell (i, j). Rings are closed,
+    with the cells on their left.
+    """
+    padded = np.pad(mask, 1)
+    inner = padded[1:-1, 1:-1]
+    i, j = np.nonzero(inner)
+    starts = []
+    ends = []
+    # (neighbour offset, edge start offset, edge end offset), going around the cell counter-clockwise
+    for (di, dj), start, end in [
+        ((0, -1), (0, 0), (1, 0)),
+        ((1, 0), (1, 0), (1, 1)),
+        ((0, 1), (1, 1), (0, 1)),
+        ((-1, 0), (0, 1), (0, 0)),
+    ]:
+        is_boundary = ~padded[i + 1 + di, j + 1 + dj]
+        cells = np.column_stack([i[is_boundary], j[is_boundary]])
+        starts.append(cells + start)
+        ends.append(cells + end)
+    starts = np.concatenate(starts).tolist()
+    ends = np.concatenate(ends).tolist()
+
+    outgoing = {}
+    for index, start in enumerate(starts):
+        outgoing.setdefault(tuple(start), []).append(index)
+
+    rings = []
+    is_used = [False] * len(starts)
+    for first in range(len(starts)):
+        if is_used[first]:
+            continue
+        ring = [starts[first]]
+        edge = first
+        while True:
+            is_used[edge] = True
+            ring.append(ends[edge])
+            candidates = [e for e in outgoing[tuple(ends[edge])] if not is_used[e]]
+            if not candidates:
+                break
+            if len(candidates) > 1:
+                # cells touching by a corner: always take the right turn, so rings never cross each other
+                du = ends[edge][0] - starts[edge][0]
+                dv = ends[edge][1] - starts[edge][1]
+                candidates.sort(
+                    key=lambda e: du * (ends[e][1] - starts[e][1]) - dv * (ends[e][0] - starts[e][0])
+                )
+            edge = candidates[0]
+        rings.append(np.array(ring, dtype=np.float64))
+    return rings
+
+
+def rank_polygons(ranks: np.ndarray) -> dict[str, list[list[list[float]]]]:
+    """Trace the boundaries of each unit of a rank grid.
+
+    Parameters
+    ----------
+    ranks : np.ndarray
+        Rank grid of shape resolution.
+
+    Returns
+    -------
+    dict[str, list[list[list[float]]]]
+        For each rank, the list of closed rings bounding its areas, each a list of [u, v] points in grid steps along
+        the width and the height. Grid points are at integer coordinates, and boundaries follow the edges of the cells
+        around them, half way between grid points, so the units tile the section without gaps.
+        Outer rings are counter-clockwise and holes clockwise, so they can be filled with the even-odd or nonzero rule.
+    """
+    polygons = {}
+    for rank in np.unique(ranks):
+        rings = _boundary_rings(ranks == rank)
+        polygons[str(rank)] = [(_remove_collinear_points(ring) - 0.5).tolist() for ring in rings]
+    return polygons
 
 
 def calculate_resolution(width: float, height: float, res: int) -> tuple[int, int]:
@@ -113,17 +215,52 @@ def compute_map_points(
     y_map_range = np.linspace(box.ymin, box.ymax, resolution[1])
     y, x = np.meshgrid(y_map_range, x_map_range)
     xy = np.stack([x.ravel(), y.ravel()], axis=1)
-    z = model.topography.evaluate_z(xy)
+    z = evaluate_z(model.topography, xy)
     xyz = np.column_stack((xy, z))
     return xyz
 
 
+def _evaluate_ranks_at(
+    evaluator,
+    xyz: np.ndarray,
+    indices: np.ndarray,
+    model: GeologicalModel,
+    topography: bool,
+    topography_potential: np.ndarray | None,
+) -> np.ndarray:
+    """Evaluate the ranks of some of the points of a cross section"""
+    if not topography:
+        return evaluator(xyz[indices])
+    potential = topography_potential[indices] if topography_potential is not None else None
+    return evaluate_ranks(evaluator, xyz[indices], model.topography, potential)
+
+
+def _boundary_fields(xyz: np.ndarray, model: GeologicalModel, topography_potential: np.ndarray | None):
+    """Fields whose zero level bounds units on a cross section: the faults, and the topography if given. None if
+    there is none"""
+    if not model.faults and topography_potential is None:
+        return None
+
+    def evaluate(indices: np.ndarray) -> np.ndarray:
+        points = xyz[indices]
+        fields = [np.asarray(fault(points)).reshape(-1) for fault in model.faults.values()]
+        if topography_potential is not None:
+            fields.append(topography_potential[indices])
+        return np.column_stack(fields)
+
+    return evaluate
+
+
 def compute_cross_section_ranks(
     xyz: np.ndarray,
     resolution: tuple[int, int],
     model: GeologicalModel,
     topography: bool = False,
-) -> list:
+    topography_potential: np.ndarray = None,
+    output: RankOutputMode = RankOutputMode.GRID,
+    tolerance: int = None,
+    evaluator=None,
+) -> np.ndarray | dict:
     """Compute formation ranks for a geological cross section.
 
     Parameters
@@ -137,157 +274,235 @@ def compute_cross_section_ranks(
     topography : bool, optional
         If True, the topography of the geological model will be used for rank evaluation.
         Default is False.
+    topography_potential : np.ndarray, optional
+        Topography potential at the points, shared with the fault intersections of the same section.
+        Only used with topography.
+    output : RankOutputMode, optional
+        Return the rank grid (default), or the boundary rings of each unit.
+    tolerance : int, optional
+        If greater than 1, ranks are evaluated adaptively, starting from a lattice with this step in grid points and
+        refining where ranks, faults or the topography change, see refine_ranks. Units thinner than the step may be
+        missed. By default, every point is evaluated.
+    evaluator : optional
+        Compiled rank evaluator of the model, with its implicit topography if topography is True. Created from the
+        model if not given.
 
     Returns
     -------
-    list
-        A list of ranks after evaluation, reshaped to resolution.
+    np.ndarray | dict
+        An array of ranks after evaluation, reshaped to resolution. With polygons output, a dict from rank to rings,
+        see rank_polygons.
 
     Notes
     -----
     For top-down views the topography should be False and for vertical slices it should be True.
+    With topography, points above the highest DEM corner of their cell are set to the sky rank without evaluation.
     """
 
-    cppmodel = from_GeoModeller(model)
-    if topography:
-        topography = model.implicit_topography()
-        evaluator = make_evaluator(cppmodel, topography)
+    if evaluator is None and topography:
+        evaluator = make_evaluator(from_GeoModeller(model), model.implicit_topography())
+    elif evaluator is None:
+        evaluator = make_evaluator(from_GeoModeller(model))
+
+    if tolerance is not None and tolerance > 1:
+        ranks, _ = refine_ranks(
+            lambda indices: _evaluate_ranks_at(evaluator, xyz, indices, model, topography, topography_potential),
+            resolution,
+            tolerance,
+            _boundary_fields(xyz, model, topography_potential if topography else None),
+        )
+        ranks = ranks.ravel()
+    elif topography:
+        # points above the topography are sky without evaluation
+        ranks = evaluate_ranks(evaluator, xyz, model.topography, topography_potential)
     else:
-        evaluator = make_evaluator(cppmodel)
+        ranks = evaluator(xyz)
 
     is_base = model.pile.reference == "base"
     rank_offset = -1 if is_base else 0
 
-    ranks = evaluator(xyz) + rank_offset
+    ranks = ranks + rank_offset
     ranks.shape = resolution
-    ranks = ranks.tolist()
+    if output == RankOutputMode.POLYGONS:
+        ranks = rank_polygons(ranks)
     profile_step("ranks")
     return ranks
 
 
-def project_hydro_features_on_slice(
-    lower_left: np.ndarray,
-    upper_right: np.ndarray,
-    xyz: np.ndarray,
-    spring_map: dict,
-    drillhole_map: dict[str, Box],
-    gwb_meshes: dict[str, list[bytes]],
+def compute_borehole_logs(
+    boreholes: dict[str, list[dict[str, float]]], model: GeologicalModel, samples: int
+) -> dict[str, list[list[float | int]]]:
+    """Compute the rank logs of virtual boreholes, with a single evaluation for all of them.
+
+    Parameters
+    ----------
+    boreholes : dict[str, list[dict[str, float]]]
+        Borehole ID to its polyline, a list of {"x", "y", "z"} points from the collar down.
+    model : gmlib.GeologicalModel3D.GeologicalModel
+        The GeologicalModel from gmlib to use for the formation rank evaluation.
+    samples : int
+        Number of samples along each borehole.
+
+    Returns
+    -------
+    dict[str, list[list[float | int]]]
+        Borehole ID to intervals [from depth, to depth, rank], with depths along the borehole from its first point.
+        Above the topography, the rank is the sky rank like on cross sections.
+    """
+    if not boreholes:
+        return {}
+    polylines = [[[p["x"], p["y"], p["z"]] for p in polyline] for polyline in boreholes.values()]
+    xyz, depths, lengths = sample_polylines(polylines, samples)
+
+    evaluator = make_evaluator(from_GeoModeller(model), model.implicit_topography())
+    potential = topography_potential(model.topography, xyz)
+    ranks = evaluate_ranks(evaluator, xyz, model.topography, potential)
+    if model.pile.reference == "base":
+        ranks = ranks - 1
+    ranks = ranks.reshape(depths.shape)
+
+    logs = {
+        borehole_id: rank_intervals(depths[n], ranks[n], lengths[n])
+        for n, borehole_id in enumerate(boreholes)
+    }
+    profile_step("borehole_logs")
+    return logs
+
+
+class HydroFeatures:
+    """Springs and drillholes of a job, packed into arrays once to be projected on every cross section at once"""
+
+    def __init__(self, spring_map: dict | None, drillhole_map: dict | None):
+        spring_map = spring_map or {}
+        drillhole_map = drillhole_map or {}
+        self.spring_ids = list(spring_map)
+        self.springs = np.array(
+            [[p["x"], p["y"], p["z"]] for p in spring_map.values()], dtype=np.float64
+        ).reshape(-1, 3)
+        self.drillhole_ids = list(drillhole_map)
+        lines = [Box(**line) for line in drillhole_map.values()]
+        self.drillhole_starts = np.array(
+            [[line.xmin, line.ymin, line.zmin] for line in lines], dtype=np.float64
+        ).reshape(-1, 3)
+        self.drillhole_ends = np.array(
+            [[line.xmax, line.ymax, line.zmax] for line in lines], dtype=np.float64
+        ).reshape(-1, 3)
+
+
+def hydro_projection_plane(b: Box) -> tuple[np.ndarray, np.ndarray]:
+    """Lower left and upper right corners of the plane hydrogeological features are projected on, for a cross section
+    segment"""
+    lower_left = np.array([b.xmin, b.ymin, b.zmin])
+    upper_right = np.array([b.xmax, b.ymax, b.zmax])
+
+    # fix for drillholes slices where there is no x and y extent (fully vertical)
+    if round(b.xmax) - round(b.xmin) == 0 and round(b.ymax) - round(b.ymin) == 0:
+        lower_left[0] -= 1
+        upper_right[0] += 1
+        lower_left[1] -= 1
+        upper_right[1] += 1
+    return lower_left, upper_right
+
+
+def _project_on_planes(
+    points: np.ndarray, origins: np.ndarray, normals: np.ndarray, max_dist_proj: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """Project points on every plane, in section coordinates.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Array of shape (planes, points, 2) of the [distance along the section, elevation] of the projected points,
+        and array of shape (planes, points) of whether the points are closer to the plane than max_dist_proj.
+    """
+    offsets = points[np.newaxis, :, :] - origins[:, np.newaxis, :]
+    dist_to_plane = np.einsum("spk,sk->sp", offsets, normals)
+    projected = points[np.newaxis, :, :] - dist_to_plane[:, :, np.newaxis] * normals[:, np.newaxis, :]
+    delta = projected[:, :, :2] - origins[:, np.newaxis, :2]
+    coordinates = np.stack(
+        [np.sqrt(delta[:, :, 0] ** 2 + delta[:, :, 1] ** 2), projected[:, :, 2]], axis=-1
+    )
+    return coordinates, np.abs(dist_to_plane) < max_dist_proj
+
+
+def project_hydro_features(
+    features: HydroFeatures,
+    lower_lefts: np.ndarray,
+    upper_rights: np.ndarray,
     max_dist_proj: float,
-) -> tuple[dict, dict, list]:
-    """Project hydrogeological features onto a vertical cross section plane.
+) -> list[tuple[dict, dict]]:
+    """Project springs and drillholes onto many vertical cross section planes at once.
 
     Parameters
     ----------
-    lower_left : np.ndarray
-        The lower left corner coordinates of the cross section
-    upper_right : np.ndarray
-        The upper right corner coordinates of the cross section
-    xyz : np.ndarray
-        Array of shape (N, 3) containing the (x, y, z) coordinates of points of the cross section
-    spring_map : dict
-        Dictionary of spring data with coordinates
-    drillhole_map : dict
-        Dictionary of drill hole data with start and end coordinates
-    gwb_meshes : dict[str, list[str]]
-        Dictionary containing groundwater body IDs and their corresponding mesh strings in OFF or Draco format
+    features : HydroFeatures
+        The springs and drillholes to project.
+    lower_lefts : np.ndarray
+        Array of shape (S, 3) of the lower left corners of the cross sections, see hydro_projection_plane
+    upper_rights : np.ndarray
+        Array of shape (S, 3) of the upper right corners of the cross sections
     max_dist_proj : float
         Maximum projection distance for features
 
     Returns
     -------
-    drillholes_line : dict
-        Dictionary of projected drill holes with start and end coordinates
-    springs_point : dict
-        Dictionary of projected springs with coordinates
-    matrix_gwb_combine : list
-        List of groundwater body values for each point in rank_matrix
-        each value corresponds to the groundwater body ID for that point
+    list[tuple[dict, dict]]
+        For each cross section, the projected drill holes with start and end coordinates, and the projected springs
+        with coordinates, as [distance along the section, elevation]. Drill holes are kept if either end is close
+        enough to the plane.
     """
-
-    # Create a third point to define the plane
+    # Create a third point to define each plane
     # The third point is the same x and y as the lower left corner, but z is the upper right corner
     # This is possible because cross sections are always parallel to the z axis
-    p0 = np.array(lower_left)
-    p1 = np.array(upper_right)
-    p2 = np.array([lower_left[0], lower_left[1], upper_right[2]])
-
-    # Pre-compute plane normal vector once
-    plane_normal = np.cross(np.subtract(p1, p0), np.subtract(p2, p0))
-    plane_normal = plane_normal / np.linalg.norm(plane_normal)
-
-    def _proj_point_on_plane(q: np.ndarray) -> tuple[list, bool]:
-        """Project a point onto the section plane and check if it's within threshold.
-
-        Parameters
-        ----------
-        q : np.ndarray
-            The 3D point to project
-
-        Returns
-        -------
-        Tuple[list, bool]
-            Projected 2D coordinates and boolean indicating if projection is valid
-        """
-        q_to_p0 = np.subtract(q, p0)
-        dist_to_plane = np.dot(q_to_p0, plane_normal)
-        q_proj = np.subtract(q, dist_to_plane * plane_normal)
-        proj_distance = np.linalg.norm(np.subtract(q, q_proj))
-        valid = proj_distance < max_dist_proj
-        return _transform_value(q_proj), valid
-
-    def _transform_value(q: np.ndarray) -> list:
-        """Transform a 3D point into 2D section coordinates.
-
-        Parameters
-        ----------
-        q : np.ndarray
-            The 3D point to transform
-
-        Returns
-        -------
-        list
-            2D coordinates [distance_along_section, elevation]
-        """
-        delta_x = q[0] - p0[0]
-        delta_y = q[1] - p0[1]
-        return [math.sqrt(delta_x**2 + delta_y**2), q[2]]
+    p0 = np.asarray(lower_lefts, dtype=np.float64).reshape(-1, 3)
+    p1 = np.asarray(upper_rights, dtype=np.float64).reshape(-1, 3)
+    p2 = np.column_stack([p0[:, 0], p0[:, 1], p1[:, 2]])
+    normals = np.cross(p1 - p0, p2 - p0)
+    normals = normals / np.linalg.norm(normals, axis=1, keepdims=True)
+
+    springs, springs_valid = _project_on_planes(features.springs, p0, normals, max_dist_proj)
+    starts, starts_valid = _project_on_planes(features.drillhole_starts, p0, normals, max_dist_proj)
+    ends, ends_valid = _project_on_planes(features.drillhole_ends, p0, normals, max_dist_proj)
+    drillholes_valid = starts_valid | ends_valid
+
+    projections = []
+    for s in range(p0.shape[0]):
+        drillholes_line = {
+            features.drillhole_ids[i]: [starts[s, i].tolist(), ends[s, i].tolist()]
+            for i in np.flatnonzero(drillholes_valid[s])
+        }
+        springs_point = {
+            features.spring_ids[i]: springs[s, i].tolist() for i in np.flatnonzero(springs_valid[s])
+        }
+        projections.append((drillholes_line, springs_point))
+    return projections
+
+
+def project_gwbs_on_slice(xyz: np.ndarray, gwb_meshes: dict[str, list[bytes]]) -> np.ndarray | list:
+    """Find the groundwater body of each point of a cross section.
+
+    Parameters
+    ----------
+    xyz : np.ndarray
+        Array of shape (N, 3) containing the (x, y, z) coordinates of points of the cross section
+    gwb_meshes : dict[str, list[str]]
+        Dictionary containing groundwater body IDs and their corresponding mesh strings in OFF or Draco format
 
+    Returns
+    -------
+    np.ndarray | list
+        Array of groundwater body values for each point in rank_matrix, or an empty list without groundwater bodies
+        each value corresponds to the groundwater body ID for that point
+    """
     matrix_gwb = []
-    drillholes_line = {}
-    springs_point = {}
-    profile_step("hydro_setup")
-
-    if drillhole_map:
-        for d_id, line in drillhole_map.items():
-            line = Box(**line)
-            start_point = np.array([line.xmin, line.ymin, line.zmin])
-            end_point = np.array([line.xmax, line.ymax, line.zmax])
-
-            s_proj, s_valid = _proj_point_on_plane(start_point)
-            e_proj, e_valid = _proj_point_on_plane(end_point)
-
-            if s_valid or e_valid:
-                drillholes_line[d_id] = [s_proj, e_proj]
-    profile_step("hydro_project_drillholes")
-
-    if spring_map:
-        for s_id, p in spring_map.items():
-            point = np.array([p["x"], p["y"], p["z"]])
-            p_proj, valid = _proj_point_on_plane(point)
-            if valid:
-                springs_point[s_id] = p_proj
-    profile_step("hydro_project_springs")
-
-    points_polydata = pv.PolyData(xyz)
+
     # Test each point of the cross section against groundwater body meshes
+    # The same meshes are tested against every segment, so they are decoded once and cached
     for gwb_id, meshes in gwb_meshes.items():
         gwb_id_int = int(gwb_id)
         for data in meshes:
-            mesh = read_mesh_to_polydata(data)
-            inside_points = points_polydata.select_enclosed_points(
-                mesh, tolerance=0.00001
-            )
-            selected_points = inside_points["SelectedPoints"].astype(np.uint16)
+            mesh = read_cached_mesh(data)
+            selected_points = select_enclosed_points(xyz, mesh).astype(np.uint16)
             matrix_gwb.append(selected_points * gwb_id_int)
 
     # Combine all gwb values into one matrix
@@ -299,16 +514,15 @@ def project_hydro_features_on_slice(
         if len(matrix_gwb) > 1:
             nonzero_mask = stacked > 0
             row_has_nonzero = np.any(nonzero_mask, axis=1)
-            # Cast to int from int8 to be able to serialize in json
             result = np.zeros(len(matrix_gwb[0]), dtype=np.int32)
 
             for i in np.where(row_has_nonzero)[0]:
                 first_nonzero_idx = np.argmax(nonzero_mask[i])
                 result[i] = stacked[i, first_nonzero_idx]
 
-            matrix_gwb_combine = result.tolist()
+            matrix_gwb_combine = result
         else:
-            matrix_gwb_combine = stacked.astype(np.int32).tolist()
+            matrix_gwb_combine = stacked.astype(np.int32)
     profile_step("hydro_project_gwbs")
 
-    return drillholes_line, springs_point, matrix_gwb_combine
+    return matrix_gwb_combine
@@ -1,5 +1,4 @@
 import numpy as np
-from collections import defaultdict
 
 from forgeo.gmlib.GeologicalModel3D import GeologicalModel, Box
 
@@ -7,29 +6,36 @@ from skimage.measure import marching_cubes
 from forgeo.gmlib.architecture import from_GeoModeller, make_evaluator, grid
 from forgeo.gmlib.utils.tools import BBox3
 
-from .profiler import profile_step
-from .mesh_io.mesh_io import generate_mesh
+from .profiler import profile_step, get_current_profiler
+from .cache.ranks import SAMPLING_NODES, cached_ranks
+from .mesh_io.mesh_io import MeshFormat, generate_mesh, split_mesh_by_part
 from .rigs import extract
+from .sky_culling import RANK_SKY, evaluate_ranks
 
 
-# Constants
-RANK_SKY = 0
-
-
-def compute_ranks(res: tuple[int, int, int], model: GeologicalModel, box: Box = None):
+def compute_ranks(res: tuple[int, int, int], model: GeologicalModel, box: Box = None, model_hash: str = None):
     """"
     :param res: resolution (supposed to be a tuple)
     :param model: gmlib.GeologicalModel object
     :param box: if not given will default to the bounding box of model
+    :param model_hash: hash of the model inputs. If given, ranks are read from and stored in the rank grid cache
     """
     if box is None:
         box = model.bbox()
     else:
         box = BBox3(box.xmin, box.xmax, box.ymin, box.ymax, box.zmin, box.zmax)
-    cppmodel = from_GeoModeller(model)
-    topography = model.implicit_topography()
-    evaluator = make_evaluator(cppmodel, topography)
-    return evaluator(grid(box, res))
+
+    def evaluate():
+        cppmodel = from_GeoModeller(model)
+        topography = model.implicit_topography()
+        evaluator = make_evaluator(cppmodel, topography)
+        return evaluate_ranks(evaluator, grid(box, res), model.topography)
+
+    ranks, is_cached = cached_ranks(model_hash, box, res, SAMPLING_NODES, evaluate)
+    profiler = get_current_profiler()
+    if profiler:
+        profiler.set_metadata("ranks_cached", is_cached)
+    return ranks
 
 
 def rescale_to_grid(verts, box: Box, shape: tuple[int, int, int]):
@@ -44,16 +50,22 @@ def rescale_to_grid(verts, box: Box, shape: tuple[int, int, int]):
 
 
 def generate_volumes(
-    model: GeologicalModel, shape: tuple[int, int, int], box: Box
+    model: GeologicalModel,
+    shape: tuple[int, int, int],
+    box: Box,
+    mesh_format: MeshFormat = MeshFormat.DRACO,
+    model_hash: str = None,
 ) -> {"mesh": dict[str, bytes], "fault": dict[str, bytes]}:
-    """Generates topologically valid meshes for each unit in the model. Meshes are output in OFF format.
+    """Generates topologically valid meshes for each unit in the model. Meshes are output in the given format.
 
     Parameters:
         model: A valid GeologicalModel with a loaded surface model (DEM).
         shape: Number of samples for marching cubes (x,y,z)
         box: Custom box
+        mesh_format: Encoding of the output meshes. Defaults to Draco
+        model_hash: Hash of the model inputs, to reuse the rank grid of a previous meshes job. Not cached when not given
     """
-    ranks = compute_ranks(shape, model, box)
+    ranks = compute_ranks(shape, model, box, model_hash)
     ranks.shape = shape
 
     # FIXME: it would be cheaper to retrieve the ranks from the stratigraphy. Something like:
@@ -97,28 +109,33 @@ def generate_volumes(
         scaled_verts = rescale_to_grid(verts, box, shape)
         profile_step('marching_cubes')
 
-        mesh = generate_mesh(scaled_verts, faces)
+        mesh = generate_mesh(scaled_verts, faces, mesh_format=mesh_format)
         out_files["mesh"][str(rank_id)] = mesh
         profile_step('generate_mesh')
 
     if len(model.faults.items()) > 0:
         # don't waste time generating faults if there are none
         # the setup for the generation takes a considerable amount of time, even if there is nothing to generate
-        out_files['fault'] = generate_faults_files(model, shape, box)
+        out_files['fault'] = generate_faults_files(model, shape, box, mesh_format)
 
     return out_files
 
 
 # Currently unused, for future reference and testing. Drop-in replacement for "generate_volumes", but currently returns surfaces and not volumes (not yet implemented in rigs)
 def generate_rigs_volumes(
-    model: GeologicalModel, shape: tuple[int, int, int], box: Box = None
+    model: GeologicalModel,
+    shape: tuple[int, int, int],
+    box: Box = None,
+    mesh_format: MeshFormat = MeshFormat.DRACO,
+    model_hash: str = None,
 ) -> {"mesh": dict[str, bytes], "fault": dict[str, bytes]}:
-    """Generates topologically valid meshes for each unit in the model. Meshes are output in Draco format.
+    """Generates topologically valid meshes for each unit in the model. Meshes are output in Draco format by default.
 
     Parameters:
         model: A valid GeologicalModel with a loaded surface model (DEM).
         shape: Size of the regular grid of tesselated cubes. (x,y,z)
         box: Custom box. Optional
+        mesh_format: Encoding of the output meshes. Defaults to Draco
     """
     out_files = {"mesh": {}, "fault": {}}
     is_top = model.pile.reference == "top"
@@ -138,12 +155,11 @@ def generate_rigs_volumes(
     v, f, parts, surface_names = extract(model, shape, box)
 
     # The returned data is one big list of vertices and faces for all parts. We can separate the faces by part using an identifier per face.
-    grouped = defaultdict(list)
-    for i, fi in enumerate(f):
-        grouped[parts[i]].append(fi)
+    # Each part gets its own compact vertex array, so it doesn't carry the vertices of every other part.
+    split = split_mesh_by_part(v, f, parts)
 
     # Then separate the result into the relevant units/faults and generate Draco meshes for each
-    for part in grouped.keys():
+    for part, (part_verts, part_faces) in split.items():
         try:
             prefixed_name = surface_names[part]
             print(f"Extracting part {part} with name {prefixed_name}")
@@ -152,7 +168,7 @@ def generate_rigs_volumes(
             print(f"Ignoring part {part} with unknown name")
             continue
 
-        mesh = generate_mesh(v, grouped[part])
+        mesh = generate_mesh(part_verts, part_faces, mesh_format=mesh_format)
 
         # We can know which unit/fault the part represents, as the identifier is the index in surface_names
         # Since units and faults are mixed, we need to figure out which type this is
@@ -175,7 +191,10 @@ def generate_rigs_volumes(
 
 
 def generate_faults_files(
-    model: GeologicalModel, shape: tuple[int, int, int], box: Box = None
+    model: GeologicalModel,
+    shape: tuple[int, int, int],
+    box: Box = None,
+    mesh_format: MeshFormat = MeshFormat.DRACO,
 ) -> dict[str, bytes]:
     # For now, the resolution of faults is 10x lower than the mesh, with a minimum of 10, as with RIGS, we see no improvements with increased resolution except for conformity with the DEM and higher resolutions are extremely slow
     rigs_shape = (
@@ -188,17 +207,16 @@ def generate_faults_files(
     profile_step('tesselate_faults')
 
     # The returned data is one big list of vertices and faces for all parts. We can separate the faces by part using an identifier per face.
-    grouped = defaultdict(list)
-    for i, fi in enumerate(f):
-        grouped[parts[i]].append(fi)
+    # Each part gets its own compact vertex array, so it doesn't carry the vertices of every other part.
+    split = split_mesh_by_part(v, f, parts)
 
     out_files = {}
 
-    for part in grouped.keys():
+    for part, (part_verts, part_faces) in split.items():
         # We can know which unit/fault the part represents, as the identifier is the index in surface_names
         # Here we only computed faults therefore we assume every returned part is a valid fault. There is a bit more checking if we compute both units & faults
         name = surface_names[part]
-        mesh = generate_mesh(v, grouped[part])
+        mesh = generate_mesh(part_verts, part_faces, mesh_format=mesh_format)
         out_files[name] = mesh
 
     profile_step("generate_mesh")
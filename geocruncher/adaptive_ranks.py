@@ -0,0 +1,122 @@
+"""
+Adaptive evaluation of rank grids. Most of a cross section lies inside homogeneous units, so the ranks are first
+evaluated on a coarse lattice, and only the blocks whose corners differ are recursively split and evaluated further.
+Blocks with identical corners are filled with their corner rank without evaluation.
+
+A unit thinner than the lattice step can fall entirely between the corners of a block and be missed. The lattice step
+is the tolerance: with a step of 1, every point is evaluated. Blocks are also split where boundary fields, such as
+the topography and fault potentials, change sign between their corners, so that thin slivers along those boundaries
+are found.
+"""
+from typing import Callable
+
+import numpy as np
+
+
+def _lattice(size: int, step: int) -> np.ndarray:
+    """Indices of the lattice nodes along an axis, always including both ends"""
+    return np.unique(np.append(np.arange(0, size, step), size - 1))
+
+
+def _halves(start: np.ndarray, stop: np.ndarray) -> list[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Halves of closed intervals, as (start, stop, is valid). Intervals of length 1 or less are not split, they are
+    their first half and have no valid second half"""
+    is_split = stop - start > 1
+    middle = np.where(is_split, (start + stop) // 2, stop)
+    return [(start, middle, np.ones_like(is_split)), (middle, stop, is_split)]
+
+
+def normalize_tolerance(tolerance) -> int:
+    """Lattice step of a rank tolerance option, 1 when not given. Raises a ValueError unless it is an integer of at
+    least 1"""
+    if tolerance is None:
+        return 1
+    if isinstance(tolerance, bool) or not isinstance(tolerance, (int, np.integer)) or tolerance < 1:
+        raise ValueError(f"The rank tolerance must be an integer of at least 1, not {tolerance!r}")
+    return int(tolerance)
+
+
+def refine_ranks(
+    evaluate: Callable[[np.ndarray], np.ndarray],
+    resolution: tuple[int, int],
+    step: int,
+    boundaries: Callable[[np.ndarray], np.ndarray] = None,
+) -> tuple[np.ndarray, int]:
+    """Evaluate a rank grid adaptively.
+
+    Parameters
+    ----------
+    evaluate : Callable[[np.ndarray], np.ndarray]
+        Evaluates the ranks at flat indices of the grid, in C order.
+    resolution : tuple[int, int]
+        Shape of the grid.
+    step : int
+        Step of the initial lattice, in grid points. 1 evaluates every point.
+    boundaries : Callable[[np.ndarray], np.ndarray], optional
+        Evaluates boundary fields at flat indices of the grid, as an array of shape (N, number of fields). Blocks are
+        split where a field changes sign between their corners.
+
+    Returns
+    -------
+    tuple[np.ndarray, int]
+        The ranks of shape resolution, and the number of evaluated points.
+    """
+    nx, ny = resolution
+    is_evaluated = np.zeros(resolution, dtype=bool)
+    ranks = None
+    sides = None
+
+    def evaluate_at(i: np.ndarray, j: np.ndarray) -> None:
+        nonlocal ranks, sides
+        i, j = i.ravel(), j.ravel()
+        missing = ~is_evaluated[i, j]
+        indices = np.unique(np.ravel_multi_index((i[missing], j[missing]), resolution))
+        if indices.size == 0:
+            return
+        values = np.asarray(evaluate(indices))
+        if ranks is None:
+            ranks = np.zeros(resolution, dtype=values.dtype)
+        ranks.flat[indices] = values
+        if boundaries is not None:
+            fields = np.asarray(boundaries(indices)).reshape(indices.size, -1)
+            if sides is None:
+                sides = np.zeros(resolution + (fields.shape[1],), dtype=bool)
+            sides.reshape(-1, fields.shape[1])[indices] = fields > 0
+        is_evaluated.flat[indices] = True
+
+    i_nodes = _lattice(nx, max(step, 1))
+    j_nodes = _lattice(ny, max(step, 1))
+    evaluate_at(*np.meshgrid(i_nodes, j_nodes, indexing="ij"))
+    if i_nodes.size == 1 or j_nodes.size == 1:
+        # a single row or column of nodes, refine it as blocks of zero width
+        i_nodes = np.append(i_nodes, i_nodes[-1]) if i_nodes.size == 1 else i_nodes
+        j_nodes = np.append(j_nodes, j_nodes[-1]) if j_nodes.size == 1 else j_nodes
+
+    # blocks are closed ranges of indices [i0, i1] x [j0, j1], sharing their edges with their neighbours
+    i0, j0 = (a.ravel() for a in np.meshgrid(i_nodes[:-1], j_nodes[:-1], indexing="ij"))
+    i1, j1 = (a.ravel() for a in np.meshgrid(i_nodes[1:], j_nodes[1:], indexing="ij"))
+
+    while i0.size > 0:
+        corners = np.stack([ranks[i0, j0], ranks[i1, j0], ranks[i0, j1], ranks[i1, j1]])
+        is_uniform = np.all(corners == corners[0], axis=0)
+        if sides is not None:
+            corner_sides = np.stack([sides[i0, j0], sides[i1, j0], sides[i0, j1], sides[i1, j1]])
+            is_uniform &= np.all(corner_sides == corner_sides[0], axis=(0, 2))
+
+        for a, b, c, d, rank in zip(i0[is_uniform], i1[is_uniform], j0[is_uniform], j1[is_uniform],
+                                    corners[0, is_uniform]):
+            block = np.s_[a:b + 1, c:d + 1]
+            # points on the edges may be evaluated by a neighbour block, the evaluation wins
+            ranks[block][~is_evaluated[block]] = rank
+
+        # blocks of at most 2 x 2 points only have corners, the others are split in halves along each axis
+        is_split = ~is_uniform & ((i1 - i0 > 1) | (j1 - j0 > 1))
+        children = []
+        for i_start, i_stop, i_valid in _halves(i0[is_split], i1[is_split]):
+            for j_start, j_stop, j_valid in _halves(j0[is_split], j1[is_split]):
+                valid = i_valid & j_valid
+                children.append((i_start[valid], i_stop[valid], j_start[valid], j_stop[valid]))
+        i0, i1, j0, j1 = (np.concatenate(bounds) for bounds in zip(*children))
+        evaluate_at(np.stack([i0, i1, i0, i1]), np.stack([j0, j0, j1, j1]))
+
+    return ranks, int(is_evaluated.sum())
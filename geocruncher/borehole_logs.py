@@ -0,0 +1,62 @@
+"""
+Rank logs of virtual boreholes. Boreholes are sampled along their polylines only, instead of evaluating a whole
+vertical cross section around them, and the ranks are returned as intervals of depth along the borehole.
+"""
+import numpy as np
+
+
+def sample_polylines(polylines: list[np.ndarray], samples: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Sample polylines at regular intervals along their length, both ends included.
+
+    Parameters
+    ----------
+    polylines : list[np.ndarray]
+        Polylines of shape (N, 3), with N >= 1.
+    samples : int
+        Number of samples per polyline, at least 2.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray]
+        Points of shape (len(polylines) * samples, 3), ordered by polyline, their depths along their polyline of shape
+        (len(polylines), samples), and the lengths of the polylines.
+    """
+    samples = max(samples, 2)
+    points = np.empty((len(polylines), samples, 3))
+    depths = np.empty((len(polylines), samples))
+    lengths = np.empty(len(polylines))
+    for n, polyline in enumerate(polylines):
+        polyline = np.asarray(polyline, dtype=np.float64).reshape(-1, 3)
+        distances = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(polyline, axis=0), axis=1))])
+        lengths[n] = distances[-1]
+        depths[n] = np.linspace(0.0, lengths[n], samples)
+        for axis in range(3):
+            points[n, :, axis] = np.interp(depths[n], distances, polyline[:, axis])
+    return points.reshape(-1, 3), depths, lengths
+
+
+def rank_intervals(depths: np.ndarray, ranks: np.ndarray, length: float) -> list[list[float | int]]:
+    """Run-length encode the ranks sampled along a borehole.
+
+    Parameters
+    ----------
+    depths : np.ndarray
+        Increasing depths of the samples along the borehole.
+    ranks : np.ndarray
+        Rank at each sample.
+    length : float
+        Length of the borehole.
+
+    Returns
+    -------
+    list[list[float | int]]
+        Intervals [from depth, to depth, rank] covering the whole borehole. Changes of rank are placed halfway between
+        the samples where they happen.
+    """
+    ranks = np.asarray(ranks)
+    changes = np.flatnonzero(ranks[1:] != ranks[:-1]) + 1
+    boundaries = np.concatenate([[0.0], 0.5 * (depths[changes - 1] + depths[changes]), [length]])
+    return [
+        [float(boundaries[n]), float(boundaries[n + 1]), int(ranks[start])]
+        for n, start in enumerate(np.concatenate([[0], changes]))
+    ]
@@ -0,0 +1,61 @@
+"""
+Cache for computation results that can be reused across jobs, such as groundwater bodies for unchanged unit meshes.
+Configured using environment variables. See the CacheConfig class.
+"""
+import hashlib
+import json
+from typing import Optional
+
+from .config import CacheConfig
+from .storage import CacheStorage, DiskStorage, MemoryStorage, RedisStorage
+
+_storage = CacheConfig().create_storage()
+
+
+def get_cache() -> Optional[CacheStorage]:
+    """Get the configured cache storage, or None if caching is disabled"""
+    return _storage
+
+
+def content_hash(*parts: bytes | str) -> str:
+    """Hash the given parts into a cache key component"""
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        # prefix each part with its length, so the parts can't be confused with each other
+        h.update(len(part).to_bytes(8, 'little'))
+        h.update(part)
+    return h.hexdigest()
+
+
+def pack_entry(header: dict, blobs: list[bytes | str]) -> bytes:
+    """Pack a JSON serializable header and binary blobs into a single cache value"""
+    blobs = [b.encode('utf-8') if isinstance(b, str) else b for b in blobs]
+    header = dict(header, blob_sizes=[len(b) for b in blobs])
+    encoded = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    return len(encoded).to_bytes(4, 'little') + encoded + b''.join(blobs)
+
+
+def unpack_entry(value: bytes) -> tuple[dict, list[bytes]]:
+    """Unpack a cache value created with pack_entry, returning the header and the blobs"""
+    header_size = int.from_bytes(value[:4], 'little')
+    header = json.loads(value[4:4 + header_size])
+    blobs = []
+    offset = 4 + header_size
+    for size in header.pop('blob_sizes'):
+        blobs.append(value[offset:offset + size])
+        offset += size
+    return header, blobs
+
+
+__all__ = [
+    'CacheStorage',
+    'DiskStorage',
+    'MemoryStorage',
+    'RedisStorage',
+    'get_cache',
+    'content_hash',
+    'pack_entry',
+    'unpack_entry',
+]
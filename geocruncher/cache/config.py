@@ -0,0 +1,39 @@
+import os
+import tempfile
+from typing import Optional
+from .storage import CacheStorage, DiskStorage, MemoryStorage, RedisStorage
+
+
+class CacheConfig:
+    """Configuration for the result cache system"""
+
+    def __init__(self):
+        self.is_enabled = os.environ.get('CACHE_ENABLED', 'true').lower() == 'true'
+        self.storage_type = os.environ.get('CACHE_STORAGE_TYPE', 'memory').lower()
+        # Memory budget of the in-process storage, in bytes
+        self.max_bytes = int(os.environ.get('CACHE_MAX_BYTES', 256 * 1024 * 1024))
+        # Time to live of the redis and disk entries, in seconds. Set to 8 hours, like the celery results
+        self.ttl = int(os.environ.get('CACHE_TTL', 8 * 60 * 60))
+        # Directory of the disk storage
+        self.directory = os.environ.get('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'geocruncher-cache'))
+        self.redis_host = os.environ.get('REDIS_HOST', 'localhost')
+        self.redis_port = int(os.environ.get('REDIS_PORT', '6379'))
+        # Per default this uses db 4 because db 0, 1 and 2 are already
+        # getting used by geocruncher/celery and 3 by the profiler.
+        self.redis_db = int(os.environ.get('CACHE_REDIS_DB', '4'))
+        # Number of loaded models kept in memory by each worker process, for point queries
+        self.max_models = int(os.environ.get('CACHE_MAX_MODELS', '4'))
+
+    def create_storage(self) -> Optional[CacheStorage]:
+        """Create storage backend based on configuration"""
+        if not self.is_enabled:
+            return None
+
+        if self.storage_type == 'memory':
+            return MemoryStorage(self.max_bytes)
+        elif self.storage_type == 'disk':
+            return DiskStorage(self.directory, self.ttl)
+        elif self.storage_type == 'redis':
+            return RedisStorage(self.redis_host, self.redis_port, self.redis_db, self.ttl)
+        else:
+            raise ValueError(f"Unknown cache storage type: {self.storage_type}")
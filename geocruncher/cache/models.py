@@ -0,0 +1,94 @@
+"""
+Loaded geological models, kept in memory by project hash. Loading a model and compiling its evaluators takes much
+longer than evaluating a few points, so workers answering many small queries on the same project keep them. Each
+worker process has its own models.
+
+Recently used models are kept up to a maximum number, while the models of interactive sessions are pinned until their
+session is released.
+"""
+from collections import OrderedDict
+from typing import Callable
+
+from forgeo.gmlib.GeologicalModel3D import GeologicalModel
+from forgeo.gmlib.architecture import from_GeoModeller, make_evaluator
+
+from .config import CacheConfig
+
+
+class LoadedModel:
+    """A geological model, with its evaluators compiled on first use"""
+
+    def __init__(self, model: GeologicalModel):
+        self.model = model
+        self._cppmodel = None
+        self._evaluators = {}
+
+    def evaluator(self, topography: bool):
+        """Rank evaluator of the model, using its implicit topography or not"""
+        if topography not in self._evaluators:
+            if self._cppmodel is None:
+                self._cppmodel = from_GeoModeller(self.model)
+            if topography:
+                self._evaluators[topography] = make_evaluator(self._cppmodel, self.model.implicit_topography())
+            else:
+                self._evaluators[topography] = make_evaluator(self._cppmodel)
+        return self._evaluators[topography]
+
+
+_max_models = CacheConfig().max_models
+_models: OrderedDict[str, LoadedModel] = OrderedDict()
+
+
+def cached_model(project_hash: str, load: Callable[[], GeologicalModel]) -> tuple[LoadedModel, bool]:
+    """Get a loaded model by project hash, or load it, evicting the least recently used model if needed.
+
+    Returns
+    -------
+    tuple[LoadedModel, bool]
+        The loaded model, and whether it was already loaded.
+    """
+    loaded = _models.get(project_hash)
+    if loaded is not None:
+        _models.move_to_end(project_hash)
+        return loaded, True
+
+    loaded = LoadedModel(load())
+    if _max_models > 0:
+        _models[project_hash] = loaded
+        while len(_models) > _max_models:
+            _models.popitem(last=False)
+    return loaded, False
+
+
+# models pinned by session ID, with their project hash. Kept until released, whatever the size of the cache
+_sessions: dict[str, tuple[str, LoadedModel]] = {}
+
+
+def session_model(
+    session_id: str, project_hash: str, load: Callable[[], GeologicalModel]
+) -> tuple[LoadedModel, bool]:
+    """Get the model pinned by a session, or pin it. The model is shared with the other sessions and the cache when
+    they already loaded the same project.
+
+    Returns
+    -------
+    tuple[LoadedModel, bool]
+        The loaded model, and whether it was already loaded.
+    """
+    pinned = _sessions.get(session_id)
+    if pinned is not None and pinned[0] == project_hash:
+        return pinned[1], True
+
+    loaded = next((model for pinned_hash, model in _sessions.values() if pinned_hash == project_hash), None)
+    if loaded is None:
+        loaded = _models.get(project_hash)
+    is_loaded = loaded is not None
+    if not is_loaded:
+        loaded = LoadedModel(load())
+    _sessions[session_id] = (project_hash, loaded)
+    return loaded, is_loaded
+
+
+def release_session_model(session_id: str) -> None:
+    """Unpin the model of a session. It stays loaded while other sessions or the cache use it"""
+    _sessions.pop(session_id, None)
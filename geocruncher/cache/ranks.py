@@ -0,0 +1,84 @@
+"""
+Cache of rank grids. Evaluating the model on the grid is the most expensive part of the meshes and voxels computations,
+and clients resubmit the same job on an unchanged project, for instance to change the mesh format. Ranks are stored as
+the smallest integer type that fits them, compressed.
+
+Meshes sample the grid nodes and voxels sample the voxel centers, so each kind of job only reuses its own grids.
+"""
+import zlib
+from typing import Callable
+
+import numpy as np
+
+from . import get_cache, content_hash, pack_entry, unpack_entry
+
+# Sampling conventions of the grids. They are part of the key, since the same box and shape give different points
+# grid nodes, including the box bounds, in gmlib grid order
+SAMPLING_NODES = "nodes"
+# voxel centers, in numpy meshgrid order
+SAMPLING_CELLS = "cells"
+
+
+def encode_ranks(ranks: np.ndarray) -> bytes:
+    """Encode a rank grid as int8 or int16 when the values fit, compressed"""
+    ranks = np.asarray(ranks)
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if ranks.size == 0 or (ranks.min() >= info.min and ranks.max() <= info.max):
+            break
+    encoded = np.ascontiguousarray(ranks, dtype=dtype)
+    header = {"dtype": np.dtype(dtype).str, "shape": list(ranks.shape), "source_dtype": ranks.dtype.str}
+    return pack_entry(header, [zlib.compress(encoded.tobytes(), 1)])
+
+
+def decode_ranks(value: bytes) -> np.ndarray:
+    """Decode a rank grid encoded with encode_ranks, with its original type and shape"""
+    header, (data,) = unpack_entry(value)
+    ranks = np.frombuffer(zlib.decompress(data), dtype=np.dtype(header["dtype"]))
+    return ranks.astype(np.dtype(header["source_dtype"])).reshape(header["shape"])
+
+
+def rank_grid_key(model_hash: str, box, shape: tuple[int, int, int], sampling: str) -> str:
+    bounds = (box.xmin, box.xmax, box.ymin, box.ymax, box.zmin, box.zmax)
+    return "ranks:" + content_hash(model_hash, repr([float(b) for b in bounds]), repr(list(shape)), sampling)
+
+
+def cached_ranks(
+    model_hash: str | None,
+    box,
+    shape: tuple[int, int, int],
+    sampling: str,
+    evaluate: Callable[[], np.ndarray],
+) -> tuple[np.ndarray, bool]:
+    """Get the rank grid from the cache, or evaluate and store it.
+
+    Parameters
+    ----------
+    model_hash : str or None
+        Hash of the model inputs. Nothing is cached when None.
+    box
+        Bounds of the grid, with xmin, xmax, ymin, ymax, zmin and zmax attributes.
+    shape : tuple[int, int, int]
+        Number of samples along each axis.
+    sampling : str
+        Sampling convention, SAMPLING_NODES or SAMPLING_CELLS.
+    evaluate : Callable[[], np.ndarray]
+        Evaluates the ranks on a cache miss.
+
+    Returns
+    -------
+    tuple[np.ndarray, bool]
+        The ranks, and whether they were read from the cache.
+    """
+    cache = get_cache()
+    if cache is None or model_hash is None:
+        return evaluate(), False
+
+    key = rank_grid_key(model_hash, box, shape, sampling)
+    value = cache.get(key)
+    if value is not None:
+        return decode_ranks(value), True
+
+    ranks = evaluate()
+    cache.set(key, encode_ranks(ranks))
+    return ranks, False
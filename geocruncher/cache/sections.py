@@ -0,0 +1,71 @@
+"""
+Cache of intersections results per cross section segment. Users usually edit a few sections of a project and resubmit
+all of them, so only the new or changed segments are computed. Results are stored in the binary format of
+geocruncher.serialization, without losing precision.
+"""
+import json
+from typing import Callable
+
+import numpy as np
+
+from . import get_cache, content_hash
+from ..serialization import dumps_binary, loads_binary
+
+
+def hydro_inputs_hash(springs: dict | None, drillholes: dict | None, gwb_meshes: dict[str, list[bytes]]) -> str:
+    """Hash of the hydrogeological inputs projected on the sections"""
+    parts = [json.dumps(springs, sort_keys=True), json.dumps(drillholes, sort_keys=True)]
+    for gwb_id in sorted(gwb_meshes):
+        parts.append(gwb_id)
+        parts.extend(gwb_meshes[gwb_id])
+    return content_hash(*parts)
+
+
+def section_key(model_hash: str, box: dict, resolution: int, hydro_hash: str, output_modes: tuple[str, ...]) -> str:
+    """Key of a cross section segment. The output options change what is stored, so they are part of the key"""
+    bounds = json.dumps(box, sort_keys=True)
+    return "section:" + content_hash(model_hash, bounds, str(resolution), hydro_hash, *output_modes)
+
+
+def cached_section(
+    model_hash: str | None,
+    box: dict,
+    resolution: int,
+    hydro_hash: str,
+    output_modes: tuple[str, ...],
+    compute: Callable[[], dict],
+) -> tuple[dict, bool]:
+    """Get the results of a cross section segment from the cache, or compute and store them.
+
+    Parameters
+    ----------
+    model_hash : str or None
+        Hash of the model inputs. Nothing is cached when None.
+    box : dict
+        Bounds of the segment, as given to the computation.
+    resolution : int
+        Requested resolution of the sections.
+    hydro_hash : str
+        Hash of the hydrogeological inputs, see hydro_inputs_hash.
+    output_modes : tuple[str, ...]
+        Output options of the ranks and faults, such as their output modes.
+    compute : Callable[[], dict]
+        Computes the segment results on a cache miss.
+
+    Returns
+    -------
+    tuple[dict, bool]
+        The segment results, and whether they were read from the cache.
+    """
+    cache = get_cache()
+    if cache is None or model_hash is None:
+        return compute(), False
+
+    key = section_key(model_hash, box, resolution, hydro_hash, output_modes)
+    value = cache.get(key)
+    if value is not None:
+        return loads_binary(value), True
+
+    section = compute()
+    cache.set(key, dumps_binary(section, float_dtype=np.float64))
+    return section, False
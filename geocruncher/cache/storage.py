@@ -0,0 +1,105 @@
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+import redis
+
+
+class CacheStorage(ABC):
+    """Abstract base class for result cache backends"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: bytes) -> None:
+        pass
+
+
+class MemoryStorage(CacheStorage):
+    """In-process LRU storage, bounded by the total size of the stored values"""
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes) -> None:
+        if len(value) > self._max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = value
+            self._size += len(value)
+            while self._size > self._max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+
+class RedisStorage(CacheStorage):
+    """Redis storage, entries expire after the given time to live"""
+
+    def __init__(self, host: str, port: int = 6379, db: int = 4, ttl: int = 8 * 60 * 60):
+        # Per default this uses db 4 because db 0, 1 and 2 are already
+        # getting used by geocruncher/celery and 3 by the profiler.
+        self._client = redis.StrictRedis(host=host, port=port, db=db)
+        self._ttl = ttl
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self._client.get(key)
+        if value is not None:
+            # keep entries that are still in use alive
+            self._client.expire(key, self._ttl)
+        return value
+
+    def set(self, key: str, value: bytes) -> None:
+        self._client.set(key, value, ex=self._ttl)
+
+
+class DiskStorage(CacheStorage):
+    """Local disk storage, shared by the worker processes of a host. Entries expire after the given time to live
+    since their last use"""
+
+    def __init__(self, directory: str, ttl: int = 8 * 60 * 60):
+        self._directory = directory
+        self._ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, key.replace(':', '_').replace('/', '_'))
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self._ttl:
+                os.remove(path)
+                return None
+            with open(path, 'rb') as f:
+                value = f.read()
+            # keep entries that are still in use alive
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, value: bytes) -> None:
+        path = self._path(key)
+        # write to a temporary file first, so other processes never read a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(value)
+        os.replace(tmp_path, path)
@@ -5,20 +5,28 @@ These functions take data as input and return data as output, with no Disk inter
 
 import numpy as np
 import math
-from typing import TypedDict
+from typing import Callable, TypedDict
 from enum import Enum
 from forgeo.gmlib.GeologicalModel3D import GeologicalModel, Box
 
 from .ComputeIntersections import (
     compute_vertical_slice_points,
-    project_hydro_features_on_slice,
+    HydroFeatures,
+    hydro_projection_plane,
+    project_hydro_features,
+    project_gwbs_on_slice,
     compute_map_points,
     compute_cross_section_ranks,
+    compute_borehole_logs,
     calculate_resolution,
+    RankOutputMode,
 )
-from .fault_intersections import compute_fault_intersections
+from .fault_intersections import compute_fault_intersections, FaultOutputMode
 from .MeshGeneration import generate_volumes, generate_faults_files
 from .geomodeller_import import extract_project_data
+from .adaptive_ranks import normalize_tolerance
+from .sky_culling import evaluate_ranks
+from .topography_reader import topography_potential
 from .tunnel_shape_generation import (
     get_circle_segment,
     get_elliptic_segment,
@@ -27,6 +35,10 @@ from .tunnel_shape_generation import (
 )
 from .voxel_computation import Voxels
 from .geo_algo import GeoAlgo, GeoAlgoOutput
+from .mesh_io.mesh_io import MeshFormat
+from .cache import content_hash
+from .cache.models import cached_model, session_model
+from .cache.sections import cached_section, hydro_inputs_hash
 
 from .profiler import PROFILES, set_profiler, get_current_profiler, profile_step
 from .profiler.util import MetadataHelpers
@@ -75,7 +87,9 @@ class TunnelMeshesData(TypedDict):
 
 
 def compute_tunnel_meshes(
-    data: TunnelMeshesData, metadata: dict = None
+    data: TunnelMeshesData,
+    metadata: dict = None,
+    mesh_format: MeshFormat = MeshFormat.DRACO,
 ) -> dict[str, bytes]:
     """Compute Tunnel Meshes.
 
@@ -85,11 +99,13 @@ def compute_tunnel_meshes(
         The configuration data.
     metadata : dict, optional
         Optional metadata to include in profiler, such as project_id.
+    mesh_format : MeshFormat, optional
+        Encoding of the output meshes. Defaults to Draco.
 
     Returns
     -------
     dict[str, bytes]
-        A map from Tunnel name to OFF or Draco mesh file.
+        A map from Tunnel name to mesh file in the requested format.
     """
     output = {}
     # sub tunnel are a bit bigger to wrap main tunnel
@@ -124,6 +140,7 @@ def compute_tunnel_meshes(
             data["tStart"],
             data["idxEnd"],
             data["tEnd"],
+            mesh_format,
         )
         # write profiler result before moving on to the next tunnel
         get_current_profiler().save_results()
@@ -165,7 +182,11 @@ class MeshesResult(TypedDict):
 
 
 def compute_meshes(
-    data: MeshesData, xml: str, dem: str, metadata: dict = None
+    data: MeshesData,
+    xml: str,
+    dem: str,
+    metadata: dict = None,
+    mesh_format: MeshFormat = MeshFormat.DRACO,
 ) -> MeshesResult:
     """Compute Unit and Fault Meshes.
 
@@ -179,11 +200,13 @@ def compute_meshes(
         DEM datapoints as ASCIIGrid.
     metadata : dict, optional
         Optional metadata to include in profiler, such as project_id.
+    mesh_format : MeshFormat, optional
+        Encoding of the output meshes. Defaults to Draco.
 
     Returns
     -------
     MeshesResult
-        Dictionnary with mesh, a map from unit ID to OFF or Draco mesh file, and fault, a map from fault name to OFF or Draco mesh file.
+        Dictionnary with mesh, a map from unit ID to mesh file, and fault, a map from fault name to mesh file.
     """
     set_profiler(PROFILES["meshes"])
     model = GeologicalModel(extract_project_data(xml, dem), use_cache=False)
@@ -220,7 +243,7 @@ def compute_meshes(
         box = Box(**data["box"])
     else:
         box = model.getbox()
-    output = generate_volumes(model, shape, box)
+    output = generate_volumes(model, shape, box, mesh_format, content_hash(xml, dem))
     get_current_profiler().save_results()
     return output
 
@@ -254,27 +277,41 @@ class IntersectionsData(TypedDict):
     springs: dict[str, Vec3Float]
     # Optional. ID as string to box
     drillholes: dict[str, BoxDict]
+    # Optional. Virtual boreholes, ID as string to polyline from the collar down, sampled with resolution points
+    boreholes: dict[str, list[Vec3Float]]
     resolution: int
     # cross sections, ID as string to box for each segment
     toCompute: dict[str, list[BoxDict]]
     computeMap: bool
+    # Optional. "grid" (default) or "trace", see FaultOutputMode
+    faultOutput: str
+    # Optional. "grid" (default) or "polygons", see RankOutputMode
+    rankOutput: str
+    # Optional. Initial lattice step of the adaptive rank evaluation, in grid points. Every point is evaluated when
+    # not given or 1. See compute_cross_section_ranks
+    rankTolerance: int
 
 
 class MeshIntersectionsResult(TypedDict):
-    """Data returned by the mesh intersections computation"""
+    """Data returned by the mesh intersections computation. Grids are NumPy arrays, shown as the lists they become in
+    JSON"""
 
+    # With the "polygons" rank output, each segment is a dict from rank to rings of [u, v] points instead of a grid
     forCrossSections: dict[str, list[list[list[int]]]]
     drillholes: dict[str, list[dict[str, list[list[float]]]]]
     springs: dict[str, list[dict[str, list[float]]]]
     matrixGwb: dict[str, list[list[int]]]
-    # Optional
+    # Optional. Same as each cross section segment
     forMaps: list[list[int]]
+    # Optional. Virtual borehole ID to intervals [from depth, to depth, rank], depths along the borehole
+    boreholes: dict[str, list[list[float]]]
 
 
 class FaultIntersectionsResult(TypedDict):
     """Data returned by the fault intersections computation"""
 
     # For Fault intersections, we return floats and not ints, as we return the distance from the fault in the potential field, whereas we returned the unit ID for the Meshes intersections
+    # With the "trace" fault output, each fault maps to a list of polylines of [u, v] points instead of a grid
     forCrossSections: dict[str, list[dict[str, list[list[float]]]]]
     # Optional
     forMaps: dict[str, list[list[float]]]
@@ -290,15 +327,67 @@ class IntersectionsResult(TypedDict):
 RATIO_MAX_DIST_PROJ = 0.2
 
 
+def _compute_segment(
+    b: Box,
+    model: GeologicalModel,
+    data: IntersectionsData,
+    hydro_features: tuple[dict, dict] | None,
+    gwb_meshes: dict[str, list[bytes]],
+    rank_output_mode: RankOutputMode,
+    fault_output_mode: FaultOutputMode,
+    evaluator=None,
+) -> dict:
+    """Compute the ranks and fault intersections of a cross section segment, and the groundwater bodies unless
+    hydro_features, the projected drillholes and springs, is None. The rank evaluator with topography is compiled from
+    the model unless given"""
+    # FIXME: if we remove rounding, it breaks virtual drillhole slices. But it feels wrong to round, since we are rounding to arbitrary units of EPSG, usually meters, and the effect is not going to be the same on small and large projects
+    x_coord = [round(b.xmin), round(b.xmax)]
+    y_coord = [round(b.ymin), round(b.ymax)]
+    z_coord = [round(b.zmin), round(b.zmax)]
+    x_extent = round(b.xmax) - round(b.xmin)
+    y_extent = round(b.ymax) - round(b.ymin)
+    height = round(b.zmax) - round(b.zmin)
+    width = math.sqrt(x_extent**2 + y_extent**2)
+    resolution = calculate_resolution(width, height, data["resolution"])
+    xyz = compute_vertical_slice_points(x_coord, y_coord, z_coord, resolution)
+    profile_step("cross_section_grid")
+    # shared by the ranks and the fault intersections of the section
+    topography = topography_potential(model.topography, xyz)
+    profile_step("topography")
+
+    segment = {
+        "ranks": compute_cross_section_ranks(
+            xyz,
+            resolution,
+            model,
+            topography=True,
+            topography_potential=topography,
+            output=rank_output_mode,
+            tolerance=normalize_tolerance(data.get("rankTolerance")),
+            evaluator=evaluator,
+        )
+    }
+    if hydro_features is not None:
+        drillholes, springs = hydro_features
+        segment.update(drillholes=drillholes, springs=springs, matrixGwb=project_gwbs_on_slice(xyz, gwb_meshes))
+    segment["faults"] = compute_fault_intersections(xyz, resolution, model, topography, fault_output_mode)
+    return segment
+
+
 def compute_intersections(
     data: IntersectionsData,
     xml: str,
     dem: str,
     gwb_meshes: dict[str, list[bytes]],
     metadata: dict = None,
+    on_section: Callable[[str | None, dict], None] = None,
+    session_id: str = None,
 ) -> IntersectionsResult:
     """Compute Intersections.
 
+    Cross section segments are cached by model, bounds, resolution and hydrogeological inputs, so that only new or
+    changed segments are computed when a project is resubmitted.
+
     Parameters
     ----------
     data : IntersectionsData
@@ -311,15 +400,31 @@ def compute_intersections(
         A dict from GWB ID to meshes in the OFF or Draco format.
     metadata : dict, optional
         Optional metadata to include in profiler, such as project_id.
+    on_section : Callable[[str | None, dict], None], optional
+        Called as soon as each cross section is computed, with its ID and a dict from field (ranks, faults,
+        drillholes, springs and matrixGwb) to its list of segments, then with None and the ranks and faults of the map.
+    session_id : str, optional
+        Session pinning the model, whose requests all run in the same worker. The loaded model and its compiled
+        evaluators are kept in memory until the session is released, and reused if already loaded, see
+        geocruncher.cache.models.
 
     Returns
     -------
     IntersectionsResult
-        Results for cross sections, drillholes, sptrings, gwb matrix and maps.
+        Results for cross sections, drillholes, sptrings, gwb matrix and maps. Grids are NumPy arrays, serialize
+        them with geocruncher.serialization.
         TODO: find a more complete explanation of what is returned and simplify return type.
     """
     set_profiler(PROFILES["intersections"])
-    model = GeologicalModel(extract_project_data(xml, dem), use_cache=False)
+    model_hash = content_hash(xml, dem)
+    loaded = None
+    if session_id is not None:
+        loaded, _ = session_model(
+            session_id, model_hash, lambda: GeologicalModel(extract_project_data(xml, dem), use_cache=False)
+        )
+        model = loaded.model
+    else:
+        model = GeologicalModel(extract_project_data(xml, dem), use_cache=False)
     box = model.getbox()
     max_dist_proj = max(box.xmax - box.xmin, box.ymax - box.ymin) * RATIO_MAX_DIST_PROJ
     mesh_output: MeshIntersectionsResult = {
@@ -359,17 +464,52 @@ def compute_intersections(
         "num_drillholes", len(data["drillholes"]) if "drillholes" in data else 0
     ).set_metadata(
         "num_gwb_parts", len(gwb_meshes)
+    ).set_metadata(
+        "num_boreholes", len(data["boreholes"]) if "boreholes" in data else 0
     )
     if metadata:
         for key in metadata:
             profiler.set_metadata(key, metadata[key])
 
+    fault_output_mode = FaultOutputMode(data.get("faultOutput", FaultOutputMode.GRID))
+    rank_output_mode = RankOutputMode(data.get("rankOutput", RankOutputMode.GRID))
+    rank_tolerance = normalize_tolerance(data.get("rankTolerance"))
     has_hydro_layer = bool(
         any(key in data for key in ["springs", "drillholes"]) or gwb_meshes
     )
 
     profile_step("load_model")
 
+    if data.get("boreholes"):
+        # sampled along each borehole only, instead of a vertical cross section around it
+        mesh_output["boreholes"] = compute_borehole_logs(data["boreholes"], model, data["resolution"])
+
+    hydro_hash = (
+        hydro_inputs_hash(data.get("springs"), data.get("drillholes"), gwb_meshes)
+        if has_hydro_layer
+        else ""
+    )
+    output_modes = (rank_output_mode.value, fault_output_mode.value, str(rank_tolerance))
+    num_cached_sections = 0
+
+    # springs and drillholes are projected on every segment at once
+    hydro_projections = {}
+    if has_hydro_layer:
+        segments = [
+            (key, index, Box(**b))
+            for key, intersection in data["toCompute"].items()
+            for index, b in enumerate(intersection)
+        ]
+        planes = [hydro_projection_plane(b) for _, _, b in segments]
+        projections = project_hydro_features(
+            HydroFeatures(data.get("springs"), data.get("drillholes")),
+            np.array([lower_left for lower_left, _ in planes]).reshape(-1, 3),
+            np.array([upper_right for _, upper_right in planes]).reshape(-1, 3),
+            max_dist_proj,
+        )
+        hydro_projections = {(key, index): projection for (key, index, _), projection in zip(segments, projections)}
+        profile_step("hydro_project_features")
+
     for key, intersection in data["toCompute"].items():
         # create empty arrays. each segment in the cross section gets it's data
         fault_output["forCrossSections"][key] = []
@@ -378,49 +518,51 @@ def compute_intersections(
         mesh_output["springs"][key] = []
         mesh_output["matrixGwb"][key] = []
 
-        for b in intersection:
-            b = Box(**b)
-            # FIXME: if we remove rounding, it breaks virtual drillhole slices. But it feels wrong to round, since we are rounding to arbitrary units of EPSG, usually meters, and the effect is not going to be the same on small and large projects
-            x_coord = [round(b.xmin), round(b.xmax)]
-            y_coord = [round(b.ymin), round(b.ymax)]
-            z_coord = [round(b.zmin), round(b.zmax)]
-            x_extent = round(b.xmax) - round(b.xmin)
-            y_extent = round(b.ymax) - round(b.ymin)
-            height = round(b.zmax) - round(b.zmin)
-            width = math.sqrt(x_extent**2 + y_extent**2)
-            resolution = calculate_resolution(width, height, data["resolution"])
-            xyz = compute_vertical_slice_points(x_coord, y_coord, z_coord, resolution)
-            profile_step("cross_section_grid")
-
-            mesh_output["forCrossSections"][key].append(
-                compute_cross_section_ranks(xyz, resolution, model, topography=True)
-            )
-            if has_hydro_layer:
-                lower_left = np.array([b.xmin, b.ymin, b.zmin])
-                upper_right = np.array([b.xmax, b.ymax, b.zmax])
-
-                # fix for drillholes slices where there is no x and y extent (fully vertical)
-                if x_extent == 0 and y_extent == 0:
-                    lower_left[0] -= 1
-                    upper_right[0] += 1
-                    lower_left[1] -= 1
-                    upper_right[1] += 1
-
-                d, s, m = project_hydro_features_on_slice(
-                    lower_left,
-                    upper_right,
-                    xyz,
-                    data.get("springs"),
-                    data.get("drillholes"),
+        is_section_cached = True
+        for index, b in enumerate(intersection):
+            # only new or changed segments are computed
+            segment, is_cached = cached_section(
+                model_hash,
+                b,
+                data["resolution"],
+                hydro_hash,
+                output_modes,
+                lambda: _compute_segment(
+                    Box(**b),
+                    model,
+                    data,
+                    hydro_projections.get((key, index)),
                     gwb_meshes,
-                    max_dist_proj,
-                )
-                mesh_output["drillholes"][key].append(d)
-                mesh_output["springs"][key].append(s)
-                mesh_output["matrixGwb"][key].append(m)
-            fault_output["forCrossSections"][key].append(
-                compute_fault_intersections(xyz, resolution, model)
+                    rank_output_mode,
+                    fault_output_mode,
+                    loaded.evaluator(topography=True) if loaded is not None else None,
+                ),
             )
+            is_section_cached &= is_cached
+
+            mesh_output["forCrossSections"][key].append(segment["ranks"])
+            if has_hydro_layer:
+                mesh_output["drillholes"][key].append(segment["drillholes"])
+                mesh_output["springs"][key].append(segment["springs"])
+                mesh_output["matrixGwb"][key].append(segment["matrixGwb"])
+            fault_output["forCrossSections"][key].append(segment["faults"])
+        num_cached_sections += is_section_cached
+
+        if on_section is not None:
+            section = {
+                "ranks": mesh_output["forCrossSections"][key],
+                "faults": fault_output["forCrossSections"][key],
+            }
+            if has_hydro_layer:
+                for field in ["drillholes", "springs", "matrixGwb"]:
+                    section[field] = mesh_output[field][key]
+            on_section(key, section)
+
+    profiler.set_metadata(
+        "sections_computed", len(data["toCompute"]) - num_cached_sections
+    ).set_metadata(
+        "sections_cached", num_cached_sections
+    )
 
     if data["computeMap"]:
         width = box.xmax - box.xmin
@@ -428,17 +570,33 @@ def compute_intersections(
         resolution = calculate_resolution(width, height, data["resolution"])
         xyz = compute_map_points(box, resolution, model)
         profile_step("map_grid")
+        topography = topography_potential(model.topography, xyz)
+        profile_step("topography")
 
         mesh_output["forMaps"] = compute_cross_section_ranks(
-            xyz, resolution, model, topography=False
+            xyz,
+            resolution,
+            model,
+            topography=False,
+            output=rank_output_mode,
+            tolerance=rank_tolerance,
+            evaluator=loaded.evaluator(topography=False) if loaded is not None else None,
+        )
+        fault_output["forMaps"] = compute_fault_intersections(
+            xyz, resolution, model, topography, fault_output_mode
         )
-        fault_output["forMaps"] = compute_fault_intersections(xyz, resolution, model)
+        if on_section is not None:
+            on_section(None, {"ranks": mesh_output["forMaps"], "faults": fault_output["forMaps"]})
     get_current_profiler().save_results()
     return {"mesh": mesh_output, "fault": fault_output}
 
 
 def compute_faults(
-    data: MeshesData, xml: str, dem: str, metadata: dict = None
+    data: MeshesData,
+    xml: str,
+    dem: str,
+    metadata: dict = None,
+    mesh_format: MeshFormat = MeshFormat.DRACO,
 ) -> MeshesResult:
     """Compute Fault Meshes. Parameters and return types are the same as mesh computation.
 
@@ -452,6 +610,8 @@ def compute_faults(
         DEM datapoints as ASCIIGrid.
     metadata : dict, optional
         Optional metadata to include in profiler, such as project_id.
+    mesh_format : MeshFormat, optional
+        Encoding of the output meshes. Defaults to Draco.
 
     Returns
     -------
@@ -488,7 +648,7 @@ def compute_faults(
     else:
         box = model.getbox()
 
-    output = {"mesh": {}, "fault": generate_faults_files(model, shape, box)}
+    output = {"mesh": {}, "fault": generate_faults_files(model, shape, box, mesh_format)}
     get_current_profiler().save_results()
     return output
 
@@ -546,11 +706,124 @@ def compute_voxels(
     else:
         box = model.getbox()
 
-    output = Voxels.output(model, shape, box, gwb_meshes)
+    output = Voxels.output(model, shape, box, gwb_meshes, content_hash(xml, dem))
     get_current_profiler().save_results()
     return output
 
 
+class PointsQueryData(TypedDict):
+    """Data given to the points query"""
+
+    # points as [x, y, z]
+    points: list[list[float]]
+    # Optional. Evaluate the ranks with the topography, points above it getting the sky rank. Defaults to True
+    topography: bool
+    # Optional. Names of the faults whose potential is returned
+    faults: list[str]
+
+
+class PointsQueryResult(TypedDict):
+    """Data returned by the points query"""
+
+    # rank of each point
+    ranks: list[int]
+    # fault name to the potential at each point
+    faults: dict[str, list[float]]
+
+
+def query_points(
+    data: PointsQueryData,
+    project_hash: str,
+    load_project: Callable[[], tuple[bytes, str]],
+    metadata: dict = None,
+    session_id: str = None,
+) -> PointsQueryResult:
+    """Evaluate the ranks and fault potentials at arbitrary points.
+
+    Loaded models are kept in memory by project hash, so repeated queries on a project don't load it again.
+
+    Parameters
+    ----------
+    data : PointsQueryData
+        The configuration data.
+    project_hash : str
+        Hash of the project, see geocruncher.cache.content_hash.
+    load_project : Callable[[], tuple[bytes, str]]
+        Returns the Geomodeller XML and the ASCIIGrid DEM of the project, only called if its model is not loaded.
+    metadata : dict, optional
+        Optional metadata to include in profiler, such as project_id.
+    session_id : str, optional
+        Session pinning the model, kept in memory until the session is released instead of in the cache.
+
+    Returns
+    -------
+    PointsQueryResult
+        Ranks and fault potentials, as arrays.
+    """
+    set_profiler(PROFILES["points"])
+
+    def load():
+        return GeologicalModel(extract_project_data(*load_project()), use_cache=False)
+
+    if session_id is not None:
+        loaded, is_cached = session_model(session_id, project_hash, load)
+    else:
+        loaded, is_cached = cached_model(project_hash, load)
+    model = loaded.model
+    unknown_faults = [name for name in data.get("faults", []) if name not in model.faults]
+    if unknown_faults:
+        raise ValueError(f"Unknown faults {', '.join(unknown_faults)}")
+    xyz = np.asarray(data["points"], dtype=np.float64).reshape(-1, 3)
+
+    profiler = get_current_profiler()
+    profiler.set_metadata(
+        "num_points", xyz.shape[0]
+    ).set_metadata(
+        "num_faults", len(data.get("faults", []))
+    ).set_metadata(
+        "model_cached", is_cached
+    )
+    if metadata:
+        for key in metadata:
+            profiler.set_metadata(key, metadata[key])
+
+    profile_step("load_model")
+
+    if data.get("topography", True):
+        # points above the topography are sky without evaluation
+        ranks = evaluate_ranks(loaded.evaluator(topography=True), xyz, model.topography)
+    else:
+        ranks = loaded.evaluator(topography=False)(xyz)
+    if model.pile.reference == "base":
+        ranks = ranks - 1
+    profile_step("ranks")
+
+    faults = {name: np.asarray(model.faults[name](xyz)).reshape(-1) for name in data.get("faults", [])}
+    profile_step("faults")
+    get_current_profiler().save_results()
+    return {"ranks": np.asarray(ranks), "faults": faults}
+
+
+def preload_model(session_id: str, project_hash: str, load_project: Callable[[], tuple[bytes, str]]) -> None:
+    """Load the model of a session and compile its evaluators ahead of the requests on it, so that the first request
+    doesn't wait for them. The model is pinned until the session is released, see geocruncher.cache.models.
+
+    Parameters
+    ----------
+    session_id : str
+        Session pinning the model.
+    project_hash : str
+        Hash of the project, see geocruncher.cache.content_hash.
+    load_project : Callable[[], tuple[bytes, str]]
+        Returns the Geomodeller XML and the ASCIIGrid DEM of the project, only called if its model is not loaded.
+    """
+    loaded, _ = session_model(
+        session_id, project_hash, lambda: GeologicalModel(extract_project_data(*load_project()), use_cache=False)
+    )
+    loaded.evaluator(topography=True)
+    loaded.evaluator(topography=False)
+
+
 class Spring(TypedDict):
     """Spring data needed for the gwb meshes computation"""
 
@@ -567,9 +840,15 @@ class UnitMesh(TypedDict):
 
 
 def compute_gwb_meshes(
-    unit_meshes: dict[str, bytes], springs: list[Spring], metadata: dict = None
+    unit_meshes: dict[str, bytes],
+    springs: list[Spring],
+    metadata: dict = None,
+    mesh_format: MeshFormat = MeshFormat.DRACO,
+    incremental: bool = False,
 ) -> GeoAlgoOutput:
-    """Returns the metadata, then a dict of unit_id to OFF or Draco mesh file"""
+    """Returns the metadata, then a dict of unit_id to mesh file in the requested format.
+    Results are cached by unit meshes. With incremental, results of unchanged springs above the first changed one are reused.
+    """
     set_profiler(PROFILES["gwb_meshes"])
 
     profiler = get_current_profiler()
@@ -580,6 +859,6 @@ def compute_gwb_meshes(
         for key in metadata:
             profiler.set_metadata(key, metadata[key])
 
-    results = GeoAlgo.output(unit_meshes, springs)
+    results = GeoAlgo.output(unit_meshes, springs, mesh_format, incremental)
     get_current_profiler().save_results()
     return results
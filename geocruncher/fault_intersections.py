@@ -1,10 +1,82 @@
+import os
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
 import numpy as np
 from forgeo.gmlib.GeologicalModel3D import GeologicalModel
+from skimage.measure import find_contours
 from .profiler import profile_step
+from .topography_reader import topography_potential
 
 CLIP_VALUE = np.nan
 
+# Number of threads evaluating fault fields and ellipsoids, in each worker process. Sequential by default: threads only
+# help if the potential evaluation releases the GIL, and prefork workers would each start that many threads
+FAULT_WORKERS = max(int(os.environ.get('FAULT_WORKERS', 1)), 1)
+
+# Decimals kept for the coordinates of fault traces, in grid steps
+TRACE_DECIMALS = 3
+
+# Relative margin added to the radius of the sphere bounding a finite fault ellipsoid
+ELLIPSOID_MARGIN = 1e-6
+
+
+class FaultOutputMode(str, Enum):
+    """How fault intersections are returned"""
+
+    # clipped potential grid, transposed, with None where clipped
+    GRID = "grid"
+    # polylines of the zero level of the clipped potential, as [u, v] points in grid steps along the width and height
+    TRACE = "trace"
+
+
+def fault_traces(potential: np.ndarray) -> list[list[list[float]]]:
+    """Polylines of the zero level of a clipped fault potential, using marching squares.
+
+    Parameters
+    ----------
+    potential : np.ndarray
+        Potential of shape resolution, CLIP_VALUE where clipped.
+
+    Returns
+    -------
+    list[list[list[float]]]
+        Polylines, each a list of [u, v] points where u is along the width and v along the height of the grid, in
+        grid steps. Clipped cells are not crossed.
+    """
+    is_clipped = np.isnan(potential)
+    contours = find_contours(np.where(is_clipped, 0, potential), 0, mask=~is_clipped)
+    return [np.round(contour, TRACE_DECIMALS).tolist() for contour in contours]
+
+
+def _finite_fault_center(fault_data) -> np.ndarray:
+    """Center of the ellipsoid of a finite fault, as computed by gmlib"""
+    points = np.reshape(fault_data.potential_data.interfaces[0], (-1, 3))
+    if fault_data.center_type == "mean_center":
+        return np.mean(points, axis=0)
+    elif fault_data.center_type == "databox_center":
+        return 0.5 * (points.min(axis=0) + points.max(axis=0))
+    return np.asarray(fault_data.center_type, dtype=np.float64)
+
+
+def _bounding_sphere(fault_data) -> tuple[np.ndarray, float]:
+    """Sphere containing the ellipsoid of a finite fault. The axes of the ellipsoid are orthogonal, with lengths of
+    the influence radius, the lateral extent and the vertical extent"""
+    radius = max(fault_data.influence_radius, fault_data.lateral_extent, fault_data.vertical_extent)
+    return _finite_fault_center(fault_data), radius * (1 + ELLIPSOID_MARGIN)
+
+
+# Rectangle of grid indices (i start, i stop, j start, j stop)
+Region = tuple[int, int, int, int]
+
+
+def _union(a: Region | None, b: Region | None) -> Region | None:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return (min(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3]))
+
 
 class FaultIntersector:
     """Inspired by gmlib FaultTesselator"""
@@ -14,11 +86,12 @@ class FaultIntersector:
         grid_points: np.ndarray,
         resolution: tuple[int, int],
         model: GeologicalModel,
+        topography: np.ndarray = None,
     ):
         self._grid_points = grid_points
         self._resolution = resolution
         self._model = model
-        self._topography = self._intersect_topography()
+        self._topography = topography if topography is not None else self._intersect_topography()
 
     def _sort_faults(self) -> list[str]:
         """
@@ -46,30 +119,84 @@ class FaultIntersector:
         return sorted_faults
 
     def _intersect_topography(self):
-        model = self._model
+        return topography_potential(self._model.topography, self._grid_points)
 
-        if hasattr(model.topography, "z") and isinstance(model.topography.z, float):
-            # Horizontal plane case: potential = point.z - plane.z
-            topography = self._grid_points[:, 2] - model.topography.z
-        else:
-            # Evaluate actual topography function
-            topography = model.topography(self._grid_points)
+    def _footprint(self, name: str) -> Region | None:
+        """Rectangle of the grid that may be inside the ellipsoid of a finite fault, or None if the ellipsoid
+        does not reach the grid. The whole grid for infinite faults."""
+        res = self._resolution
+        fault_data = self._model.faults_data[name]
+        if fault_data.infinite or name not in self._model.fault_ellipsoids:
+            return (0, res[0], 0, res[1])
+
+        center, radius = _bounding_sphere(fault_data)
+        # cheap test against the bounding box of the grid first
+        lower = self._grid_points.min(axis=0)
+        upper = self._grid_points.max(axis=0)
+        if np.any(center + radius < lower) or np.any(center - radius > upper):
+            return None
+
+        grid_2d = self._grid_points.reshape(res + (3,))
+        inside = np.sum((grid_2d - center) ** 2, axis=2) <= radius**2
+        rows = np.flatnonzero(inside.any(axis=1))
+        cols = np.flatnonzero(inside.any(axis=0))
+        if rows.size == 0:
+            return None
+        return (rows[0], rows[-1] + 1, cols[0], cols[-1] + 1)
+
+    def _evaluation_regions(self, sorted_faults: list[str]) -> dict[str, Region]:
+        """Region of the grid where each fault potential is needed. Faults limiting other faults are needed wherever
+        those are, even outside of their own footprint. Faults needed nowhere are left out."""
+        regions = {name: self._footprint(name) for name in sorted_faults}
+        # faults come after the faults they limit, so their region is complete when they are reached
+        for name in sorted_faults:
+            for limit in self._model.faults_data[name].stops_on:
+                if limit in regions:
+                    regions[limit] = _union(regions[limit], regions[name])
+        return {name: region for name, region in regions.items() if region is not None}
 
-        return topography
+    def _evaluate_on_region(self, function, region: Region) -> np.ndarray:
+        """Evaluate a function on a region of the grid. Values outside of the region are CLIP_VALUE"""
+        i0, i1, j0, j1 = region
+        values = np.full(self._resolution, CLIP_VALUE)
+        points = self._grid_points.reshape(self._resolution + (3,))[i0:i1, j0:j1]
+        values[i0:i1, j0:j1] = np.asarray(
+            function(np.ascontiguousarray(points.reshape(-1, 3)))
+        ).reshape(i1 - i0, j1 - j0)
+        return values
 
-    def intersect(self) -> dict:
+    def intersect(self, mode: FaultOutputMode = FaultOutputMode.GRID) -> dict:
         res = self._resolution
         topography_2d = self._topography.reshape(res)
 
         model = self._model
-        fault_potentials = {}
+        sorted_faults = self._sort_faults()
+        regions = self._evaluation_regions(sorted_faults)
 
-        # Evaluate all faults upfront
-        for name, field in model.faults.items():
-            fault_potentials[name] = field(self._grid_points).reshape(res)
+        ellipsoids = {
+            name: model.fault_ellipsoids.get(name)
+            for name in regions
+            if not model.faults_data[name].infinite and model.fault_ellipsoids.get(name)
+        }
+
+        # Evaluate all faults upfront, only where finite faults and the faults they stop on can be.
+        # Fields and ellipsoids are independent from each other, only the clipping below depends on the order
+        with ThreadPoolExecutor(max_workers=FAULT_WORKERS) as executor:
+            potential_futures = {
+                name: executor.submit(self._evaluate_on_region, model.faults[name], region)
+                for name, region in regions.items()
+            }
+            ellipsoid_futures = {
+                name: executor.submit(self._evaluate_on_region, ellipsoid, regions[name])
+                for name, ellipsoid in ellipsoids.items()
+            }
+            fault_potentials = {name: future.result() for name, future in potential_futures.items()}
+            ellipsoid_values = {name: future.result() for name, future in ellipsoid_futures.items()}
 
         # Process each fault in dependency order
-        for name in self._sort_faults():
+        for name in sorted_faults:
+            if name not in fault_potentials:
+                continue
             fault_data = model.faults_data[name]
             potential = fault_potentials[name]
 
@@ -101,13 +228,12 @@ class FaultIntersector:
                 potential[~valid_mask] = CLIP_VALUE
 
             # 3. Clip finite faults
-            if not fault_data.infinite:
-                ellipsoid = model.fault_ellipsoids.get(name)
-                if ellipsoid:
-                    E = ellipsoid(self._grid_points).reshape(res)
-                    if np.any(E):
-                        # Set outside ellipsoid to None
-                        potential[E > 0] = CLIP_VALUE
+            if name in ellipsoid_values:
+                # outside of the evaluated region is outside of the ellipsoid, and already clipped
+                E = ellipsoid_values[name]
+                if np.any(E):
+                    # Set outside ellipsoid to None
+                    potential[E > 0] = CLIP_VALUE
 
         for name in list(fault_potentials):
             potential = fault_potentials[name]
@@ -118,20 +244,25 @@ class FaultIntersector:
             ):
                 del fault_potentials[name]
 
-        # Prepare output: transpose and convert to list
+        if mode == FaultOutputMode.TRACE:
+            traces = {name: fault_traces(potential) for name, potential in fault_potentials.items()}
+            profile_step("tesselate_faults")
+            return {name: polylines for name, polylines in traces.items() if polylines}
+
+        # Prepare output: transpose, clipped values stay NaN and become None when serialized to JSON
         for name, potential in fault_potentials.items():
-            transposed = np.transpose(potential)
-            # Setting the values to None directly doesn't work, so we use np.nan and replace it all with None at the end
-            fault_potentials[name] = np.where(
-                np.isnan(transposed), None, transposed
-            ).tolist()
+            fault_potentials[name] = np.ascontiguousarray(np.transpose(potential))
 
         profile_step("tesselate_faults")
         return fault_potentials
 
 
 def compute_fault_intersections(
-    grid_points: np.ndarray, resolution: tuple[int, int], model: GeologicalModel
+    grid_points: np.ndarray,
+    resolution: tuple[int, int],
+    model: GeologicalModel,
+    topography: np.ndarray = None,
+    mode: FaultOutputMode = FaultOutputMode.GRID,
 ) -> dict:
     """Compute fault intersections on a top-down or vertical geological cross section.
 
@@ -143,17 +274,21 @@ def compute_fault_intersections(
         x is the width resolution, y is the height resolution.
     model : gmlib.GeologicalModel3D.GeologicalModel
         GeologicalModel from forgeo.gmlib containing the faults data
+    topography : np.ndarray, optional
+        Topography potential at the grid points, if already computed for the ranks of the same section
+    mode : FaultOutputMode, optional
+        Return the potential grid (default) or the zero level traces.
 
     Returns
     -------
     dict
-        Dictionary mapping fault names to lists of intersection values,
-        reshaped to resolution.
+        Dictionary mapping fault names to arrays of intersection values, NaN where clipped,
+        reshaped to resolution. In trace mode, to lists of polylines.
 
     Notes
     -----
     The order of the intersection values are transposed compared to the rank matrix. This is
     because VISKAR expects these values in transposed order.
     """
-    intersector = FaultIntersector(grid_points, resolution, model)
-    return intersector.intersect()
+    intersector = FaultIntersector(grid_points, resolution, model, topography)
+    return intersector.intersect(mode)
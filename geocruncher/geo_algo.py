@@ -1,10 +1,18 @@
 """
 GeoAlgo is a set of C++ algorithms that enable the computation of ground water body meshes
 """
+import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import TypedDict
 import PyGeoAlgo as ga
 
-from .profiler import profile_step
+from .profiler import profile_step, get_current_profiler
+from .cache import get_cache, content_hash, pack_entry, unpack_entry
+from .mesh_io.mesh_io import MeshFormat, generate_mesh, read_mesh_to_arrays
+from .mesh_io.mesh_cache import mesh_hash
+
+# Number of threads used to decode the unit meshes
+LOAD_MESH_WORKERS = os.cpu_count() or 1
 
 class GwbMeshesResult(TypedDict):
     """Data returned by the gwb meshes computation"""
@@ -20,29 +28,105 @@ class GeoAlgoOutput(TypedDict):
     metadata: list[GwbMeshesResult]
     meshes: list[bytes]
 
+def _load_unit_mesh(unit_id: str, mesh: bytes) -> ga.UnitMesh:
+    # Decoding happens in Python, the arrays are then read by PyGeoAlgo without copies
+    verts, triangles = read_mesh_to_arrays(mesh)
+    return ga.UnitMesh(ga.FileIO.load_from_arrays(verts, triangles), int(unit_id))
+
+def _spring_key(spring) -> list:
+    """Everything about a spring that influences the result"""
+    location = spring['location']
+    return [spring['id'], location['x'], location['y'], location['z'], spring['unit_id']]
+
+def _sort_springs(springs: list) -> list:
+    """Sort springs in the order they are processed by AquiferCalc: by Z descending, ties by ID"""
+    return sorted(springs, key=lambda spring: (-spring['location']['z'], spring['id']))
+
+def _cache_key(unit_meshes: dict[str, bytes], mesh_format: MeshFormat) -> str:
+    hashes = sorted(f"{unit_id}:{mesh_hash(mesh)}" for unit_id, mesh in unit_meshes.items())
+    return "gwb_meshes:" + content_hash(mesh_format.value, *hashes)
+
 class GeoAlgo:
     @staticmethod
-    def output(unit_meshes: dict[str, bytes], springs: list) -> GeoAlgoOutput:
+    def output(unit_meshes: dict[str, bytes], springs: list, mesh_format: MeshFormat = MeshFormat.DRACO,
+               incremental: bool = False) -> GeoAlgoOutput:
+        """Compute the groundwater bodies of the given springs.
+
+        Results are cached by unit meshes and output format. If the springs are the same as the cached ones, the
+        cached result is returned. With incremental, the aquifers of the cached springs processed before the first
+        changed spring are reused, and only the following springs are computed. Reused aquifers went through the
+        mesh codec, so the result may differ slightly from a full computation with a lossy format.
+        """
+        springs = _sort_springs(springs)
+        spring_keys = [_spring_key(spring) for spring in springs]
+
+        cache = get_cache()
+        key = _cache_key(unit_meshes, mesh_format) if cache else None
+        cached = cache.get(key) if cache else None
+
+        # number of springs at the beginning of the processing order whose results are reused
+        num_reused = 0
+        reused_metadata = []
+        reused_meshes = []
+        if cached:
+            header, blobs = unpack_entry(cached)
+            if header["springs"] == spring_keys or incremental:
+                for cached_key, spring_key in zip(header["springs"], spring_keys):
+                    if cached_key != spring_key:
+                        break
+                    num_reused += 1
+                for part, mesh in zip(header["parts"], blobs):
+                    if part["spring_index"] < num_reused:
+                        reused_metadata.append(part["metadata"])
+                        reused_meshes.append(mesh)
+
+        profiler = get_current_profiler()
+        if profiler:
+            profiler.set_metadata("num_springs_reused", num_reused)
+
+        if num_reused == len(springs) and cached:
+            profile_step('load_mesh')
+            profile_step('compute')
+            profile_step('generate_mesh')
+            return {"metadata": reused_metadata, "meshes": reused_meshes}
+
         s = [ga.Spring(spring['id'], ga.Point_3(spring['location']['x'], spring['location']['y'],
-                                                spring['location']['z']), spring['unit_id']) for spring in springs]
+                                                spring['location']['z']), spring['unit_id']) for spring in springs[num_reused:]]
 
-        m = [ga.UnitMesh(ga.FileIO.load_from_bytes(
-            mesh), int(unit_id)) for unit_id, mesh in unit_meshes.items()]
+        with ThreadPoolExecutor(max_workers=LOAD_MESH_WORKERS) as executor:
+            m = list(executor.map(_load_unit_mesh, unit_meshes.keys(), unit_meshes.values()))
+            existing = list(executor.map(_load_unit_mesh, [part["unit_id"] for part in reused_metadata], reused_meshes))
         profile_step('load_mesh')
 
-        aquifer_calc = ga.AquiferCalc(m, s)
+        aquifer_calc = ga.AquiferCalc(m, s, existing) if existing else ga.AquiferCalc(m, s)
         aquifers = aquifer_calc.calculate()
         profile_step('compute')
 
-        metadata = []
-        meshes = []
+        stats = aquifer_calc.stats
+        if profiler:
+            profiler.set_metadata(
+                "pairs_pruned_bbox", stats.pairs_pruned_bbox
+            ).set_metadata(
+                "pairs_tested_exact", stats.pairs_tested_exact
+            ).set_metadata(
+                "pairs_intersecting", stats.pairs_intersecting
+            )
+
+        metadata = reused_metadata
+        meshes = reused_meshes
         for aquifer in aquifers:
             metadata.append({
                 "unit_id": aquifer.unit_id,
                 "spring_id": aquifer.spring.id,
                 "volume": aquifer.volume
             })
-            meshes.append(ga.FileIO.write_to_bytes(aquifer.mesh))
+            verts, triangles = ga.FileIO.write_to_arrays(aquifer.mesh)
+            meshes.append(generate_mesh(verts, triangles, mesh_format=mesh_format))
+
+        if cache:
+            spring_index = {spring['id']: i for i, spring in enumerate(springs)}
+            parts = [{"spring_index": spring_index[part["spring_id"]], "metadata": part} for part in metadata]
+            cache.set(key, pack_entry({"springs": spring_keys, "parts": parts}, meshes))
 
         profile_step("generate_mesh")
         return {"metadata": metadata, "meshes": meshes}
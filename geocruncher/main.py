@@ -8,6 +8,7 @@ import os
 from collections import defaultdict
 
 from .computations import compute_tunnel_meshes, compute_meshes, compute_intersections, compute_faults, compute_voxels
+from .serialization import dumps_json
 
 
 def main():
@@ -102,8 +103,8 @@ def run_geocruncher(computation: str, args: list[str]):
 
         outputs = compute_intersections(data, xml, dem, gwb_meshes)
 
-        with open(args[6], 'w', encoding='utf8') as f:
-            json.dump(outputs, f, indent=2, separators=(',', ': '))
+        with open(args[6], 'wb') as f:
+            f.write(dumps_json(outputs, indent=True))
         sys.stdout.flush()
 
     if computation == 'faults':
@@ -6,43 +6,73 @@ DRACO_COMPRESSION_LEVEL = 6
 DRACO_QUANTIZATION_BITS = 14
 
 
-def triangulate_faces(faces: list) -> np.ndarray:
+def fan_triangulate(faces) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Convert mixed triangles, quads, and ngons to all triangles, keeping track of the source face.
+    Uses fan triangulation around the first vertex: (0,1,2), (0,2,3), (0,3,4), ...
+
+    Faces are bucketed by vertex count, and each bucket is triangulated in a single array operation.
+    The triangles are written in the same order as the faces they come from.
+
+    Args:
+        faces: faces, each being a list of vertex indices. Can be a ragged list or a 2D np.array
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: triangles with shape (N, 3), and for each triangle the index of its source face
+    """
+    if isinstance(faces, np.ndarray) and faces.ndim == 2:
+        num_faces = faces.shape[0]
+        counts = np.full(num_faces, faces.shape[1], dtype=np.int64)
+        flat = faces.astype(np.int64, copy=False).ravel()
+    else:
+        num_faces = len(faces)
+        counts = np.fromiter((len(face) for face in faces), dtype=np.int64, count=num_faces)
+        flat = np.fromiter(
+            (i for face in faces for i in face), dtype=np.int64, count=int(counts.sum())
+        )
+
+    if num_faces == 0:
+        return np.empty((0, 3), dtype=np.int32), np.empty(0, dtype=np.int64)
+    if counts.min() < 3:
+        raise ValueError(
+            f"Invalid face with {counts.min()} vertices (minimum 3 required)"
+        )
+
+    # start of each face in the flat index list, and of its first triangle in the output
+    face_starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    tris_per_face = counts - 2
+    tri_starts = np.concatenate(([0], np.cumsum(tris_per_face)[:-1]))
+
+    triangles = np.empty((int(tris_per_face.sum()), 3), dtype=np.int32)
+    face_index = np.repeat(np.arange(num_faces), tris_per_face)
+
+    for n in np.unique(counts):
+        bucket = np.flatnonzero(counts == n)
+        starts = face_starts[bucket][:, None]
+        fan = np.arange(1, n - 1)
+        # shape (faces in bucket, n - 2, 3)
+        bucket_tris = np.stack(
+            np.broadcast_arrays(flat[starts], flat[starts + fan], flat[starts + fan + 1]),
+            axis=-1,
+        )
+        positions = tri_starts[bucket][:, None] + np.arange(n - 2)
+        triangles[positions.ravel()] = bucket_tris.reshape(-1, 3)
+
+    return triangles, face_index
+
+
+def triangulate_faces(faces) -> np.ndarray:
     """
     Convert mixed triangles, quads, and ngons to all triangles.
     Uses fan triangulation for ngons.
 
     Args:
-        faces: np.array of faces, each being a list of vertex indices
+        faces: faces, each being a list of vertex indices
 
     Returns:
         np.array of triangles with shape (N, 3)
     """
-    triangles = []
-
-    for face in faces:
-        n_verts = len(face)
-
-        if n_verts == 3:
-            # Triangle - keep as is
-            triangles.append(face)
-
-        elif n_verts == 4:
-            # Quad - split into two triangles
-            triangles.append([face[0], face[1], face[2]])
-            triangles.append([face[0], face[2], face[3]])
-
-        elif n_verts >= 5:
-            # Ngon - fan triangulation around first vertex
-            # Creates triangles: (0,1,2), (0,2,3), (0,3,4), ...
-            for i in range(1, n_verts - 1):
-                triangles.append([face[0], face[i], face[i + 1]])
-
-        else:
-            raise ValueError(
-                f"Invalid face with {n_verts} vertices (minimum 3 required)"
-            )
-
-    return np.array(triangles, dtype=np.int32)
+    return fan_triangulate(faces)[0]
 
 
 def generate_draco(verts: np.ndarray | list, faces: np.ndarray | list) -> bytes:
@@ -60,7 +90,7 @@ def generate_draco(verts: np.ndarray | list, faces: np.ndarray | list) -> bytes:
     )
 
 
-def read_draco_to_polydata(draco_bytes: bytes) -> pv.PolyData:
+def read_draco(draco_bytes: bytes) -> tuple[np.ndarray, np.ndarray]:
     # Decode Draco bytes (vertices + triangles)
     data = DracoPy.decode_buffer_to_mesh(draco_bytes)
     if data.faces is None:
@@ -69,6 +99,11 @@ def read_draco_to_polydata(draco_bytes: bytes) -> pv.PolyData:
     # Convert to expected dtypes (float64 for points, int32 for faces)
     points = np.asarray(data.points, dtype=np.float64)  # shape (n_verts, 3)
     faces = np.asarray(data.faces, dtype=np.int32)      # shape (n_faces, 3)
+    return points, faces
+
+
+def read_draco_to_polydata(draco_bytes: bytes) -> pv.PolyData:
+    points, faces = read_draco(draco_bytes)
 
     # PyVista expects faces as a 1D array formatted as [n_verts, v0, v1, ..., vN]
     # For triangles: [3, v0, v1, v2, 3, v3, v4, v5, ...]
@@ -0,0 +1,136 @@
+"""
+Process-wide cache of decoded meshes.
+The same groundwater body meshes are uploaded by the client for every intersections and voxels job of a project,
+so instead of decoding them each time, the decoded PolyData is kept in memory, keyed by a hash of the encoded bytes.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+import numpy as np
+import pyvista as pv
+
+from .mesh_io import read_mesh_to_polydata
+
+# Memory budget of the cache, in bytes. Least recently used meshes are evicted once it is exceeded
+MESH_CACHE_MAX_BYTES = int(os.environ.get("MESH_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+class DecodedMesh(NamedTuple):
+    """A decoded mesh, along with data precomputed once per mesh"""
+
+    polydata: pv.PolyData
+    # (xmin, xmax, ymin, ymax, zmin, zmax)
+    bounds: np.ndarray
+    # whether the surface has no open edges. Required to test if points are enclosed
+    is_closed: bool
+    # approximate size in memory, used for the memory budget
+    nbytes: int
+
+
+def mesh_hash(data: bytes | str) -> str:
+    """Fast content hash of an encoded mesh."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class MeshCache:
+    """Thread safe LRU cache from encoded mesh bytes to DecodedMesh, with a memory budget"""
+
+    def __init__(self, max_bytes: int = MESH_CACHE_MAX_BYTES):
+        self._max_bytes = max_bytes
+        self._entries: OrderedDict[str, DecodedMesh] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """Approximate memory used by the cached meshes, in bytes"""
+        return self._size
+
+    def get(self, data: bytes) -> DecodedMesh:
+        """Return the decoded mesh for the given OFF or Draco bytes, decoding it on a cache miss."""
+        key = mesh_hash(data)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        # decode outside the lock, so other threads are not blocked by a large mesh
+        polydata = read_mesh_to_polydata(data)
+        entry = DecodedMesh(
+            polydata=polydata,
+            bounds=np.asarray(polydata.bounds, dtype=np.float64),
+            is_closed=polydata.n_open_edges == 0,
+            # actual_memory_size is in kibibytes
+            nbytes=polydata.actual_memory_size * 1024,
+        )
+
+        with self._lock:
+            if key not in self._entries and entry.nbytes <= self._max_bytes:
+                self._entries[key] = entry
+                self._size += entry.nbytes
+                while self._size > self._max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._size -= evicted.nbytes
+        return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+_mesh_cache = MeshCache()
+
+
+def read_cached_mesh(data: bytes) -> DecodedMesh:
+    """Load either OFF or Draco bytes into a DecodedMesh, using the process-wide cache."""
+    return _mesh_cache.get(data)
+
+
+def select_enclosed_points(
+    points: np.ndarray, mesh: DecodedMesh, tolerance: float = 0.00001
+) -> np.ndarray:
+    """Test which points are inside a closed mesh.
+
+    Points outside of the bounding box of the mesh cannot be enclosed, so only the remaining ones
+    are tested against the surface.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Array of shape (N, 3) of the points to test.
+    mesh : DecodedMesh
+        The closed surface.
+    tolerance : float, optional
+        Tolerance as a fraction of the mesh bounding box diagonal, as in pyvista.
+
+    Returns
+    -------
+    np.ndarray
+        Boolean array of shape (N,), True for points inside the mesh.
+    """
+    if not mesh.is_closed:
+        raise RuntimeError(
+            "Surface is not closed. Cannot test if points are enclosed by it."
+        )
+    lower = mesh.bounds[0::2]
+    upper = mesh.bounds[1::2]
+    margin = np.linalg.norm(upper - lower) * tolerance
+    in_bounds = np.all((points >= lower - margin) & (points <= upper + margin), axis=1)
+
+    inside = np.zeros(points.shape[0], dtype=bool)
+    if not in_bounds.any():
+        return inside
+    candidates = pv.PolyData(points[in_bounds])
+    selected = candidates.select_enclosed_points(
+        mesh.polydata, tolerance=tolerance, check_surface=False
+    )
+    inside[in_bounds] = selected["SelectedPoints"].astype(bool)
+    return inside
@@ -1,8 +1,25 @@
+from enum import Enum
+
 import pyvista as pv
 import numpy as np
 
 from .off import read_off, generate_off
-from .draco import read_draco_to_polydata, generate_draco
+from .draco import read_draco, read_draco_to_polydata, generate_draco, fan_triangulate, triangulate_faces
+from .raw import is_raw_file, generate_raw, read_raw
+
+
+class MeshFormat(str, Enum):
+    """Possible encodings for generated meshes"""
+
+    DRACO = "draco"
+    OFF = "off"
+    RAW = "raw"
+    RAW_ZSTD = "raw.zst"
+
+    @property
+    def extension(self) -> str:
+        """Suffix added to result entry names. Draco is the historical default and has none"""
+        return "" if self == MeshFormat.DRACO else "." + self.value
 
 
 def is_off_file(data: bytes) -> bool:
@@ -11,17 +28,92 @@ def is_off_file(data: bytes) -> bool:
 
 
 def generate_mesh(
-    verts: np.ndarray | list, faces: np.ndarray | list, use_off=False
+    verts: np.ndarray | list,
+    faces: np.ndarray | list,
+    mesh_format: MeshFormat = MeshFormat.DRACO,
 ) -> bytes:
-    if use_off:
+    if mesh_format == MeshFormat.OFF:
         return generate_off(verts, faces)
-    else:
-        return generate_draco(verts, faces)
+    if mesh_format in (MeshFormat.RAW, MeshFormat.RAW_ZSTD):
+        f = (
+            faces
+            if isinstance(faces, np.ndarray) and faces.shape[1] == 3
+            else triangulate_faces(faces)
+        )
+        return generate_raw(verts, f, compress=mesh_format == MeshFormat.RAW_ZSTD)
+    return generate_draco(verts, faces)
 
 
-def read_mesh_to_polydata(data: bytes) -> pv.PolyData:
-    """Load either OFF or Draco bytes into a PyVista PolyData."""
+def split_mesh_by_part(
+    verts: np.ndarray | list, faces: np.ndarray | list, parts: np.ndarray | list
+) -> dict[int, tuple[np.ndarray, np.ndarray]]:
+    """Split a shared vertex/face soup into one compact triangle mesh per part.
+
+    Parameters
+    ----------
+    verts : np.ndarray | list
+        Vertices shared by all parts, shape (V, 3).
+    faces : np.ndarray | list
+        Polygons referencing ``verts`` (tris, quads & ngons possible).
+    parts : np.ndarray | list
+        Non-negative part identifier for each face.
+
+    Returns
+    -------
+    dict[int, tuple[np.ndarray, np.ndarray]]
+        A map from part identifier to (vertices, triangles), where the vertex array only
+        contains the vertices used by the part and the triangles index into it.
+    """
+    verts = np.asarray(verts)
+    triangles, face_index = fan_triangulate(faces)
+    triangle_parts = np.asarray(parts, dtype=np.int64)[face_index]
+
+    # bucket the triangles by part with a stable sort, so each part keeps the original face order
+    order = np.argsort(triangle_parts, kind="stable")
+    counts = np.bincount(triangle_parts) if triangle_parts.size else np.empty(0, dtype=np.int64)
+    ends = np.cumsum(counts)
+
+    out = {}
+    for part in np.flatnonzero(counts):
+        part_triangles = triangles[order[ends[part] - counts[part]:ends[part]]]
+        # only keep the vertices referenced by this part, and reindex the triangles accordingly
+        used, inverse = np.unique(part_triangles, return_inverse=True)
+        out[int(part)] = (verts[used], inverse.reshape(-1, 3).astype(np.int32))
+    return out
+
+
+def read_mesh_to_arrays(data: bytes) -> tuple[np.ndarray, np.ndarray]:
+    """Load either OFF, raw or Draco bytes into vertices of shape (V, 3) and triangles of shape (F, 3)."""
+    if is_raw_file(data):
+        try:
+            return read_raw(data)
+        except Exception as e:
+            raise ValueError("Invalid raw mesh file") from e
     if is_off_file(data):
+        try:
+            mesh = read_off(data.decode('utf-8'))
+            return mesh.points, mesh.cells[0].data
+        except Exception as e:
+            raise ValueError("Invalid OFF file") from e
+    try:
+        return read_draco(data)
+    except Exception as e:
+        raise ValueError("Invalid Draco file") from e
+
+
+def read_mesh_to_polydata(data: bytes) -> pv.PolyData:
+    """Load either OFF, raw or Draco bytes into a PyVista PolyData."""
+    if is_raw_file(data):
+        try:
+            points, triangles = read_raw(data)
+            faces_pv = np.hstack([
+                np.full((triangles.shape[0], 1), 3, dtype=np.int64),
+                triangles.astype(np.int64)
+            ]).ravel()
+            mesh = pv.PolyData(points.astype(np.float64), faces=faces_pv)
+        except Exception as e:
+            raise ValueError("Invalid raw mesh file") from e
+    elif is_off_file(data):
         # Old OFF importer
         try:
             mesh_str = data.decode('utf-8')  # Decode only if confirmed OFF
@@ -0,0 +1,90 @@
+"""
+Raw binary mesh container, for consumers where Draco encoding and decoding costs more than the bandwidth it saves.
+
+Layout (little-endian):
+    magic       4 bytes   b"VKRM"
+    version     uint8
+    flags       uint8     bit 0: payload is zstd compressed
+    reserved    2 bytes
+    num_verts   uint32
+    num_faces   uint32
+    payload     num_verts * 3 float32 vertex positions, followed by num_faces * 3 uint32 triangle indices
+"""
+
+import struct
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, only needed for compressed payloads
+    zstandard = None
+
+RAW_MAGIC = b"VKRM"
+RAW_VERSION = 1
+RAW_FLAG_ZSTD = 0x01
+RAW_ZSTD_LEVEL = 3
+
+_HEADER = struct.Struct("<4sBBxxII")
+_VERTEX_DTYPE = np.dtype("<f4")
+_INDEX_DTYPE = np.dtype("<u4")
+
+
+def is_raw_file(data: bytes) -> bool:
+    """Check if the bytes start with the raw mesh magic number."""
+    return len(data) >= _HEADER.size and data[:4] == RAW_MAGIC
+
+
+def generate_raw(verts: np.ndarray, triangles: np.ndarray, compress=False) -> bytes:
+    """Generate a raw mesh container from vertices and triangles.
+
+    Parameters
+    ----------
+        verts: np.array
+            Vertex positions, shape (V, 3).
+        triangles: np.array
+            Triangle vertex indices, shape (F, 3).
+        compress: bool
+            Compress the payload with zstd. Requires the zstandard package. Defaults to False.
+
+    Returns
+    --------
+        bytes: The raw mesh container.
+    """
+    verts = np.ascontiguousarray(verts, dtype=_VERTEX_DTYPE).reshape(-1, 3)
+    triangles = np.ascontiguousarray(triangles, dtype=_INDEX_DTYPE).reshape(-1, 3)
+    payload = verts.tobytes() + triangles.tobytes()
+    flags = 0
+    if compress:
+        if zstandard is None:
+            raise ValueError("zstd compressed meshes require the zstandard package")
+        payload = zstandard.ZstdCompressor(level=RAW_ZSTD_LEVEL).compress(payload)
+        flags |= RAW_FLAG_ZSTD
+    header = _HEADER.pack(RAW_MAGIC, RAW_VERSION, flags, len(verts), len(triangles))
+    return header + payload
+
+
+def read_raw(data: bytes) -> tuple[np.ndarray, np.ndarray]:
+    """Read a raw mesh container, returning vertices of shape (V, 3) and triangles of shape (F, 3)."""
+    if not is_raw_file(data):
+        raise ValueError("Not a raw mesh container")
+    _, version, flags, num_verts, num_faces = _HEADER.unpack_from(data)
+    if version != RAW_VERSION:
+        raise ValueError(f"Unsupported raw mesh version {version}")
+    payload = memoryview(data)[_HEADER.size:]
+    if flags & RAW_FLAG_ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd compressed meshes require the zstandard package")
+        payload = zstandard.ZstdDecompressor().decompress(
+            payload,
+            max_output_size=num_verts * 3 * _VERTEX_DTYPE.itemsize
+            + num_faces * 3 * _INDEX_DTYPE.itemsize,
+        )
+    verts = np.frombuffer(payload, dtype=_VERTEX_DTYPE, count=num_verts * 3)
+    triangles = np.frombuffer(
+        payload,
+        dtype=_INDEX_DTYPE,
+        count=num_faces * 3,
+        offset=num_verts * 3 * _VERTEX_DTYPE.itemsize,
+    )
+    return verts.reshape(-1, 3), triangles.reshape(-1, 3)
@@ -2,18 +2,20 @@ from .profiler import VkProfiler, set_profiler, get_current_profiler, profile_st
 from .util import VkProfilerSettings
 from .settings.tunnel_meshes import PROFILER_TUNNEL_MESHES_V4
 from .settings.meshes import PROFILER_MESHES_V6
-from .settings.intersections import PROFILER_INTERSECTIONS_V5
+from .settings.intersections import PROFILER_INTERSECTIONS_V8
 from .settings.faults import PROFILER_FAULTS_V5
 from .settings.voxels import PROFILER_VOXELS_V3
-from .settings.gwb_meshes import PROFILER_GWB_MESHES_V3
+from .settings.gwb_meshes import PROFILER_GWB_MESHES_V4
+from .settings.points import PROFILER_POINTS_V1
 
 PROFILES = {
     "tunnel_meshes": PROFILER_TUNNEL_MESHES_V4,
     "meshes": PROFILER_MESHES_V6,
-    "intersections": PROFILER_INTERSECTIONS_V5,
+    "intersections": PROFILER_INTERSECTIONS_V8,
     "faults": PROFILER_FAULTS_V5,
     "voxels": PROFILER_VOXELS_V3,
-    "gwb_meshes": PROFILER_GWB_MESHES_V3,
+    "gwb_meshes": PROFILER_GWB_MESHES_V4,
+    "points": PROFILER_POINTS_V1,
 }
 
 __all__ = [
@@ -2,8 +2,8 @@
 # the code will then append the stats to an appropriate file, not mixing between versions
 from ..util import VkProfilerSettings
 
-PROFILER_INTERSECTIONS_V5 = VkProfilerSettings(
-    version=5,
+PROFILER_INTERSECTIONS_V8 = VkProfilerSettings(
+    version=8,
     computation='intersections',
-    steps=['load_model', 'cross_section_grid','map_grid', 'ranks', 'tesselate_faults',
-     'hydro_setup', 'hydro_project_drillholes', 'hydro_project_springs', 'hydro_project_gwbs'])
+    steps=['load_model', 'cross_section_grid','map_grid', 'topography', 'ranks', 'tesselate_faults',
+     'hydro_project_features', 'hydro_project_gwbs', 'borehole_logs'])
@@ -0,0 +1,8 @@
+# if the profiling characteristics change, make a new version.
+# the code will then append the stats to an appropriate file, not mixing between versions
+from ..util import VkProfilerSettings
+
+PROFILER_POINTS_V1 = VkProfilerSettings(
+    version=1,
+    computation='points',
+    steps=['load_model', 'ranks', 'faults'])
@@ -0,0 +1,173 @@
+"""
+Serialization of computation results containing NumPy arrays, such as intersections.
+
+Results are nested dicts and lists, with NumPy arrays for the large grids. They can be written as JSON, where arrays
+become nested lists and NaN becomes null, or as a compact binary container keeping the arrays as typed arrays.
+
+JSON is written with orjson when it is installed, which writes arrays directly instead of building lists of Python
+objects first.
+
+Binary layout (little-endian):
+    magic       4 bytes   b"VKAR"
+    version     uint8
+    reserved    3 bytes
+    header_size uint32
+    header      header_size bytes of UTF-8 JSON: {"arrays": [{"dtype", "shape", "offset"}], "data": ...}, padded with
+                spaces to a multiple of 8 bytes including the preamble
+    arrays      raw C ordered array data, each starting at its offset from the end of the header, aligned to 8 bytes
+
+In "data", every array is replaced by {"$array": index in "arrays"}. Integer arrays are stored with the smallest of
+uint8, int8, uint16, int16 and int32 that fits their values, and float arrays as float32 by default, with NaN kept.
+"""
+
+import json
+import struct
+from typing import Any
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # optional dependency, arrays are then converted to lists before being written
+    orjson = None
+
+JSON_MIMETYPE = "application/json"
+BINARY_MIMETYPE = "application/vnd.geocruncher.arrays"
+
+BINARY_MAGIC = b"VKAR"
+BINARY_VERSION = 1
+_PREAMBLE = struct.Struct("<4sBxxxI")
+_ALIGNMENT = 8
+_ARRAY_KEY = "$array"
+_INTEGER_DTYPES = [np.uint8, np.int8, np.uint16, np.int16, np.int32]
+
+
+def to_json_compatible(value: Any) -> Any:
+    """Convert arrays in a result to nested lists, with NaN as None."""
+    if isinstance(value, np.ndarray):
+        if np.issubdtype(value.dtype, np.floating) and np.isnan(value).any():
+            return np.where(np.isnan(value), None, value).tolist()
+        return value.tolist()
+    if isinstance(value, dict):
+        return {key: to_json_compatible(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json_compatible(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _orjson_default(value: Any) -> Any:
+    """Called by orjson for what it can't serialize, such as arrays that are not C contiguous or of other types"""
+    if isinstance(value, np.ndarray):
+        if value.dtype == np.float16:
+            return value.astype(np.float32)
+        if not value.flags.c_contiguous:
+            return np.ascontiguousarray(value)
+        return to_json_compatible(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps_json(value: Any, indent: bool = False) -> bytes:
+    """Serialize a result as JSON, compact unless indented with 2 spaces"""
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(value, default=_orjson_default, option=option)
+    if indent:
+        return json.dumps(to_json_compatible(value), indent=2, separators=(',', ': ')).encode('utf-8')
+    return json.dumps(to_json_compatible(value), separators=(',', ':')).encode('utf-8')
+
+
+def _padding(size: int) -> int:
+    return -size % _ALIGNMENT
+
+
+def _narrow(array: np.ndarray, float_dtype: np.dtype) -> np.ndarray:
+    """Smallest storage type for the values of an array"""
+    if array.dtype == np.bool_:
+        return array.astype(np.uint8)
+    if np.issubdtype(array.dtype, np.integer):
+        if array.size == 0:
+            return array.astype(np.uint8)
+        low, high = array.min(), array.max()
+        for dtype in _INTEGER_DTYPES:
+            info = np.iinfo(dtype)
+            if info.min <= low and high <= info.max:
+                return array.astype(dtype)
+        return array.astype(np.int64)
+    if np.issubdtype(array.dtype, np.floating):
+        return array.astype(float_dtype)
+    raise TypeError(f"Unsupported array type {array.dtype}")
+
+
+def dumps_binary(value: Any, float_dtype: np.dtype = np.float32) -> bytes:
+    """Serialize a result in the binary container format.
+
+    Float arrays are stored as float32, unless another float_dtype is given. Use float64 to store results without
+    losing precision, for example before converting them to JSON later.
+    """
+    arrays = []
+
+    def replace(item: Any) -> Any:
+        if isinstance(item, np.ndarray):
+            arrays.append(np.ascontiguousarray(_narrow(item, float_dtype)))
+            return {_ARRAY_KEY: len(arrays) - 1}
+        if isinstance(item, dict):
+            return {key: replace(v) for key, v in item.items()}
+        if isinstance(item, (list, tuple)):
+            return [replace(v) for v in item]
+        if isinstance(item, np.generic):
+            return item.item()
+        return item
+
+    data = replace(value)
+
+    descriptions = []
+    offset = 0
+    for array in arrays:
+        descriptions.append({"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset})
+        offset += array.nbytes + _padding(array.nbytes)
+    header = json.dumps({"arrays": descriptions, "data": data}, separators=(',', ':')).encode('utf-8')
+    # pad the header with spaces, so the arrays are aligned
+    header += b" " * _padding(_PREAMBLE.size + len(header))
+
+    parts = [_PREAMBLE.pack(BINARY_MAGIC, BINARY_VERSION, len(header)), header]
+    for array in arrays:
+        parts.append(array.tobytes())
+        parts.append(b"\0" * _padding(array.nbytes))
+    return b"".join(parts)
+
+
+def is_binary(data: bytes) -> bool:
+    """Check if the bytes start with the binary container magic number"""
+    return len(data) >= _PREAMBLE.size and data[:4] == BINARY_MAGIC
+
+
+def loads_binary(data: bytes) -> Any:
+    """Deserialize a binary container. Arrays are read only views on the given bytes"""
+    if not is_binary(data):
+        raise ValueError("Not a binary result container")
+    _, version, header_size = _PREAMBLE.unpack_from(data)
+    if version != BINARY_VERSION:
+        raise ValueError(f"Unsupported binary result version {version}")
+    header = json.loads(data[_PREAMBLE.size:_PREAMBLE.size + header_size])
+    start = _PREAMBLE.size + header_size
+    arrays = []
+    for description in header["arrays"]:
+        dtype = np.dtype(description["dtype"])
+        count = int(np.prod(description["shape"], dtype=np.int64))
+        array = np.frombuffer(data, dtype=dtype, count=count, offset=start + description["offset"])
+        arrays.append(array.reshape(description["shape"]))
+
+    def restore(item: Any) -> Any:
+        if isinstance(item, dict):
+            if len(item) == 1 and _ARRAY_KEY in item:
+                return arrays[item[_ARRAY_KEY]]
+            return {key: restore(v) for key, v in item.items()}
+        if isinstance(item, list):
+            return [restore(v) for v in item]
+        return item
+
+    return restore(header["data"])
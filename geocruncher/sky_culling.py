@@ -0,0 +1,132 @@
+"""
+Points above the topography are always evaluated to the sky rank, but evaluating them still walks the whole model.
+The DEM is interpolated inside each of its cells, so the elevation of the surface in a cell lies between the lowest
+and the highest of the cell corners. Points above the highest corner are certainly in the sky and are not evaluated.
+"""
+import weakref
+from typing import Callable
+
+import numpy as np
+from forgeo.gmlib.topography_reader import ImplicitDTM, ImplicitHorizontalPlane
+
+# Point classification
+ABOVE = 1
+NEAR = 0
+BELOW = -1
+
+# Rank of the points above the topography, as returned by the evaluator
+RANK_SKY = 0
+
+# Margin around the surface bounds, relative to the elevation range of the DEM, so that points close to the surface
+# are always evaluated
+RELATIVE_MARGIN = 1e-6
+
+
+class ColumnBounds:
+    """Lowest and highest elevation of the topography in each DEM cell"""
+
+    def __init__(self, topography: ImplicitDTM | ImplicitHorizontalPlane):
+        if isinstance(topography, ImplicitDTM):
+            z = topography.z
+            corners = np.stack([z[:-1, :-1], z[1:, :-1], z[:-1, 1:], z[1:, 1:]])
+            self.zmin = corners.min(axis=0)
+            self.zmax = corners.max(axis=0)
+            self.origin = topography.origin
+            self.invsteps = topography.invsteps
+            z_range = float(z.max() - z.min()) if z.size else 0.0
+        else:
+            # a single cell covering everything
+            self.zmin = np.full((1, 1), topography.z)
+            self.zmax = np.full((1, 1), topography.z)
+            self.origin = None
+            self.invsteps = None
+            z_range = 0.0
+        self.margin = RELATIVE_MARGIN * max(z_range, 1.0)
+
+    def classify(self, xyz: np.ndarray) -> np.ndarray:
+        """Classify points as ABOVE, BELOW or NEAR the topography.
+
+        Parameters
+        ----------
+        xyz : np.ndarray
+            Array of shape (N, 3) of the points to classify.
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (N,) of ABOVE, BELOW or NEAR. Points outside of the DEM are NEAR, since the way
+            the surface is extended there is up to the evaluator.
+        """
+        xyz = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+        classes = np.full(xyz.shape[0], NEAR, dtype=np.int8)
+        if self.zmax.size == 0:
+            return classes
+        if self.origin is None:
+            cells = np.zeros((xyz.shape[0], 2), dtype=np.intp)
+            inside = np.ones(xyz.shape[0], dtype=bool)
+        else:
+            ncells = np.array(self.zmax.shape)
+            position = (xyz[:, :2] - self.origin) * self.invsteps
+            inside = np.all((position >= 0) & (position <= ncells), axis=1)
+            # points on the upper edges belong to the last cell
+            cells = np.minimum(np.floor(position[inside]).astype(np.intp), ncells - 1)
+        i, j = cells[:, 0], cells[:, 1]
+        z = xyz[inside, 2]
+        inside_classes = np.full(z.shape[0], NEAR, dtype=np.int8)
+        inside_classes[z > self.zmax[i, j] + self.margin] = ABOVE
+        inside_classes[z < self.zmin[i, j] - self.margin] = BELOW
+        classes[inside] = inside_classes
+        return classes
+
+
+_column_bounds: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def column_bounds(topography: ImplicitDTM | ImplicitHorizontalPlane) -> ColumnBounds:
+    """Get the column bounds of a topography, computed once per topography"""
+    bounds = _column_bounds.get(topography)
+    if bounds is None:
+        bounds = ColumnBounds(topography)
+        _column_bounds[topography] = bounds
+    return bounds
+
+
+def evaluate_ranks(
+    evaluator: Callable[[np.ndarray], np.ndarray],
+    xyz: np.ndarray,
+    topography: ImplicitDTM | ImplicitHorizontalPlane,
+    potential: np.ndarray = None,
+) -> np.ndarray:
+    """Evaluate ranks with a topography aware evaluator, without evaluating the points certainly above the topography.
+
+    Parameters
+    ----------
+    evaluator : Callable[[np.ndarray], np.ndarray]
+        Evaluator created with the implicit topography of the model.
+    xyz : np.ndarray
+        Array of shape (N, 3) of the points to evaluate.
+    topography : ImplicitDTM or ImplicitHorizontalPlane
+        The topography of the model, used to create the evaluator.
+    potential : np.ndarray, optional
+        Topography potential at the points, if already known. Points clearly above the surface are then found
+        exactly instead of with the column bounds.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (N,) of the ranks, RANK_SKY above the topography.
+    """
+    xyz = np.asarray(xyz).reshape(-1, 3)
+    bounds = column_bounds(topography)
+    if potential is not None:
+        is_evaluated = np.asarray(potential).reshape(-1) <= bounds.margin
+    else:
+        is_evaluated = bounds.classify(xyz) != ABOVE
+    if is_evaluated.all():
+        return evaluator(xyz)
+    if not is_evaluated.any():
+        return np.full(xyz.shape[0], RANK_SKY, dtype=np.int32)
+    evaluated = np.asarray(evaluator(np.ascontiguousarray(xyz[is_evaluated])))
+    ranks = np.full(xyz.shape[0], RANK_SKY, dtype=evaluated.dtype)
+    ranks[is_evaluated] = evaluated
+    return ranks
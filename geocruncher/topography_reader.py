@@ -9,7 +9,7 @@ import re
 from io import StringIO
 
 import numpy as np
-from forgeo.gmlib.topography_reader import ImplicitDTM
+from forgeo.gmlib.topography_reader import ImplicitDTM, ImplicitHorizontalPlane
 
 logger = logging.getLogger(__name__)
 
@@ -32,3 +32,40 @@ def ascii_grid_to_implicit_dtm(dem: str) -> ImplicitDTM:
     zmap = zmap[::-1].T
 
     return ImplicitDTM((xllcorner, yllcorner), (float(cellsize), float(cellsize)), zmap)
+
+
+def evaluate_z(topography, xy: np.ndarray) -> np.ndarray:
+    """Vectorized equivalent of the evaluate_z method of GMLIB elevation surfaces, for arrays of shape (N, 2).
+
+    ImplicitDTM interpolates each point on its own in Python, which is slow on whole cross sections. Points are
+    interpolated the same way here: clamped to the DEM, and linearly interpolated in one of the two triangles of their
+    cell.
+    """
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    if isinstance(topography, ImplicitHorizontalPlane):
+        return np.full(xy.shape[0], topography.z)
+    if not isinstance(topography, ImplicitDTM):
+        return np.asarray(topography.evaluate_z(xy), dtype=np.float64).reshape(-1)
+
+    zmap = topography.z
+    nx, ny = zmap.shape
+    position = (xy - topography.origin) * topography.invsteps
+    position = np.maximum(position, 0)
+    i = np.minimum(position[:, 0], nx - 1)
+    j = np.minimum(position[:, 1], ny - 1)
+    ii = i.astype(np.intp)
+    ij = j.astype(np.intp)
+    i -= ii
+    j -= ij
+    # the next indices are only used with a zero weight on the last row and column
+    ii1 = np.minimum(ii + 1, nx - 1)
+    ij1 = np.minimum(ij + 1, ny - 1)
+    lower = (1 - i - j) * zmap[ii, ij] + i * zmap[ii1, ij] + j * zmap[ii, ij1]
+    upper = (i + j - 1) * zmap[ii1, ij1] + (1 - i) * zmap[ii, ij1] + (1 - j) * zmap[ii1, ij]
+    return np.where(i + j <= 1, lower, upper)
+
+
+def topography_potential(topography, xyz: np.ndarray) -> np.ndarray:
+    """Potential of the topography at points of shape (N, 3): the height above the surface, positive in the sky"""
+    xyz = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+    return xyz[:, 2] - evaluate_z(topography, xyz[:, :2])
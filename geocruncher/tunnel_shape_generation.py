@@ -3,16 +3,17 @@ import numpy as np
 from sympy.parsing.sympy_parser import parse_expr
 from sympy import diff, symbols
 import scipy.integrate as integrate
-from .mesh_io.mesh_io import generate_mesh
+from .mesh_io.mesh_io import MeshFormat, generate_mesh
 from .profiler import profile_step
 
-def tunnel_to_meshes(functions, step, xy_points, idxStart, tStart, idxEnd, tEnd) -> bytes:
+def tunnel_to_meshes(functions, step, xy_points, idxStart, tStart, idxEnd, tEnd, mesh_format=MeshFormat.DRACO) -> bytes:
     """Generate a mesh for a tunnel
 
     Args:
         functions (list((str, str, str))): the functions that define the tunnel (separated for x, y, z and for t between 0 and 1)
         step (float): size of a step between 0 and 1
         xy_points (list(tuple[int, int, int])): points representing a segment of the tunnel on the xy plane
+        mesh_format (MeshFormat): encoding of the output mesh. Defaults to Draco
     """
     vertices = []
     t = symbols("t")
@@ -38,7 +39,7 @@ def tunnel_to_meshes(functions, step, xy_points, idxStart, tStart, idxEnd, tEnd)
             profile_step("project_points")
     triangles = _connect_vertices(len(xy_points), nb_series)
     profile_step("connect_vertices")
-    mesh = generate_mesh(np.array(vertices), np.array(triangles))
+    mesh = generate_mesh(np.array(vertices), np.array(triangles), mesh_format=mesh_format)
     profile_step("generate_mesh")
     return mesh
 
@@ -1,11 +1,12 @@
 import numpy as np
-import pyvista as pv
 from forgeo.gmlib.GeologicalModel3D import GeologicalModel, Box
 
 from forgeo.gmlib.architecture import from_GeoModeller, make_evaluator
 
-from .profiler import profile_step
-from .mesh_io.mesh_io import read_mesh_to_polydata
+from .profiler import profile_step, get_current_profiler
+from .cache.ranks import SAMPLING_CELLS, cached_ranks
+from .sky_culling import evaluate_ranks
+from .mesh_io.mesh_cache import read_cached_mesh, select_enclosed_points
 
 
 class Voxels:
@@ -15,6 +16,7 @@ class Voxels:
         shape: tuple[int, int, int],
         box: Box,
         gwb_meshes: dict[str, list[bytes]],
+        model_hash: str = None,
     ) -> str:
         # we use numpy meshgrid to produce a regular grid
         # the output is a list containing a 3D array for each coordinate
@@ -40,22 +42,26 @@ class Voxels:
         gwb_tags = [0] * xyz.shape[0]
         for gwb_id, meshes in gwb_meshes.items():
             for mesh_data in meshes:
-                mesh = read_mesh_to_polydata(mesh_data)
-                points = pv.PolyData(xyz)
+                mesh = read_cached_mesh(mesh_data)
                 profile_step('read_gwbs')
 
-                inside_points = points.select_enclosed_points(
-                    mesh, tolerance=0.00001)
-                selected_points = inside_points["SelectedPoints"].astype(
+                selected_points = select_enclosed_points(xyz, mesh).astype(
                     np.uint16)  # cast array to int16 to avoid overflow error
                 gwb_tags = [max(new_id, _id) for new_id, _id in zip(
                     selected_points * int(gwb_id), gwb_tags)]
                 profile_step('test_inside_gwbs')
 
-        cppmodel = from_GeoModeller(model)
-        topography = model.implicit_topography()
-        evaluator = make_evaluator(cppmodel, topography)
-        ranks = evaluator(xyz)
+        def evaluate():
+            cppmodel = from_GeoModeller(model)
+            topography = model.implicit_topography()
+            evaluator = make_evaluator(cppmodel, topography)
+            return evaluate_ranks(evaluator, xyz, model.topography)
+
+        # the rank grid of a previous voxels job on the same model, box and shape is reused, when model_hash is given
+        ranks, is_cached = cached_ranks(model_hash, box, shape, SAMPLING_CELLS, evaluate)
+        profiler = get_current_profiler()
+        if profiler:
+            profiler.set_metadata("ranks_cached", is_cached)
         profile_step('ranks')
 
         ranks_tags = list(zip(ranks, gwb_tags))
@@ -4,3 +4,5 @@ celery -A api worker -Q geocruncher:long_running,geocruncher:priority
 # Think about concurrency, memory limits, autoscale
 # https://docs.celeryq.dev/en/stable/userguide/workers.html#max-memory-per-child-setting
 # celery -A api worker -l INFO -Q geocruncher:priority
+# Session workers, keeping the models of interactive sessions loaded, see api/sessions.py
+# celery -A api worker -l INFO -Q geocruncher:sessions --concurrency=1
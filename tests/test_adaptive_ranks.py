@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from geocruncher.adaptive_ranks import normalize_tolerance, refine_ranks
+
+
+def layered_section(resolution):
+    i, j = np.meshgrid(np.arange(resolution[0]), np.arange(resolution[1]), indexing="ij")
+    ranks = (0.7 * i + 0.3 * j) // 13 + 5 * ((i - 60) ** 2 + (j - 40) ** 2 < 300)
+    return ranks.astype(np.int32)
+
+
+class CountingEvaluator:
+    def __init__(self, ranks):
+        self.ranks = ranks
+        self.num_evaluated = 0
+
+    def __call__(self, indices):
+        self.num_evaluated += indices.size
+        return self.ranks.flat[indices]
+
+
+@pytest.mark.parametrize("resolution", [(150, 90), (90, 150), (1, 40), (40, 1), (1, 1), (3, 7)])
+def test_adaptive_ranks_match_dense_ranks(resolution):
+    expected = layered_section(resolution)
+    evaluator = CountingEvaluator(expected)
+    ranks, num_evaluated = refine_ranks(evaluator, resolution, 16)
+    np.testing.assert_array_equal(ranks, expected)
+    assert num_evaluated == evaluator.num_evaluated <= expected.size
+
+
+def test_adaptive_ranks_evaluate_fewer_points():
+    resolution = (150, 90)
+    evaluator = CountingEvaluator(layered_section(resolution))
+    refine_ranks(evaluator, resolution, 16)
+    assert evaluator.num_evaluated < 0.4 * resolution[0] * resolution[1]
+
+
+def test_boundaries_find_units_between_lattice_points():
+    resolution = (64, 64)
+    # a thin unit, between two lattice rows, along the zero level of a boundary field
+    expected = np.zeros(resolution, dtype=np.int32)
+    expected[:, 20] = 1
+    evaluator = CountingEvaluator(expected)
+
+    ranks, _ = refine_ranks(evaluator, resolution, 16)
+    assert not ranks[:, 20].any()
+
+    def boundary(indices):
+        return np.unravel_index(indices, resolution)[1] - 19.5
+
+    ranks, _ = refine_ranks(evaluator, resolution, 16, boundary)
+    np.testing.assert_array_equal(ranks, expected)
+
+
+@pytest.mark.parametrize("tolerance", [2.5, "4", 0, True])
+def test_normalize_tolerance_rejects_non_integers(tolerance):
+    with pytest.raises(ValueError):
+        normalize_tolerance(tolerance)
+
+
+def test_normalize_tolerance_defaults_to_every_point():
+    assert normalize_tolerance(None) == normalize_tolerance(1) == 1
+    assert normalize_tolerance(np.int64(8)) == 8
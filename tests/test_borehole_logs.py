@@ -0,0 +1,24 @@
+import numpy as np
+
+from geocruncher.borehole_logs import rank_intervals, sample_polylines
+
+
+def test_polylines_are_sampled_along_their_length():
+    vertical = [[0.0, 0.0, 0.0], [0.0, 0.0, -10.0]]
+    bent = [[0.0, 0.0, 0.0], [3.0, 4.0, 0.0], [3.0, 4.0, -5.0]]
+
+    points, depths, lengths = sample_polylines([vertical, bent], 3)
+
+    np.testing.assert_allclose(lengths, [10.0, 10.0])
+    np.testing.assert_allclose(depths, [[0.0, 5.0, 10.0], [0.0, 5.0, 10.0]])
+    np.testing.assert_allclose(points, [
+        [0, 0, 0], [0, 0, -5], [0, 0, -10],
+        [0, 0, 0], [3, 4, 0], [3, 4, -5],
+    ])
+
+
+def test_rank_intervals_are_run_length_encoded():
+    depths = np.array([0.0, 1.0, 2.0, 3.0, 4.0])
+    ranks = np.array([0, 0, 2, 2, 1])
+    assert rank_intervals(depths, ranks, 4.0) == [[0.0, 1.5, 0], [1.5, 3.5, 2], [3.5, 4.0, 1]]
+    assert rank_intervals(depths, np.full(5, 3), 4.0) == [[0.0, 4.0, 3]]
@@ -0,0 +1,72 @@
+import numpy as np
+
+from geocruncher.cache import DiskStorage, MemoryStorage, content_hash, pack_entry, unpack_entry
+from geocruncher.cache import sections
+from geocruncher.cache.ranks import decode_ranks, encode_ranks
+
+
+def test_pack_entry_round_trip():
+    header = {"springs": [[1, 0.0, 1.0, 2.0, 3]], "parts": []}
+    blobs = [b"\x00\x01", "OFF\n", b""]
+    unpacked_header, unpacked_blobs = unpack_entry(pack_entry(header, blobs))
+    assert unpacked_header == header
+    assert unpacked_blobs == [b"\x00\x01", b"OFF\n", b""]
+
+
+def test_content_hash_separates_parts():
+    assert content_hash("ab", "c") != content_hash("a", "bc")
+
+
+def test_memory_storage_evicts_least_recently_used():
+    storage = MemoryStorage(max_bytes=8)
+    storage.set("a", b"1234")
+    storage.set("b", b"5678")
+    storage.get("a")
+    storage.set("c", b"9012")
+    assert storage.get("a") == b"1234"
+    assert storage.get("b") is None
+    assert storage.get("c") == b"9012"
+
+
+def test_disk_storage_round_trip(tmp_path):
+    storage = DiskStorage(str(tmp_path))
+    assert storage.get("ranks:abc") is None
+    storage.set("ranks:abc", b"1234")
+    assert storage.get("ranks:abc") == b"1234"
+
+
+def test_rank_grid_round_trip():
+    ranks = np.array([0, 1, 2, 1, 0, 3], dtype=np.int64)
+    decoded = decode_ranks(encode_ranks(ranks.reshape(2, 3)))
+    assert decoded.dtype == np.int64
+    assert np.array_equal(decoded, ranks.reshape(2, 3))
+
+    large = np.array([0, 300, -2], dtype=np.int32)
+    assert np.array_equal(decode_ranks(encode_ranks(large)), large)
+
+
+def test_cached_section_only_computes_changed_segments(monkeypatch):
+    storage = MemoryStorage(max_bytes=1 << 20)
+    monkeypatch.setattr(sections, "get_cache", lambda: storage)
+    computed = []
+
+    def compute(box):
+        def run():
+            computed.append(box["lowerLeft"]["x"])
+            return {"ranks": np.array([[1, 2], [3, 4]]), "faults": {"f": np.array([[0.5, np.nan]])}}
+        return run
+
+    box = {"lowerLeft": {"x": 0, "y": 0, "z": 0}, "upperRight": {"x": 10, "y": 0, "z": 10}}
+    moved = {"lowerLeft": {"x": 1, "y": 0, "z": 0}, "upperRight": {"x": 10, "y": 0, "z": 10}}
+    modes = ("grid", "grid")
+    _, is_cached = sections.cached_section("model", box, 50, "", modes, compute(box))
+    assert not is_cached
+    segment, is_cached = sections.cached_section("model", box, 50, "", modes, compute(box))
+    assert is_cached
+    assert segment["ranks"].tolist() == [[1, 2], [3, 4]]
+    np.testing.assert_array_equal(segment["faults"]["f"], [[0.5, np.nan]])
+    _, is_cached = sections.cached_section("model", moved, 50, "", modes, compute(moved))
+    assert not is_cached
+    _, is_cached = sections.cached_section("model", box, 100, "", modes, compute(box))
+    assert not is_cached
+    assert computed == [0, 1, 0]
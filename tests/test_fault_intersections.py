@@ -0,0 +1,125 @@
+from types import SimpleNamespace
+
+import numpy as np
+from forgeo.gmlib.topography_reader import ImplicitHorizontalPlane
+
+from geocruncher.fault_intersections import FaultIntersector, FaultOutputMode
+
+
+def vertical_slice(resolution):
+    """Points of a vertical slice along the x axis, ordered like compute_vertical_slice_points"""
+    z, x = np.meshgrid(np.linspace(-50, 0, resolution[1]), np.linspace(0, 100, resolution[0]))
+    return np.stack((x.ravel(), np.zeros(x.size), z.ravel()), axis=-1)
+
+
+class CountingField:
+    """Potential field recording how many points it was evaluated on"""
+
+    def __init__(self, function):
+        self.function = function
+        self.num_evaluated = 0
+
+    def __call__(self, points):
+        points = np.reshape(points, (-1, 3))
+        self.num_evaluated += len(points)
+        return self.function(points)
+
+
+def fault_data(interfaces, infinite, stops_on=(), radius=0.0):
+    return SimpleNamespace(
+        infinite=infinite,
+        stops_on=list(stops_on),
+        potential_data=SimpleNamespace(interfaces=[np.asarray(interfaces, dtype=np.float64)]),
+        center_type="mean_center",
+        influence_radius=radius,
+        lateral_extent=radius,
+        vertical_extent=radius,
+    )
+
+
+def sphere(center, radius):
+    return CountingField(lambda p: np.sum((p - center) ** 2, axis=1) / radius**2 - 1)
+
+
+def test_finite_faults_are_only_evaluated_around_their_ellipsoid():
+    resolution = (40, 20)
+    xyz = vertical_slice(resolution)
+
+    near_center = np.array([30.0, 0.0, -25.0])
+    far_center = np.array([30.0, 500.0, -25.0])
+    faults = {
+        "near": CountingField(lambda p: p[:, 0] - 30),
+        "far": CountingField(lambda p: p[:, 0] - 30),
+        "infinite": CountingField(lambda p: p[:, 0] - 70),
+    }
+    ellipsoids = {"near": sphere(near_center, 10.0), "far": sphere(far_center, 10.0)}
+    model = SimpleNamespace(
+        topography=ImplicitHorizontalPlane(0.0),
+        faults=faults,
+        fault_ellipsoids=ellipsoids,
+        faults_data={
+            "near": fault_data([near_center], False, radius=10.0),
+            "far": fault_data([far_center], False, radius=10.0),
+            "infinite": fault_data([[70.0, 0.0, -25.0]], True),
+        },
+    )
+
+    result = FaultIntersector(xyz, resolution, model).intersect()
+
+    assert faults["far"].num_evaluated == 0
+    assert "far" not in result
+    assert 0 < faults["near"].num_evaluated < len(xyz)
+    assert faults["infinite"].num_evaluated == len(xyz)
+
+    near = np.array(result["near"], dtype=np.float64).T
+    inside = (np.sum((xyz - near_center) ** 2, axis=1) < 100).reshape(resolution)
+    expected = np.where(inside, xyz[:, 0].reshape(resolution) - 30, np.nan)
+    np.testing.assert_allclose(near, expected)
+
+
+def test_limiting_faults_are_evaluated_where_the_limited_fault_is():
+    resolution = (40, 20)
+    xyz = vertical_slice(resolution)
+
+    limit_center = np.array([90.0, 0.0, -25.0])
+    faults = {
+        "limited": CountingField(lambda p: p[:, 2] + 25),
+        "limit": CountingField(lambda p: p[:, 0] - 50),
+    }
+    model = SimpleNamespace(
+        topography=ImplicitHorizontalPlane(0.0),
+        faults=faults,
+        fault_ellipsoids={"limit": sphere(limit_center, 5.0)},
+        faults_data={
+            "limited": fault_data([[20.0, 0.0, -25.0], [30.0, 0.0, -25.0]], True, stops_on=["limit"]),
+            "limit": fault_data([limit_center], False, radius=5.0),
+        },
+    )
+
+    result = FaultIntersector(xyz, resolution, model).intersect()
+
+    # the whole grid, plus the interface points of the limited fault to find its side
+    assert faults["limit"].num_evaluated == len(xyz) + 2
+    limited = np.array(result["limited"], dtype=np.float64).T
+    # clipped on the other side of the limiting fault, even far from its ellipsoid
+    assert np.isnan(limited[xyz[:, 0].reshape(resolution) > 50]).all()
+    assert not np.isnan(limited[xyz[:, 0].reshape(resolution) < 50]).all()
+
+
+def test_trace_mode_returns_the_zero_level():
+    resolution = (41, 21)
+    xyz = vertical_slice(resolution)
+    model = SimpleNamespace(
+        topography=ImplicitHorizontalPlane(0.0),
+        faults={"vertical": CountingField(lambda p: p[:, 0] - 30)},
+        fault_ellipsoids={},
+        faults_data={"vertical": fault_data([[30.0, 0.0, -25.0]], True)},
+    )
+
+    result = FaultIntersector(xyz, resolution, model).intersect(FaultOutputMode.TRACE)
+
+    (polyline,) = result["vertical"]
+    points = np.array(polyline)
+    # x = 30 is at 12 grid steps along the width, the trace spans the whole height
+    np.testing.assert_allclose(points[:, 0], 12)
+    assert points[:, 1].min() == 0 and points[:, 1].max() == resolution[1] - 1
@@ -0,0 +1,50 @@
+import numpy as np
+
+from forgeo.gmlib.GeologicalModel3D import Box
+
+from geocruncher.ComputeIntersections import (
+    HydroFeatures,
+    hydro_projection_plane,
+    project_hydro_features,
+    rank_polygons,
+)
+
+
+def test_rank_polygons_bound_each_unit():
+    ranks = np.ones((6, 4), dtype=np.int32)
+    ranks[:, 2:] = 2
+    ranks[2:4, 1] = 3
+
+    polygons = rank_polygons(ranks)
+
+    assert set(polygons) == {"1", "2", "3"}
+    # rank 2 is a rectangle on the border: 4 corners, closed
+    (ring,) = polygons["2"]
+    assert len(ring) == 5 and ring[0] == ring[-1]
+    assert {tuple(p) for p in ring} == {(-0.5, 1.5), (5.5, 1.5), (5.5, 3.5), (-0.5, 3.5)}
+    # rank 1 surrounds rank 3 on three sides, without a hole
+    assert len(polygons["1"]) == 1
+    assert len(polygons["3"]) == 1
+
+
+def test_hydro_features_are_projected_on_every_section():
+    springs = {"1": {"x": 50.0, "y": 10.0, "z": 5.0}, "2": {"x": 50.0, "y": 500.0, "z": 5.0}}
+    drillholes = {"7": {"xmin": 20.0, "ymin": -30.0, "zmin": 0.0, "xmax": 20.0, "ymax": 30.0, "zmax": -40.0}}
+    boxes = [
+        Box(xmin=0, ymin=0, zmin=-100, xmax=100, ymax=0, zmax=100),
+        Box(xmin=0, ymin=500, zmin=-100, xmax=100, ymax=500, zmax=100),
+    ]
+    planes = [hydro_projection_plane(b) for b in boxes]
+
+    projections = project_hydro_features(
+        HydroFeatures(springs, drillholes),
+        np.array([lower_left for lower_left, _ in planes]),
+        np.array([upper_right for _, upper_right in planes]),
+        max_dist_proj=50.0,
+    )
+
+    (drillholes_0, springs_0), (drillholes_1, springs_1) = projections
+    assert springs_0 == {"1": [50.0, 5.0]}
+    assert drillholes_0 == {"7": [[20.0, 0.0], [20.0, -40.0]]}
+    assert springs_1 == {"2": [50.0, 5.0]}
+    assert drillholes_1 == {}
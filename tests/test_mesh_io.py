@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+import pyvista as pv
+
+from geocruncher.mesh_io.draco import triangulate_faces
+from geocruncher.mesh_io.mesh_io import MeshFormat, generate_mesh, read_mesh_to_polydata, split_mesh_by_part
+from geocruncher.mesh_io.raw import read_raw
+from geocruncher.mesh_io.mesh_cache import MeshCache, select_enclosed_points
+
+
+def _loop_triangulate(faces):
+    triangles = []
+    for face in faces:
+        for i in range(1, len(face) - 1):
+            triangles.append([face[0], face[i], face[i + 1]])
+    return np.array(triangles, dtype=np.int32)
+
+
+def test_triangulate_mixed_faces_keeps_order():
+    faces = [[0, 1, 2], [3, 4, 5, 6], [7, 8, 9, 10, 11], [1, 2, 3], [4, 5, 6, 7]]
+    assert np.array_equal(triangulate_faces(faces), _loop_triangulate(faces))
+
+
+def test_triangulate_rejects_degenerate_face():
+    with pytest.raises(ValueError):
+        triangulate_faces([[0, 1, 2], [3, 4]])
+
+
+def test_split_mesh_by_part_compacts_vertices():
+    verts = np.arange(30, dtype=np.float64).reshape(10, 3)
+    faces = [[0, 1, 2, 3], [7, 8, 9], [1, 2, 3]]
+    parts = [2, 0, 2]
+
+    split = split_mesh_by_part(verts, faces, parts)
+
+    assert sorted(split.keys()) == [0, 2]
+    part_verts, part_faces = split[0]
+    assert np.array_equal(part_verts, verts[[7, 8, 9]])
+    assert np.array_equal(part_faces, [[0, 1, 2]])
+
+    part_verts, part_faces = split[2]
+    assert len(part_verts) == 4
+    # reindexed triangles must reference the same coordinates as the original ones
+    assert np.array_equal(part_verts[part_faces], verts[_loop_triangulate([[0, 1, 2, 3], [1, 2, 3]])])
+
+
+def _cube_draco(size: float) -> bytes:
+    cube = pv.Cube(x_length=size, y_length=size, z_length=size).triangulate().clean()
+    faces = cube.faces.reshape(-1, 4)[:, 1:]
+    return generate_mesh(np.asarray(cube.points), faces)
+
+
+def test_mesh_cache_reuses_decoded_mesh():
+    cache = MeshCache()
+    data = _cube_draco(2.0)
+    assert cache.get(data) is cache.get(data)
+
+
+def test_mesh_cache_evicts_over_budget():
+    small, large = _cube_draco(2.0), _cube_draco(4.0)
+    cache = MeshCache(max_bytes=MeshCache().get(small).nbytes)
+    first = cache.get(small)
+    cache.get(large)
+    assert cache.get(small) is not first
+    assert cache.size <= first.nbytes
+
+
+def test_select_enclosed_points_matches_pyvista():
+    mesh = MeshCache().get(_cube_draco(2.0))
+    points = np.random.default_rng(0).uniform(-3, 3, size=(500, 3))
+    expected = pv.PolyData(points).select_enclosed_points(mesh.polydata, tolerance=0.00001)
+    assert np.array_equal(
+        select_enclosed_points(points, mesh), expected["SelectedPoints"].astype(bool)
+    )
+
+
+def test_raw_mesh_round_trip():
+    verts = np.random.default_rng(0).uniform(0, 1000, size=(10, 3))
+    faces = [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    for mesh_format in (MeshFormat.RAW, MeshFormat.RAW_ZSTD):
+        data = generate_mesh(verts, faces, mesh_format=mesh_format)
+        read_verts, read_triangles = read_raw(data)
+        assert np.allclose(read_verts, verts.astype(np.float32))
+        assert np.array_equal(read_triangles, triangulate_faces(faces))
+        assert read_mesh_to_polydata(data).n_cells == 4
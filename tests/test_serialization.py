@@ -0,0 +1,55 @@
+import json
+
+import numpy as np
+
+from geocruncher.serialization import dumps_binary, dumps_json, is_binary, loads_binary
+
+
+def intersections():
+    return {
+        "mesh": {
+            "forCrossSections": {"1": [np.array([[0, 1], [2, 300]], dtype=np.int64)]},
+            "springs": {"1": [{"5": [1.0, 2.0]}]},
+            "matrixGwb": {"1": [[]]},
+        },
+        "fault": {"forCrossSections": {"1": [{"f1": np.array([[0.5, np.nan], [-1.0, 2.0]])}]}},
+    }
+
+
+def test_binary_round_trip_narrows_arrays():
+    result = loads_binary(dumps_binary(intersections()))
+
+    ranks = result["mesh"]["forCrossSections"]["1"][0]
+    assert ranks.dtype == np.uint16
+    assert ranks.tolist() == [[0, 1], [2, 300]]
+    assert result["mesh"]["springs"] == {"1": [{"5": [1.0, 2.0]}]}
+    assert result["mesh"]["matrixGwb"] == {"1": [[]]}
+
+    fault = result["fault"]["forCrossSections"]["1"][0]["f1"]
+    assert fault.dtype == np.float32
+    np.testing.assert_array_equal(fault, np.array([[0.5, np.nan], [-1.0, 2.0]], dtype=np.float32))
+
+
+def test_binary_arrays_are_aligned():
+    data = dumps_binary({"a": np.arange(3, dtype=np.uint8), "b": np.arange(3, dtype=np.float64)}, np.float64)
+    assert is_binary(data)
+    assert len(data) % 8 == 0
+    result = loads_binary(data)
+    assert result["b"].dtype == np.float64
+    assert result["b"].ctypes.data % 8 == result["a"].ctypes.data % 8
+    assert not is_binary(b'{"a": 1}')
+
+
+def test_json_replaces_nan_with_null():
+    result = json.loads(dumps_json(loads_binary(dumps_binary(intersections()))))
+    assert result["mesh"]["forCrossSections"]["1"] == [[[0, 1], [2, 300]]]
+    assert result["fault"]["forCrossSections"]["1"][0]["f1"] == [[0.5, None], [-1.0, 2.0]]
+
+
+def test_json_writes_array_views_and_indents():
+    grid = np.arange(6, dtype=np.int32).reshape(2, 3)
+    result = {"transposed": grid.T, "half": np.array([0.5], dtype=np.float16), "scalar": np.int64(3)}
+    expected = {"transposed": [[0, 3], [1, 4], [2, 5]], "half": [0.5], "scalar": 3}
+    assert json.loads(dumps_json(result)) == expected
+    assert json.loads(dumps_json(result, indent=True)) == expected
+    assert dumps_json({"a": 1}, indent=True) == b'{\n  "a": 1\n}'
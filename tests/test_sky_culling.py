@@ -0,0 +1,52 @@
+import numpy as np
+
+from forgeo.gmlib.topography_reader import ImplicitDTM, ImplicitHorizontalPlane
+
+from geocruncher.sky_culling import ABOVE, BELOW, NEAR, ColumnBounds, evaluate_ranks
+from geocruncher.topography_reader import topography_potential
+
+
+def test_classification_is_consistent_with_dtm():
+    rng = np.random.default_rng(0)
+    dtm = ImplicitDTM((100.0, 200.0), (10.0, 5.0), rng.uniform(0, 50, size=(8, 6)))
+    bounds = ColumnBounds(dtm)
+
+    xyz = np.column_stack([
+        rng.uniform(100, 170, 500),
+        rng.uniform(200, 225, 500),
+        rng.uniform(-20, 80, 500),
+    ])
+    classes = bounds.classify(xyz)
+    surface = dtm.evaluate_z(xyz[:, :2])
+    assert np.all(xyz[classes == ABOVE, 2] > surface[classes == ABOVE])
+    assert np.all(xyz[classes == BELOW, 2] < surface[classes == BELOW])
+    assert (classes == ABOVE).any() and (classes == BELOW).any()
+
+
+def test_points_outside_of_the_dtm_are_near():
+    dtm = ImplicitDTM((0.0, 0.0), (1.0, 1.0), np.zeros((3, 3)))
+    classes = ColumnBounds(dtm).classify(np.array([[-1.0, 1.0, 100.0], [1.0, 3.0, 100.0], [2.0, 2.0, 100.0]]))
+    assert classes.tolist() == [NEAR, NEAR, ABOVE]
+
+
+def test_evaluate_ranks_only_evaluates_points_not_above():
+    topography = ImplicitHorizontalPlane(10.0)
+    xyz = np.array([[0.0, 0.0, 20.0], [0.0, 0.0, 10.0], [0.0, 0.0, 0.0]])
+    evaluated = []
+
+    def evaluator(points):
+        evaluated.append(points)
+        return np.where(points[:, 2] > 10.0, 0, 3)
+
+    assert evaluate_ranks(evaluator, xyz, topography).tolist() == [0, 3, 3]
+    assert len(evaluated[0]) == 2
+
+
+def test_vectorized_topography_matches_dtm():
+    rng = np.random.default_rng(1)
+    dtm = ImplicitDTM((10.0, 20.0), (2.0, 3.0), rng.uniform(0, 10, size=(7, 5)))
+    # inside, outside and on the nodes of the DEM
+    xy = np.column_stack([rng.uniform(0, 30, 300), rng.uniform(10, 40, 300)])
+    xy[:20] = np.array([10.0, 20.0]) + np.array([2.0, 3.0]) * rng.integers(0, 5, size=(20, 2))
+    xyz = np.column_stack([xy, rng.uniform(0, 10, 300)])
+    np.testing.assert_allclose(topography_potential(dtm, xyz), dtm(xyz))